@@ -0,0 +1,129 @@
+"""Local stand-in for Azure Blob Storage, that serves generated files over HTTP.
+
+The real ``azure-storage-blob`` client talks to this server, so the whole download
+path (SDK pipeline, connection pool, ranged GETs) is part of the measurement.
+Blobs are named ``bench-<size>.bin``; their content is generated from the offset,
+so files of several gigabytes don't need any memory.
+"""
+
+import re
+import threading
+import time
+from email.utils import formatdate
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RE_BLOB_NAME = re.compile(r"/bench-(\d+)\.bin$")
+RE_RANGE = re.compile(r"^bytes=(\d+)-(\d*)$")
+
+PATTERN = bytes(range(256)) * 256  # 64KB
+LAST_MODIFIED = formatdate(1704067200, usegmt=True)  # 2024-01-01
+
+
+def blob_name(size: int) -> str:
+    return f"bench-{size}.bin"
+
+
+def generate(offset: int, length: int, block_size: int = len(PATTERN)):
+    """Generate the content of the blob at the given offset."""
+    end = offset + length
+    while offset < end:
+        start = offset % len(PATTERN)
+        block = PATTERN[start : start + min(block_size, end - offset)]
+        yield block
+        offset += len(block)
+
+
+class FakeBlobHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the storage account
+    disable_nagle_algorithm = True  # headers and body are written separately
+    server: "FakeBlobServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.handle_blob(send_body=False)
+
+    def do_GET(self):
+        self.handle_blob(send_body=True)
+
+    def handle_blob(self, send_body: bool):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if not (match := RE_BLOB_NAME.search(self.path.partition("?")[0])):
+            self.send_error_response(HTTPStatus.NOT_FOUND, "BlobNotFound")
+            return
+
+        size = int(match.group(1))
+        etag = f'"0x8DC{size:010X}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_error_response(HTTPStatus.NOT_MODIFIED, None, etag=etag)
+            return
+        if (if_match := self.headers.get("If-Match")) and if_match != etag:
+            self.send_error_response(HTTPStatus.PRECONDITION_FAILED, "ConditionNotMet")
+            return
+
+        start, end = 0, size - 1
+        status = HTTPStatus.OK
+        if (header := self.headers.get("x-ms-range") or self.headers.get("Range")) and (
+            range_match := RE_RANGE.match(header)
+        ):
+            start = int(range_match.group(1))
+            end = min(int(range_match.group(2) or size - 1), size - 1)
+            status = HTTPStatus.PARTIAL_CONTENT
+
+        length = max(end - start + 1, 0)
+        self.send_response(status)
+        self.send_common_headers(etag)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(length))
+        self.send_header("x-ms-blob-type", "BlockBlob")
+        if status == HTTPStatus.PARTIAL_CONTENT:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+
+        if send_body:
+            for block in generate(start, length):
+                self.wfile.write(block)
+
+    def send_common_headers(self, etag: str | None):
+        self.send_header("x-ms-request-id", "00000000-0000-0000-0000-000000000000")
+        self.send_header("x-ms-version", "2025-01-05")
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", LAST_MODIFIED)
+
+    def send_error_response(self, status: HTTPStatus, error_code: str | None, etag=None):
+        self.send_response(status)
+        self.send_common_headers(etag)
+        if error_code:
+            self.send_header("x-ms-error-code", error_code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class FakeBlobServer(ThreadingHTTPServer):
+    """The server, with a fixed latency before each response (the time to first byte)."""
+
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), FakeBlobHandler)
+        self.latency = latency
+        self._thread = None
+
+    @property
+    def account_url(self) -> str:
+        """The URL to pass as ``AZURE_STORAGE_CONTAINER_ENDPOINT``."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/benchaccount"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
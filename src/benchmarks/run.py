@@ -0,0 +1,278 @@
+"""Benchmark the download view against a local fake blob storage.
+
+Every scenario (file size x concurrency) runs in a separate forked process,
+so the peak memory of one scenario doesn't leak into the next one.
+The results are written as JSON, and can be compared against a previous run::
+
+    python -m benchmarks.run --output before.json
+    python -m benchmarks.run --compare before.json
+
+The comparison exits with status 1 when throughput or latency regressed.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import django
+
+SRC_DIR = Path(__file__).parent.parent
+UNITS = {"KB": 1024, "MB": 1024**2, "GB": 1024**3}
+
+
+def parse_size(value: str) -> int:
+    """Parse a size like ``64MB`` into bytes."""
+    value = value.strip().upper()
+    for unit, factor in UNITS.items():
+        if value.endswith(unit):
+            return int(float(value[: -len(unit)]) * factor)
+    return int(value)
+
+
+def format_size(size: int) -> str:
+    for unit, factor in reversed(UNITS.items()):
+        if size >= factor and size % factor == 0:
+            return f"{size // factor}{unit}"
+    return str(size)
+
+
+def setup_django():
+    # The test settings have the key to sign tokens, debug mode adds the debug toolbar.
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tests.settings")
+    os.environ.setdefault("DJANGO_DEBUG", "false")
+    django.setup()
+    logging.disable(logging.INFO)  # The SDK logs every request.
+
+
+def make_token() -> str:
+    """Sign a token with the test key, just like the clients of the proxy have."""
+    from django.conf import settings
+    from jwcrypto.jwk import JWK
+    from jwcrypto.jwt import JWT
+
+    key = JWK(**json.loads(settings.DATAPUNT_AUTHZ["JWKS"])["keys"][0])
+    token = JWT(
+        header={"alg": "ES256", "kid": key.kid},
+        claims={"sub": "benchmark", "scopes": ["FP/MDW"], "exp": int(time.time()) + 3600},
+    )
+    token.make_signed_token(key)
+    return token.serialize()
+
+
+def percentile(values: list[float], pct: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+
+def get_current_rss() -> int:
+    """Current resident memory in bytes (Linux only, 0 elsewhere)."""
+    try:
+        return int(Path("/proc/self/statm").read_text().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return 0
+
+
+def run_scenario(account_url: str, size: int, concurrency: int, requests: int) -> dict:
+    """Download the file ``requests`` times through the Django stack, and measure it."""
+    from django.conf import settings
+    from django.test import Client
+
+    from benchmarks.fake_blob_server import blob_name
+    from vertrouwelijke_data_proxy.files.clients import client_registry
+
+    settings.AZURE_STORAGE_CONTAINER_ENDPOINT = account_url
+    client_registry._create_credential = lambda: None  # anonymous access to the fake storage
+    headers = {"Authorization": f"Bearer {make_token()}"}
+    path = f"/{blob_name(size)}"
+    start_rss = get_current_rss()
+
+    def _download(_):
+        start = time.perf_counter()
+        response = Client().get(path, headers=headers)
+        if response.status_code != 200:
+            raise RuntimeError(f"Unexpected response {response.status_code} for {path}")
+
+        ttfb = None
+        received = 0
+        for chunk in response.streaming_content:
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+            received += len(chunk)
+        response.close()
+        if received != size:
+            raise RuntimeError(f"Received {received} bytes instead of {size}")
+        return ttfb, time.perf_counter() - start
+
+    _download(None)  # warm up the connection pool and the token cache
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        timings = list(executor.map(_download, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    ttfbs = [ttfb for ttfb, _ in timings]
+    durations = [duration for _, duration in timings]
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # KB on Linux
+    return {
+        "size": size,
+        "concurrency": concurrency,
+        "requests": requests,
+        "requests_per_s": requests / elapsed,
+        "mb_per_s": requests * size / elapsed / 1024**2,
+        "ttfb_p50_ms": percentile(ttfbs, 50) * 1000,
+        "ttfb_p90_ms": percentile(ttfbs, 90) * 1000,
+        "ttfb_p99_ms": percentile(ttfbs, 99) * 1000,
+        "duration_mean_ms": statistics.mean(durations) * 1000,
+        "peak_rss_mb": peak_rss / 1024**2,
+        "rss_growth_mb": max(peak_rss - start_rss, 0) / 1024**2,
+    }
+
+
+def _run_in_child(queue, *args):
+    try:
+        queue.put(run_scenario(*args))
+    except Exception as e:  # noqa: BLE001, report it in the parent
+        queue.put({"error": repr(e)})
+
+
+def run_isolated(*args) -> dict:
+    """Run the scenario in a forked process, so its peak memory can be measured."""
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    process = context.Process(target=_run_in_child, args=(queue, *args))
+    process.start()
+    result = queue.get()
+    process.join()
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    return result
+
+
+def get_metadata(args) -> dict:
+    """Describe the environment, so results of different runs can be compared."""
+    from django.conf import settings
+
+    try:
+        commit = subprocess.run(  # noqa: S603
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=SRC_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "latency_ms": args.latency * 1000,
+        "settings": {
+            name: getattr(settings, name)
+            for name in (
+                "AZURE_STORAGE_STREAMING",
+                "AZURE_STORAGE_CHUNK_SIZE",
+                "AZURE_STORAGE_READ_AHEAD",
+                "AZURE_STORAGE_POOL_SIZE",
+                "AZURE_STORAGE_CONCURRENCY",
+                "AZURE_STORAGE_SEGMENT_SIZE",
+            )
+        },
+    }
+
+
+def compare(baseline: dict, results: dict, threshold: float) -> list[str]:
+    """Tell which scenarios are slower than in the baseline."""
+    previous = {(r["size"], r["concurrency"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        if (old := previous.get((result["size"], result["concurrency"]))) is None:
+            continue
+
+        name = f"{format_size(result['size'])} x{result['concurrency']}"
+        if result["mb_per_s"] < old["mb_per_s"] * (1 - threshold):
+            regressions.append(
+                f"{name}: throughput {old['mb_per_s']:.1f} -> {result['mb_per_s']:.1f} MB/s"
+            )
+        if result["ttfb_p50_ms"] > old["ttfb_p50_ms"] * (1 + threshold):
+            regressions.append(
+                f"{name}: TTFB p50 {old['ttfb_p50_ms']:.1f} -> {result['ttfb_p50_ms']:.1f} ms"
+            )
+        if result["peak_rss_mb"] > old["peak_rss_mb"] * (1 + threshold):
+            regressions.append(
+                f"{name}: peak RSS {old['peak_rss_mb']:.0f} -> {result['peak_rss_mb']:.0f} MB"
+            )
+    return regressions
+
+
+def print_table(results: list[dict]):
+    print(
+        f"{'size':>8} {'conc':>5} {'req/s':>9} {'MB/s':>9} {'ttfb p50':>9}"
+        f" {'p90':>8} {'p99':>8} {'peak RSS':>9}"
+    )
+    for r in results:
+        print(
+            f"{format_size(r['size']):>8} {r['concurrency']:>5} {r['requests_per_s']:>9.1f}"
+            f" {r['mb_per_s']:>9.1f} {r['ttfb_p50_ms']:>7.1f}ms {r['ttfb_p90_ms']:>6.1f}ms"
+            f" {r['ttfb_p99_ms']:>6.1f}ms {r['peak_rss_mb']:>7.0f}MB"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1KB,1MB,64MB", help="File sizes, e.g. 1KB,1MB,1GB")
+    parser.add_argument("--concurrency", default="1,8", help="Parallel clients, e.g. 1,8,32")
+    parser.add_argument(
+        "--transfer", default="256MB", help="Bytes to download per scenario (at least 1 request)"
+    )
+    parser.add_argument("--max-requests", type=int, default=200)
+    parser.add_argument(
+        "--latency", type=float, default=0.01, help="Storage response latency in seconds"
+    )
+    parser.add_argument("--output", type=Path, help="Write the results as JSON")
+    parser.add_argument("--compare", type=Path, help="Previous JSON results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Allowed regression ratio")
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from benchmarks.fake_blob_server import FakeBlobServer
+
+    server = FakeBlobServer(latency=args.latency)
+    server.start()
+    try:
+        transfer = parse_size(args.transfer)
+        results = []
+        for size in map(parse_size, args.sizes.split(",")):
+            for concurrency in map(int, args.concurrency.split(",")):
+                requests = max(min(transfer // size, args.max_requests), concurrency)
+                results.append(run_isolated(server.account_url, size, concurrency, requests))
+    finally:
+        server.stop()
+
+    report = {"metadata": get_metadata(args), "results": results}
+    print_table(results)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+    if args.compare:
+        regressions = compare(json.loads(args.compare.read_text()), report, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
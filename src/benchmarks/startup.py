@@ -0,0 +1,102 @@
+"""Measure the startup time of the application, and which imports take the most time.
+
+The WSGI application and its views are loaded in a fresh interpreter with
+``python -X importtime``, once without and once with the warm-up that loads the storage SDK::
+
+    python -m benchmarks.startup --budget 1000
+
+The command exits with status 1 when loading the application takes longer than the budget.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+SRC_DIR = Path(__file__).parent.parent
+# The URLconf is loaded too, which otherwise happens on the first request.
+LOAD_APPLICATION = (
+    "import vertrouwelijke_data_proxy.wsgi; "
+    "from django.urls import get_resolver; get_resolver().url_patterns"
+)
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def parse_import_times(output: str) -> list[tuple[str, int, int]]:
+    """Parse the ``-X importtime`` output into (module, cumulative, depth) entries.
+    The times are in microseconds, the depth tells how deep the import is nested.
+    """
+    entries = []
+    for line in output.splitlines():
+        if match := IMPORT_TIME_LINE.match(line):
+            _, cumulative, indent, name = match.groups()
+            entries.append((name, int(cumulative), (len(indent) - 1) // 2))
+    return entries
+
+
+def profile_startup(warm_up: bool) -> dict:
+    """Load the application in a new process, and report the time it took."""
+    env = {
+        **os.environ,
+        "DJANGO_DEBUG": "false",
+        "AZURE_TOKEN_PREFETCH": "false",  # no token requests during the measurement
+        "STARTUP_WARM_UP": str(warm_up).lower(),
+    }
+    # The test settings have a key, so the application can start without a configured JWKS.
+    env.setdefault("DJANGO_SETTINGS_MODULE", "tests.settings")
+
+    start = time.perf_counter()
+    process = subprocess.run(  # noqa: S603
+        [sys.executable, "-X", "importtime", "-c", LOAD_APPLICATION],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=SRC_DIR,
+        env=env,
+    )
+    elapsed = time.perf_counter() - start
+    return {"elapsed_ms": elapsed * 1000, "imports": parse_import_times(process.stderr)}
+
+
+def get_slowest_imports(
+    imports: list[tuple[str, int, int]], depth: int, limit: int
+) -> list[tuple[str, int]]:
+    """Tell which imports up to the given nesting depth took the most time."""
+    times = {}
+    for name, cumulative, level in imports:
+        if level <= depth:
+            times[name] = max(times.get(name, 0), cumulative)
+    return sorted(times.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget", type=float, help="Maximum milliseconds to load the app")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest imports to show")
+    parser.add_argument("--depth", type=int, default=2, help="Nesting depth of imports to show")
+    args = parser.parse_args(argv)
+
+    result = profile_startup(warm_up=False)
+    warm = profile_startup(warm_up=True)
+
+    print(f"{'module':<60} {'cumulative':>10}")
+    for name, cumulative in get_slowest_imports(result["imports"], args.depth, args.top):
+        print(f"{name:<60} {cumulative / 1000:>8.1f}ms")
+    print()
+    print(f"Loading the application: {result['elapsed_ms']:.0f}ms")
+    print(f"Loading with the warm-up: {warm['elapsed_ms']:.0f}ms")
+
+    if args.budget and result["elapsed_ms"] > args.budget:
+        print(
+            f"OVER BUDGET loading took {result['elapsed_ms']:.0f}ms (budget {args.budget:.0f}ms)",
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,31 @@
 from __future__ import annotations
 
 import io
+from datetime import UTC, datetime
 from pathlib import Path
+from types import SimpleNamespace
 
 import pytest
-from azure.storage.blob import BlobClient
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    ResourceModifiedError,
+    ResourceNotFoundError,
+    ResourceNotModifiedError,
+)
+from azure.storage.blob import (
+    BlobClient,
+    BlobPrefix,
+    BlobServiceClient,
+    ContainerClient,
+    UserDelegationKey,
+)
+from azure.storage.blob.aio import BlobClient as AsyncBlobClient
 from django.core.handlers.wsgi import WSGIRequest
 from rest_framework.test import APIClient, APIRequestFactory
-from vertrouwelijke_data_proxy.files.clients import ConfidentialDataClient
+
+from vertrouwelijke_data_proxy.files.clients import ConfidentialDataClient, client_registry
+from vertrouwelijke_data_proxy.files.listing import get_listing_cache
+from vertrouwelijke_data_proxy.files.properties import get_properties_cache
 
 HERE = Path(__file__).parent
 
@@ -15,14 +33,23 @@ HERE = Path(__file__).parent
 @pytest.fixture()
 def api_request_fp_mdw() -> WSGIRequest:
 
-    def make_request(path):
-        request = APIRequestFactory().get(path)
+    def make_request(path, method="get", **extra):
+        request = getattr(APIRequestFactory(), method)(path, **extra)
         request.get_token_scopes = ["FP/MDW"]
         return request
 
     return make_request
 
 
+@pytest.fixture()
+def properties_cache(settings):
+    """Enable the properties cache, which the test settings turn off."""
+    settings.PROPERTIES_CACHE_TTL = 30
+    get_properties_cache.cache_clear()
+    yield get_properties_cache()
+    get_properties_cache.cache_clear()
+
+
 @pytest.fixture()
 def patch_vdclient(monkeypatch):
     def get_stream(*args, **kwargs):
@@ -33,10 +60,160 @@ def patch_vdclient(monkeypatch):
 
 @pytest.fixture()
 def patch_azure_blob_doesnt_exist(monkeypatch):
-    def nope(_self):
-        return False
+    def nope(_self, *args, **kwargs):
+        raise ResourceNotFoundError("The specified blob does not exist.")
+
+    monkeypatch.setattr(BlobClient, "get_blob_properties", nope)
+    monkeypatch.setattr(BlobClient, "download_blob", nope)
+
+
+class FakeStorageStreamDownloader:
+    """Stand-in for the ``StorageStreamDownloader`` that ``download_blob()`` returns."""
+
+    def __init__(self, data: bytes, properties, offset=None, length=None, chunk_size: int = 4):
+        offset = offset or 0
+        self.data = data[offset : offset + length if length is not None else None]
+        self.size = len(self.data)
+        self.properties = properties
+        self.chunk_size = chunk_size
+
+    def chunks(self):
+        for start in range(0, self.size, self.chunk_size):
+            yield self.data[start : start + self.chunk_size]
+
+    def readall(self):
+        return self.data
+
+    def readinto(self, stream):
+        stream.write(self.data)
+        return self.size
+
+
+FAKE_BLOB_DATA = b"0123456789abcdef"
+FAKE_BLOB_PROPERTIES = SimpleNamespace(
+    size=len(FAKE_BLOB_DATA),
+    etag='"0x8DC0000000000"',
+    last_modified=datetime(2024, 1, 1, tzinfo=UTC),
+)
+
+
+@pytest.fixture()
+def patch_azure_blob_download(monkeypatch):
+    """Let the blob exist, and return some chunked content."""
+    data = FAKE_BLOB_DATA
+    properties = FAKE_BLOB_PROPERTIES
+
+    def download_blob(_self, offset=None, length=None, etag=None, match_condition=None, **kwargs):
+        if match_condition == MatchConditions.IfModified and etag == properties.etag:
+            raise ResourceNotModifiedError(
+                response=SimpleNamespace(
+                    status_code=304, reason="Not Modified", headers={"ETag": etag}, text=str
+                )
+            )
+        elif match_condition == MatchConditions.IfNotModified and etag != properties.etag:
+            raise ResourceModifiedError(
+                "The condition specified using HTTP conditional header(s) is not met."
+            )
+        return FakeStorageStreamDownloader(data, properties, offset, length)
+
+    monkeypatch.setattr(BlobClient, "get_blob_properties", lambda _self, **kwargs: properties)
+    monkeypatch.setattr(BlobClient, "download_blob", download_blob)
+    return data
+
+
+class FakeAsyncStorageStreamDownloader(FakeStorageStreamDownloader):
+    """Stand-in for the downloader of ``azure.storage.blob.aio``."""
+
+    async def chunks(self):
+        for chunk in super().chunks():
+            yield chunk
+
+
+@pytest.fixture()
+def patch_azure_async_blob_download(monkeypatch):
+    """Same as ``patch_azure_blob_download``, for the async client."""
+    data = FAKE_BLOB_DATA
+    properties = FAKE_BLOB_PROPERTIES
+
+    async def download_blob(_self, offset=None, length=None, **kwargs):
+        return FakeAsyncStorageStreamDownloader(data, properties, offset, length)
+
+    async def get_blob_properties(_self, **kwargs):
+        return properties
+
+    monkeypatch.setattr(AsyncBlobClient, "get_blob_properties", get_blob_properties)
+    monkeypatch.setattr(AsyncBlobClient, "download_blob", download_blob)
+    return data
+
+
+class FakeBlobPages:
+    """Stand-in for the page iterator of ``walk_blobs().by_page()``."""
+
+    def __init__(self, pages: list[list], start: int):
+        self.pages = pages
+        self.index = start
+        self.continuation_token = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.index >= len(self.pages):
+            raise StopIteration
+        page = self.pages[self.index]
+        self.index += 1
+        self.continuation_token = str(self.index) if self.index < len(self.pages) else None
+        return iter(page)
+
+
+@pytest.fixture()
+def patch_azure_blob_listing(monkeypatch):
+    """Let the container contain a folder with a subfolder and files.
+    The files are returned in pages of two items, the number of calls is counted.
+    """
+    items = [
+        BlobPrefix(None, prefix="dir/sub/"),
+        SimpleNamespace(name="dir/a.csv", **vars(FAKE_BLOB_PROPERTIES)),
+        SimpleNamespace(name="dir/b.csv", **vars(FAKE_BLOB_PROPERTIES)),
+    ]
+    calls = []
+
+    def walk_blobs(_self, name_starts_with=None, results_per_page=None, **kwargs):
+        found = [item for item in items if item.name.startswith(name_starts_with)]
+        pages = [found[i : i + 2] for i in range(0, len(found), 2)] or [[]]
+
+        def by_page(continuation_token=None):
+            calls.append((name_starts_with, continuation_token))
+            return FakeBlobPages(pages, start=int(continuation_token or 0))
+
+        return SimpleNamespace(by_page=by_page)
+
+    monkeypatch.setattr(ContainerClient, "walk_blobs", walk_blobs)
+    get_listing_cache.cache_clear()
+    yield calls
+    get_listing_cache.cache_clear()
+
+
+@pytest.fixture()
+def patch_azure_delegation_key(monkeypatch):
+    """Let the storage account hand out a user delegation key, the calls are counted."""
+    calls = []
+
+    def get_user_delegation_key(_self, key_start_time, key_expiry_time, **kwargs):
+        calls.append((key_start_time, key_expiry_time))
+        key = UserDelegationKey()
+        key.signed_oid = "00000000-0000-0000-0000-000000000000"
+        key.signed_tid = "00000000-0000-0000-0000-000000000001"
+        key.signed_start = key_start_time.strftime("%Y-%m-%dT%H:%M:%SZ")
+        key.signed_expiry = key_expiry_time.strftime("%Y-%m-%dT%H:%M:%SZ")
+        key.signed_service = "b"
+        key.signed_version = "2025-01-05"
+        key.value = "ZmFrZS1kZWxlZ2F0aW9uLWtleQ=="
+        return key
 
-    monkeypatch.setattr(BlobClient, "exists", nope)
+    monkeypatch.setattr(BlobServiceClient, "get_user_delegation_key", get_user_delegation_key)
+    monkeypatch.setattr(client_registry, "_key_caches", {})
+    return calls
 
 
 @pytest.fixture()
@@ -53,3 +53,6 @@ STORAGES = {
 # Use different default:
 AZURE_STORAGE_CONTAINER_ENDPOINT = "https://test.confidential-storage"
 DSO_API_BASE_URL = "https://dso.api"
+
+# Tests that reuse a file name shouldn't see each other's cached properties.
+PROPERTIES_CACHE_TTL = 0
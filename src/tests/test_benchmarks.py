@@ -0,0 +1,94 @@
+import pytest
+
+from benchmarks.fake_blob_server import FakeBlobServer, blob_name, generate
+from benchmarks.run import compare, parse_size, run_isolated
+from benchmarks.startup import get_slowest_imports, parse_import_times, profile_startup
+from vertrouwelijke_data_proxy.files.clients import (
+    BlobNotModified,
+    ConfidentialDataClient,
+    client_registry,
+)
+
+
+@pytest.fixture()
+def fake_blob_server(monkeypatch):
+    server = FakeBlobServer()
+    server.start()
+    monkeypatch.setattr(client_registry, "_create_credential", lambda: None)
+    monkeypatch.setattr(client_registry, "_clients", {})
+    yield server
+    server.stop()
+
+
+class TestFakeBlobServer:
+    """The fake server also proves the client works with the real SDK responses."""
+
+    def test_download(self, fake_blob_server):
+        client = ConfidentialDataClient(fake_blob_server.account_url, chunk_size=1000)
+        stream = client.download(client.get_blob_client_for(blob_name(2500)))
+        assert stream.read() == b"".join(generate(0, 2500))
+
+    def test_not_modified(self, fake_blob_server):
+        client = ConfidentialDataClient(fake_blob_server.account_url)
+        blob_client = client.get_blob_client_for(blob_name(100))
+        etag = client.get_properties(blob_client).etag
+        with pytest.raises(BlobNotModified):
+            client.download(blob_client, if_none_match=etag)
+
+    def test_not_found(self, fake_blob_server):
+        client = ConfidentialDataClient(fake_blob_server.account_url)
+        with pytest.raises(FileNotFoundError):
+            client.download(client.get_blob_client_for("unknown.csv"))
+
+
+class TestBenchmark:
+    def test_run_scenario(self, fake_blob_server):
+        result = run_isolated(fake_blob_server.account_url, parse_size("1KB"), 2, 4)
+        assert result["requests"] == 4
+        assert result["mb_per_s"] > 0
+        assert result["peak_rss_mb"] > 0
+
+    def test_compare(self):
+        baseline = {
+            "results": [
+                {
+                    "size": 1024,
+                    "concurrency": 1,
+                    "mb_per_s": 10,
+                    "ttfb_p50_ms": 5,
+                    "peak_rss_mb": 100,
+                }
+            ]
+        }
+        same = {"results": baseline["results"]}
+        slower = {"results": [{**baseline["results"][0], "mb_per_s": 5}]}
+        assert compare(baseline, same, threshold=0.1) == []
+        assert compare(baseline, slower, threshold=0.1) == ["1KB x1: throughput 10.0 -> 5.0 MB/s"]
+
+
+class TestStartup:
+    def test_parse_import_times(self):
+        output = (
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       100 |        100 |     azure.core\n"
+            "import time:       200 |        300 |   azure.storage.blob\n"
+            "import time:        50 |        350 | vertrouwelijke_data_proxy.files.clients\n"
+        )
+        imports = parse_import_times(output)
+        assert imports == [
+            ("azure.core", 100, 2),
+            ("azure.storage.blob", 300, 1),
+            ("vertrouwelijke_data_proxy.files.clients", 350, 0),
+        ]
+        assert get_slowest_imports(imports, depth=1, limit=1) == [
+            ("vertrouwelijke_data_proxy.files.clients", 350)
+        ]
+
+    def test_storage_sdk_is_deferred(self):
+        """The views can be loaded without the storage SDK, the warm-up loads it."""
+        cold = [name for name, _, _ in profile_startup(warm_up=False)["imports"]]
+        assert "vertrouwelijke_data_proxy.files.views" in cold
+        assert not any(name.startswith("azure.storage.blob") for name in cold)
+
+        warm = [name for name, _, _ in profile_startup(warm_up=True)["imports"]]
+        assert any(name.startswith("azure.storage.blob") for name in warm)
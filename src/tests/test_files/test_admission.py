@@ -0,0 +1,203 @@
+import runpy
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+
+from vertrouwelijke_data_proxy import settings as project_settings
+from vertrouwelijke_data_proxy.files import admission
+from vertrouwelijke_data_proxy.files.admission import Admission, ByteRateLimiter
+from vertrouwelijke_data_proxy.files.views import (
+    AsyncProxyConfidentialDataView,
+    ProxyConfidentialDataView,
+)
+
+
+@pytest.fixture()
+def admission_cache(settings):
+    """The test settings have a dummy cache, which doesn't keep anything."""
+    settings.CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "admission-tests",
+        }
+    }
+    yield
+    cache.clear()
+
+
+class TestAdmission:
+    def test_per_user(self, settings, admission_cache):
+        settings.DOWNLOAD_MAX_CONCURRENT_PER_USER = 2
+        first, second, third = Admission("user1"), Admission("user1"), Admission("user1")
+        assert first.acquire()
+        assert second.acquire()
+        assert not third.acquire()
+        assert Admission("user2").acquire()
+
+        first.release()
+        assert third.acquire()
+
+    def test_global(self, settings, admission_cache):
+        """A full global limit doesn't hold on to the slot of the user"""
+        settings.DOWNLOAD_MAX_CONCURRENT = 1
+        settings.DOWNLOAD_MAX_CONCURRENT_PER_USER = 1
+        assert Admission("user1").acquire()
+        denied = Admission("user2")
+        assert not denied.acquire()
+        assert denied.slots == []
+
+    def test_crashed_worker(self, monkeypatch, settings, admission_cache):
+        """The slots that are never released are free again after their window"""
+        settings.DOWNLOAD_MAX_CONCURRENT = 1
+        now = [1000.0 * settings.DOWNLOAD_SLOT_TIMEOUT]
+        monkeypatch.setattr(admission.time, "time", lambda: now[0])
+        assert Admission("user1").acquire()  # never released
+        assert not Admission("user2").acquire()
+
+        now[0] += settings.DOWNLOAD_SLOT_TIMEOUT
+        assert not Admission("user2").acquire()
+        now[0] += settings.DOWNLOAD_SLOT_TIMEOUT
+        assert Admission("user2").acquire()
+
+    def test_renewed(self, monkeypatch, settings, admission_cache):
+        """A streaming download keeps its slot in the next windows"""
+        settings.DOWNLOAD_MAX_CONCURRENT = 1
+        now = [1000.0 * settings.DOWNLOAD_SLOT_TIMEOUT]
+        monkeypatch.setattr(admission.time, "time", lambda: now[0])
+        streaming = Admission("user1")
+        assert streaming.acquire()
+        assert not streaming.needs_renewal()
+
+        for _ in range(3):
+            now[0] += settings.DOWNLOAD_SLOT_TIMEOUT
+            assert streaming.needs_renewal()
+            streaming.renew()
+            assert not Admission("user2").acquire()
+
+        streaming.release()
+        assert Admission("user2").acquire()
+
+    def test_unlimited(self, admission_cache):
+        admission = Admission("user1")
+        assert admission.acquire()
+        assert admission.slots == []
+
+
+class TestByteRateLimiter:
+    def test_rate(self, admission_cache):
+        limiter = ByteRateLimiter("user1", rate=1000)
+        assert limiter.consume(600) == 0
+        delay = limiter.consume(600)
+        assert 0.2 <= delay <= 1.2
+        assert ByteRateLimiter("user2", rate=1000).consume(600) == 0
+
+    def test_shared(self, monkeypatch, admission_cache):
+        """The bytes of all workers count, small chunks are added to the count in batches"""
+        monkeypatch.setattr(admission.time, "time", lambda: 1000.5)
+        ByteRateLimiter("user1", rate=1000).consume(900)
+        limiter = ByteRateLimiter("user1", rate=1000)
+        incr = cache.incr
+        calls = []
+        monkeypatch.setattr(cache, "incr", lambda *args: calls.append(args) or incr(*args))
+
+        assert limiter.consume(10) == 0  # the first chunk reads the shared count
+        for _ in range(9):
+            assert limiter.consume(10) == 0
+        assert len(calls) == 1
+        assert limiter.consume(10) == pytest.approx(0.5 + 0.01)
+        assert len(calls) == 2
+        assert cache.get("download-bytes:user1:1000") == 1010
+
+
+def test_shared_cache_required(monkeypatch):
+    """Limits that are kept in the memory of each worker would multiply"""
+    monkeypatch.setenv("DOWNLOAD_MAX_CONCURRENT", "10")
+    monkeypatch.setenv("CACHE_URL", "locmemcache://")
+    with pytest.raises(ImproperlyConfigured):
+        runpy.run_path(project_settings.__file__)
+
+    monkeypatch.setenv("CACHE_URL", "redis://redis:6379/0")
+    assert runpy.run_path(project_settings.__file__)["DOWNLOAD_MAX_CONCURRENT"] == 10
+
+
+class TestAdmissionViews:
+    def test_429(self, settings, admission_cache, patch_azure_blob_download, api_request_fp_mdw):
+        """The slot is held until the response is sent"""
+        settings.DOWNLOAD_MAX_CONCURRENT_PER_USER = 1
+        first = ProxyConfidentialDataView.as_view()(api_request_fp_mdw("/file.csv"))
+        assert first.status_code == 200
+
+        second = ProxyConfidentialDataView.as_view()(api_request_fp_mdw("/file.csv"))
+        assert second.status_code == 429
+        assert second["Retry-After"] == "10"
+
+        b"".join(first.streaming_content)
+        first.close()
+        third = ProxyConfidentialDataView.as_view()(api_request_fp_mdw("/file.csv"))
+        assert third.status_code == 200
+
+    def test_head(self, settings, admission_cache, patch_azure_blob_download, api_request_fp_mdw):
+        """Probing the size doesn't need a download slot"""
+        settings.DOWNLOAD_MAX_CONCURRENT_PER_USER = 1
+        first = ProxyConfidentialDataView.as_view()(api_request_fp_mdw("/file.csv"))
+        head = ProxyConfidentialDataView.as_view()(api_request_fp_mdw("/file.csv", method="head"))
+        assert head.status_code == 200
+        first.close()
+
+    def test_not_found_releases(
+        self, settings, admission_cache, patch_azure_blob_doesnt_exist, api_request_fp_mdw
+    ):
+        settings.DOWNLOAD_MAX_CONCURRENT = 1
+        request = api_request_fp_mdw("/unknown.csv")
+        assert ProxyConfidentialDataView.as_view()(request).status_code == 404
+        assert ProxyConfidentialDataView.as_view()(request).status_code == 404
+
+    def test_rate_limit(
+        self, monkeypatch, settings, admission_cache, patch_azure_blob_download, api_request_fp_mdw
+    ):
+        sleeps = []
+        monkeypatch.setattr("time.sleep", sleeps.append)
+        settings.DOWNLOAD_USER_RATE = 4
+        response = ProxyConfidentialDataView.as_view()(api_request_fp_mdw("/file.csv"))
+        assert b"".join(response.streaming_content) == patch_azure_blob_download
+        assert sleeps
+
+    def test_sendfile(
+        self, settings, admission_cache, patch_azure_blob_download, api_request_fp_mdw
+    ):
+        """The file of the response is kept, and the slot is released when it's closed"""
+        settings.AZURE_STORAGE_STREAMING = False
+        settings.AZURE_STORAGE_SPOOL_THRESHOLD = 1
+        settings.DOWNLOAD_MAX_CONCURRENT = 1
+        first = ProxyConfidentialDataView.as_view()(api_request_fp_mdw("/file.csv"))
+        assert first.file_to_stream.fileno()
+        assert (
+            ProxyConfidentialDataView.as_view()(api_request_fp_mdw("/file.csv")).status_code == 429
+        )
+
+        first.close()
+        assert (
+            ProxyConfidentialDataView.as_view()(api_request_fp_mdw("/file.csv")).status_code == 200
+        )
+
+    def test_async_429(
+        self, settings, admission_cache, patch_azure_async_blob_download, api_request_fp_mdw
+    ):
+        settings.DOWNLOAD_MAX_CONCURRENT = 1
+        view = AsyncProxyConfidentialDataView().get
+        first = async_to_sync(view)(api_request_fp_mdw("/file.csv"))
+        assert first.status_code == 200
+
+        second = async_to_sync(AsyncProxyConfidentialDataView().get)(
+            api_request_fp_mdw("/file.csv")
+        )
+        assert second.status_code == 429
+        assert second["Retry-After"] == "10"
+
+        first.close()
+        third = async_to_sync(AsyncProxyConfidentialDataView().get)(
+            api_request_fp_mdw("/file.csv")
+        )
+        assert third.status_code == 200
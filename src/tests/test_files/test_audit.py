@@ -0,0 +1,55 @@
+import logging
+
+from asgiref.sync import async_to_sync
+
+from vertrouwelijke_data_proxy.files.views import (
+    AsyncProxyConfidentialDataView,
+    ProxyConfidentialDataView,
+)
+
+
+def get_audit_records(caplog) -> list[logging.LogRecord]:
+    return [r for r in caplog.records if r.name == "vertrouwelijke_data_proxy.audit"]
+
+
+class TestAuditRecords:
+    def test_download(self, caplog, patch_azure_blob_download, api_request_fp_mdw):
+        request = api_request_fp_mdw("/file.csv")
+        request.get_token_subject = "user@example.com"
+        response = ProxyConfidentialDataView.as_view()(request)
+        assert not get_audit_records(caplog)
+
+        b"".join(response.streaming_content)
+        response.close()
+        [record] = get_audit_records(caplog)
+        assert record.event == "download"
+        assert record.subject == "user@example.com"
+        assert record.path == "/file.csv"
+        assert record.bytes == record.size == len(patch_azure_blob_download)
+        assert record.complete
+
+    def test_aborted(self, caplog, patch_azure_blob_download, api_request_fp_mdw):
+        """A client that disconnects is logged with the bytes it received"""
+        response = ProxyConfidentialDataView.as_view()(api_request_fp_mdw("/file.csv"))
+        next(iter(response.streaming_content))
+        response.close()
+        [record] = get_audit_records(caplog)
+        assert record.bytes < record.size
+        assert not record.complete
+
+    def test_not_found(self, caplog, patch_azure_blob_doesnt_exist, api_request_fp_mdw):
+        response = ProxyConfidentialDataView.as_view()(api_request_fp_mdw("/unknown.csv"))
+        assert response.status_code == 404
+        assert not get_audit_records(caplog)
+
+    def test_async_download(self, caplog, patch_azure_async_blob_download, api_request_fp_mdw):
+        response = async_to_sync(AsyncProxyConfidentialDataView().get)(
+            api_request_fp_mdw("/file.csv")
+        )
+
+        async def _read():
+            return b"".join([chunk async for chunk in response.streaming_content])
+
+        assert async_to_sync(_read)() == patch_azure_async_blob_download
+        [record] = get_audit_records(caplog)
+        assert record.complete
@@ -0,0 +1,32 @@
+import io
+import zipfile
+
+from tests.conftest import FAKE_BLOB_DATA, FAKE_BLOB_PROPERTIES
+from vertrouwelijke_data_proxy.files.bundles import stream_zip
+
+
+def _open(data: bytes):
+    stream = io.BytesIO(data)
+    stream.properties = FAKE_BLOB_PROPERTIES
+    return stream
+
+
+class TestStreamZip:
+    def test_archive(self):
+        files = [("dir/a.csv", _open(FAKE_BLOB_DATA)), ("dir/b.zip", _open(FAKE_BLOB_DATA))]
+        parts = list(stream_zip(files, chunk_size=4))
+        assert len(parts) > 2  # streamed, not generated at once
+
+        with zipfile.ZipFile(io.BytesIO(b"".join(parts))) as archive:
+            assert archive.testzip() is None
+            assert archive.read("dir/a.csv") == FAKE_BLOB_DATA
+            assert archive.read("dir/b.zip") == FAKE_BLOB_DATA
+            assert archive.getinfo("dir/a.csv").compress_type == zipfile.ZIP_DEFLATED
+            # Already compressed files are stored as-is
+            assert archive.getinfo("dir/b.zip").compress_type == zipfile.ZIP_STORED
+            assert archive.getinfo("dir/a.csv").date_time == (2024, 1, 1, 0, 0, 0)
+
+    def test_files_closed(self):
+        files = [("a.csv", _open(b"abc")), ("b.csv", _open(b"def"))]
+        list(stream_zip(iter(files), chunk_size=4))
+        assert all(stream.closed for _, stream in files)
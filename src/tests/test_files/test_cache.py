@@ -0,0 +1,54 @@
+import os
+
+from vertrouwelijke_data_proxy.files.cache import BlobCache
+from vertrouwelijke_data_proxy.files.clients import ConfidentialDataClient
+
+
+class TestBlobCache:
+    def test_store_and_open(self, tmp_path):
+        cache = BlobCache(tmp_path, max_size=100)
+        assert cache.open("container/file.csv", '"1"') is None
+
+        assert list(cache.store("container/file.csv", '"1"', [b"abc", b"def"])) == [b"abc", b"def"]
+        with cache.open("container/file.csv", '"1"') as file:
+            assert file.read() == b"abcdef"
+
+        # Another ETag is a different version
+        assert cache.open("container/file.csv", '"2"') is None
+        assert cache.stats == {"hits": 1, "misses": 2, "evictions": 0}
+
+    def test_partial_download_not_stored(self, tmp_path):
+        cache = BlobCache(tmp_path, max_size=100)
+        chunks = cache.store("container/file.csv", '"1"', [b"abc", b"def"])
+        assert next(chunks) == b"abc"
+        chunks.close()  # client disconnected
+        assert cache.open("container/file.csv", '"1"') is None
+        assert list(tmp_path.iterdir()) == []
+
+    def test_lru_eviction(self, tmp_path):
+        cache = BlobCache(tmp_path, max_size=10)
+        list(cache.store("a", '"1"', [b"aaaa"]))
+        list(cache.store("b", '"1"', [b"bbbb"]))
+        os.utime(cache.get_path("a", '"1"'), (1, 1))
+        os.utime(cache.get_path("b", '"1"'), (2, 2))
+        cache.open("a", '"1"').close()  # used recently, so "b" is evicted first.
+        list(cache.store("c", '"1"', [b"cccc"]))
+
+        assert cache.open("b", '"1"') is None
+        assert cache.open("a", '"1"') is not None
+        assert cache.stats["evictions"] == 1
+
+
+class TestCachedClient:
+    def test_download_cached(self, tmp_path, patch_azure_blob_download, api_request_fp_mdw):
+        cache = BlobCache(tmp_path, max_size=100)
+        client = ConfidentialDataClient(base_url="https://test.confidential-storage", cache=cache)
+        request = api_request_fp_mdw("/file.csv")
+
+        with client.call(request) as stream:
+            assert stream.read() == patch_azure_blob_download
+        with client.call(request) as stream:
+            assert stream.read() == patch_azure_blob_download
+            assert stream.properties.etag == '"0x8DC0000000000"'
+
+        assert cache.stats == {"hits": 1, "misses": 1, "evictions": 0}
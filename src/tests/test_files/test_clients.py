@@ -0,0 +1,70 @@
+import io
+import os
+
+from azure.storage.blob import BlobClient
+
+from vertrouwelijke_data_proxy.files.clients import (
+    ClientRegistry,
+    ConfidentialDataClient,
+    segmented_download,
+)
+
+
+class TestClientRegistry:
+    def test_clients_are_shared(self):
+        """Each request reuses the same BlobServiceClient and credential."""
+        client1 = ConfidentialDataClient(base_url="https://test.confidential-storage")
+        client2 = ConfidentialDataClient(base_url="https://test.confidential-storage")
+        assert client1.blob_service_client is client2.blob_service_client
+
+    def test_reset_after_fork(self, monkeypatch):
+        registry = ClientRegistry()
+        client = registry.get_blob_service_client("https://test.storage", chunk_size=1024)
+        credential = registry.get_credential()
+
+        # A forked worker has another pid, uWSGI doesn't run the fork hooks.
+        monkeypatch.setattr(os, "getpid", lambda: registry._pid + 1)
+        assert (
+            registry.get_blob_service_client("https://test.storage", chunk_size=1024) is not client
+        )
+        assert registry.get_credential() is not credential
+
+
+class TestSegmentedDownload:
+    def test_segments_in_order(self, patch_azure_blob_download):
+        blob_client = BlobClient("https://test.storage", "container", "file.csv")
+        segments = segmented_download(
+            blob_client,
+            offset=2,
+            length=13,
+            etag='"0x8DC0000000000"',
+            segment_size=4,
+            concurrency=2,
+        )
+        assert list(segments) == [b"2345", b"6789", b"abcd", b"e"]
+
+    def test_client_download(self, patch_azure_blob_download, api_request_fp_mdw):
+        client = ConfidentialDataClient(
+            base_url="https://test.confidential-storage", concurrency=3, segment_size=2
+        )
+        request = api_request_fp_mdw("/file.csv")
+        with client.call(request) as stream:
+            assert stream.read() == patch_azure_blob_download
+
+
+def test_spooled_download(tmp_path, patch_azure_blob_download, api_request_fp_mdw):
+    """Without streaming, a large blob is buffered in a temporary file"""
+    client = ConfidentialDataClient(
+        base_url="https://test.confidential-storage",
+        streaming=False,
+        spool_threshold=8,
+        spool_dir=tmp_path,
+    )
+    with client.call(api_request_fp_mdw("/file.csv")) as stream:
+        assert stream.fileno() > 0
+        assert stream.read() == patch_azure_blob_download
+        assert list(tmp_path.iterdir()) == []  # anonymous file
+
+    client.spool_threshold = 100
+    with client.call(api_request_fp_mdw("/file.csv")) as stream:
+        assert isinstance(stream, io.BytesIO)
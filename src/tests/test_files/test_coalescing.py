@@ -0,0 +1,210 @@
+import os
+import threading
+from datetime import UTC, datetime
+from types import SimpleNamespace
+
+import pytest
+from azure.core.exceptions import ResourceModifiedError
+
+from vertrouwelijke_data_proxy.files.cache import BlobCache
+from vertrouwelijke_data_proxy.files.clients import BlobNotModified, ConfidentialDataClient
+from vertrouwelijke_data_proxy.files.coalescing import DownloadCoalescer
+from vertrouwelijke_data_proxy.files.streams import ChunkedStream
+
+PROPERTIES = SimpleNamespace(etag='"0x1"', last_modified=datetime(2024, 1, 1, tzinfo=UTC))
+
+
+class FakeDownload:
+    """A download of which the chunks arrive when the test allows it."""
+
+    def __init__(self, chunks: list[bytes], properties=PROPERTIES):
+        self.chunks = chunks
+        self.properties = properties
+        self.calls = 0
+        self.proceed = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+
+        def _chunks():
+            yield self.chunks[0]
+            self.proceed.wait(timeout=5)
+            yield from self.chunks[1:]
+
+        stream = ChunkedStream(_chunks(), size=sum(map(len, self.chunks)))
+        stream.properties = self.properties
+        return stream
+
+
+class TestDownloadCoalescer:
+    def test_shared(self, tmp_path):
+        """A concurrent request attaches to the download in progress"""
+        coalescer = DownloadCoalescer(tmp_path, chunk_size=4)
+        download = FakeDownload([b"0123", b"4567", b"89"])
+        first = coalescer.open("blob", download)
+        assert first.read(4) == b"0123"
+
+        second = coalescer.open("blob", download)
+        assert second.size == 10
+        assert second.properties is PROPERTIES
+        download.proceed.set()
+        assert second.read() == b"0123456789"
+        assert first.read() == b"456789"
+        assert download.calls == 1
+
+        first.close()
+        second.close()
+        assert list(tmp_path.iterdir()) == []  # anonymous spool file
+
+    def test_completed(self, tmp_path):
+        """Once the download is complete, a new request downloads the blob again"""
+        coalescer = DownloadCoalescer(tmp_path, chunk_size=4)
+        download = FakeDownload([b"0123", b"45"])
+        download.proceed.set()
+        with coalescer.open("blob", download) as reader:
+            assert reader.read() == b"012345"
+
+        with coalescer.open("blob", download) as reader:
+            assert reader.read() == b"012345"
+        assert download.calls == 2
+
+    def test_reset_after_fork(self, tmp_path, monkeypatch):
+        """A forked worker (another pid) doesn't attach to the downloads of its parent"""
+        coalescer = DownloadCoalescer(tmp_path, chunk_size=4)
+        download = FakeDownload([b"0123", b"45"])
+        first = coalescer.open("blob", download)
+        monkeypatch.setattr(os, "getpid", lambda: coalescer._pid + 1)
+        download.proceed.set()
+        with coalescer.open("blob", download) as second:
+            assert second.read() == b"012345"
+        assert download.calls == 2
+        first.close()
+
+    def test_failed_start(self, tmp_path):
+        coalescer = DownloadCoalescer(tmp_path)
+
+        def _not_found():
+            raise FileNotFoundError()
+
+        with pytest.raises(FileNotFoundError):
+            coalescer.open("blob", _not_found)
+        assert coalescer._flights == {}
+
+    def test_failed_halfway(self, tmp_path):
+        """Readers receive the error when they reach the missing part"""
+
+        def _download():
+            def _chunks():
+                yield b"0123"
+                raise OSError("connection reset")
+
+            return ChunkedStream(_chunks(), size=8)
+
+        coalescer = DownloadCoalescer(tmp_path, chunk_size=4)
+        reader = coalescer.open("blob", _download)
+        assert reader.read(4) == b"0123"
+        with pytest.raises(OSError, match="connection reset"):
+            reader.read(4)
+
+
+def test_client_conditions(tmp_path, monkeypatch):
+    """A request that attaches to a download, checks its conditions locally"""
+    client = ConfidentialDataClient(
+        "https://test.confidential-storage", coalescer=DownloadCoalescer(tmp_path, chunk_size=4)
+    )
+    download = FakeDownload([b"0123", b"45"])
+    monkeypatch.setattr(client, "get_properties", lambda blob_client, **kwargs: PROPERTIES)
+    monkeypatch.setattr(client, "download", lambda blob_client, **kwargs: download())
+    blob_client = client.get_blob_client_for("file.csv")
+
+    first = client.open(blob_client)
+    with pytest.raises(BlobNotModified):
+        client.open(blob_client, if_none_match='"0x1"')
+    download.proceed.set()
+    assert first.read() == b"012345"
+    assert download.calls == 1
+
+
+class TestClientVersions:
+    """Requests only share the download of the same version of the blob"""
+
+    NEW_PROPERTIES = SimpleNamespace(etag='"0x2"', last_modified=datetime(2024, 1, 2, tzinfo=UTC))
+
+    @pytest.fixture()
+    def client(self, tmp_path, monkeypatch):
+        client = ConfidentialDataClient(
+            "https://test.confidential-storage",
+            coalescer=DownloadCoalescer(tmp_path, chunk_size=4),
+        )
+        client.current = PROPERTIES
+        client.downloads = {
+            PROPERTIES.etag: FakeDownload([b"0123", b"45"]),
+            self.NEW_PROPERTIES.etag: FakeDownload([b"abcd", b"ef"], self.NEW_PROPERTIES),
+        }
+        for download in client.downloads.values():
+            download.proceed.set()
+
+        def download(blob_client, if_match=None, **kwargs):
+            if if_match != client.current.etag:
+                raise ResourceModifiedError("The condition specified is not met.")
+            return client.downloads[if_match]()
+
+        monkeypatch.setattr(client, "download", download)
+        return client
+
+    def test_overwritten_during_download(self, client, monkeypatch):
+        """A request after the blob was replaced doesn't attach to the old download"""
+        monkeypatch.setattr(client, "get_properties", lambda blob_client, **kw: client.current)
+        blob_client = client.get_blob_client_for("file.csv")
+        client.downloads[PROPERTIES.etag].proceed.clear()
+
+        with client.open(blob_client) as first:
+            assert first.read(4) == b"0123"
+            client.current = self.NEW_PROPERTIES
+            with client.open(blob_client) as second:
+                assert second.read() == b"abcdef"
+                assert second.properties is self.NEW_PROPERTIES
+            client.downloads[PROPERTIES.etag].proceed.set()
+            assert first.read() == b"45"
+
+    def test_outdated_properties(self, client, monkeypatch):
+        """When the cached ETag is outdated, the current version is downloaded"""
+        cached = [PROPERTIES]
+
+        def get_properties(blob_client, refresh=False):
+            if refresh:
+                cached[0] = client.current
+            return cached[0]
+
+        monkeypatch.setattr(client, "get_properties", get_properties)
+        client.current = self.NEW_PROPERTIES
+        with client.open(client.get_blob_client_for("file.csv")) as reader:
+            assert reader.read() == b"abcdef"
+        assert client.downloads[PROPERTIES.etag].calls == 0
+
+
+def test_client_cache_misses_shared(tmp_path, monkeypatch):
+    """With the disk cache enabled, concurrent cache misses still share the download"""
+    client = ConfidentialDataClient(
+        "https://test.confidential-storage",
+        cache=BlobCache(tmp_path / "cache", max_size=1024),
+        coalescer=DownloadCoalescer(tmp_path, chunk_size=4),
+    )
+    download = FakeDownload([b"0123", b"45"])
+    calls = []
+
+    def fake_download(blob_client, **kwargs):
+        calls.append(kwargs)
+        return download()
+
+    monkeypatch.setattr(client, "get_properties", lambda blob_client, **kwargs: PROPERTIES)
+    monkeypatch.setattr(client, "download", fake_download)
+    blob_client = client.get_blob_client_for("file.csv")
+
+    first = client.open(blob_client)
+    second = client.open(blob_client)
+    download.proceed.set()
+    assert first.read() == second.read() == b"012345"
+    assert calls == [{"if_match": PROPERTIES.etag, "store_in_cache": True}]
+    first.close()
+    second.close()
@@ -0,0 +1,50 @@
+import time
+
+from azure.core.credentials import AccessToken
+from azure.core.exceptions import ClientAuthenticationError
+
+from vertrouwelijke_data_proxy.files.credentials import STORAGE_SCOPE, PrefetchingCredential
+
+
+class FakeCredential:
+    def __init__(self, lifetime: float = 3600):
+        self.lifetime = lifetime
+        self.calls = 0
+
+    def get_token(self, *scopes, **kwargs):
+        self.calls += 1
+        return AccessToken(f"token{self.calls}", int(time.time() + self.lifetime))
+
+
+class FailingCredential:
+    def get_token(self, *scopes, **kwargs):
+        raise ClientAuthenticationError("No credential in the chain worked")
+
+
+class TestPrefetchingCredential:
+    def test_token_cached(self):
+        fake = FakeCredential()
+        credential = PrefetchingCredential(fake)
+        assert credential.get_token(STORAGE_SCOPE).token == "token1"
+        assert credential.get_token(STORAGE_SCOPE).token == "token1"
+        assert fake.calls == 1
+
+        # Claims challenges always fetch a new token
+        assert credential.get_token(STORAGE_SCOPE, claims="{}").token == "token2"
+
+    def test_background_refresh(self):
+        fake = FakeCredential(lifetime=2)
+        credential = PrefetchingCredential(fake, refresh_margin=600)
+        assert credential.get_token(STORAGE_SCOPE).token == "token1"
+
+        # Refreshed halfway the lifetime, without a request waiting for it.
+        for _ in range(40):
+            if fake.calls > 1:
+                break
+            time.sleep(0.1)
+        assert fake.calls == 2
+
+    def test_prefetch_failure(self, caplog):
+        credential = PrefetchingCredential(FailingCredential())
+        credential.prefetch()
+        assert "Unable to prefetch token" in caplog.text
@@ -0,0 +1,51 @@
+import os
+import threading
+import time
+
+from vertrouwelijke_data_proxy.files.listing import ListingCache
+
+
+class TestListingCache:
+    def test_cached(self):
+        cache = ListingCache(ttl=60, stale_ttl=60, max_entries=10)
+        calls = []
+        assert cache.get("dir/", lambda: calls.append(1) or {"v": 1}) == {"v": 1}
+        assert cache.get("dir/", lambda: calls.append(2) or {"v": 2}) == {"v": 1}
+        assert calls == [1]
+
+    def test_stale_refreshed_in_background(self, monkeypatch):
+        cache = ListingCache(ttl=0, stale_ttl=60, max_entries=10)
+        cache.get("dir/", lambda: {"v": 1})
+
+        refreshed = threading.Event()
+
+        def fetch():
+            refreshed.set()
+            return {"v": 2}
+
+        # The stale value is returned, while the new value is fetched.
+        assert cache.get("dir/", fetch) == {"v": 1}
+        assert refreshed.wait(timeout=5)
+        for _ in range(100):
+            if not cache._refreshing:
+                break
+            time.sleep(0.01)
+        assert cache._entries["dir/"][1] == {"v": 2}
+
+    def test_reset_after_fork(self, monkeypatch):
+        """A forked worker (another pid) doesn't use the entries of the parent process"""
+        cache = ListingCache(ttl=60, stale_ttl=60, max_entries=10)
+        cache.get("dir/", lambda: {"v": 1})
+        monkeypatch.setattr(os, "getpid", lambda: cache._pid + 1)
+        assert cache.get("dir/", lambda: {"v": 2}) == {"v": 2}
+
+    def test_expired_fetched_inline(self):
+        cache = ListingCache(ttl=0, stale_ttl=0, max_entries=10)
+        cache.get("dir/", lambda: {"v": 1})
+        assert cache.get("dir/", lambda: {"v": 2}) == {"v": 2}
+
+    def test_max_entries(self):
+        cache = ListingCache(ttl=60, stale_ttl=60, max_entries=2)
+        for key in ("a/", "b/", "c/"):
+            cache.get(key, dict)
+        assert list(cache._entries) == ["b/", "c/"]
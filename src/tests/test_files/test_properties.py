@@ -0,0 +1,53 @@
+import os
+import time
+
+import pytest
+
+from tests.conftest import FAKE_BLOB_PROPERTIES
+from vertrouwelijke_data_proxy.files.properties import PropertiesCache
+
+
+class TestPropertiesCache:
+    def test_cached(self):
+        cache = PropertiesCache(ttl=60, negative_ttl=10, max_entries=10)
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            return FAKE_BLOB_PROPERTIES
+
+        assert cache.fetch("file.csv", fetch) is FAKE_BLOB_PROPERTIES
+        assert cache.fetch("file.csv", fetch) is FAKE_BLOB_PROPERTIES
+        assert calls == [1]
+
+    def test_missing(self):
+        """A missing blob is remembered for the negative TTL"""
+        cache = PropertiesCache(ttl=60, negative_ttl=10, max_entries=10)
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            raise FileNotFoundError()
+
+        for _ in range(2):
+            with pytest.raises(FileNotFoundError):
+                cache.fetch("typo.csv", fetch)
+        assert calls == [1]
+
+        cache._entries["typo.csv"] = (time.monotonic(), None)
+        assert cache.get("typo.csv") is None
+
+    def test_reset_after_fork(self, monkeypatch):
+        """A forked worker (another pid) has a new lock, and starts empty"""
+        cache = PropertiesCache(ttl=60, negative_ttl=10, max_entries=10)
+        cache.store("file.csv", FAKE_BLOB_PROPERTIES)
+        lock = cache._lock
+        monkeypatch.setattr(os, "getpid", lambda: cache._pid + 1)
+        assert cache.get("file.csv") is None
+        assert cache._lock is not lock
+
+    def test_max_entries(self):
+        cache = PropertiesCache(ttl=60, negative_ttl=10, max_entries=2)
+        for key in ("a.csv", "b.csv", "c.csv"):
+            cache.store(key, FAKE_BLOB_PROPERTIES)
+        assert list(cache._entries) == ["b.csv", "c.csv"]
@@ -0,0 +1,27 @@
+import pytest
+
+from vertrouwelijke_data_proxy.files.ranges import RangeNotSatisfiable, parse_range_header
+
+
+@pytest.mark.parametrize(
+    ("header", "expected"),
+    [
+        ("bytes=0-3", [(0, 3)]),
+        ("bytes=4-", [(4, 15)]),
+        ("bytes=-4", [(12, 15)]),
+        ("bytes=10-100", [(10, 15)]),
+        ("bytes=0-1, 8-9", [(0, 1), (8, 9)]),
+        ("bytes=0-4, 2-6, 7-8", [(0, 8)]),  # merged
+        ("bytes=0-1, 20-30", [(0, 1)]),  # unsatisfiable part dropped
+        ("items=0-1", None),
+        ("bytes=5-2", None),
+        ("bytes=abc", None),
+    ],
+)
+def test_parse_range_header(header, expected):
+    assert parse_range_header(header, size=16) == expected
+
+
+def test_parse_range_header_unsatisfiable():
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header("bytes=16-20", size=16)
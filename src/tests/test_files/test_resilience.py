@@ -0,0 +1,146 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from azure.core.exceptions import ResourceNotFoundError, ServiceResponseError
+from azure.storage.blob import BlobClient
+
+from tests.conftest import FAKE_BLOB_DATA
+from vertrouwelijke_data_proxy.files.clients import ConfidentialDataClient
+from vertrouwelijke_data_proxy.files.resilience import Hedger, resume_chunks
+
+
+def _failing_chunks(chunks, fail_after: int):
+    for i, chunk in enumerate(chunks):
+        if i == fail_after:
+            raise ServiceResponseError("Connection reset by peer")
+        yield chunk
+
+
+class TestResumeChunks:
+    def test_resume(self, patch_azure_blob_download):
+        """The download continues at the last delivered byte"""
+        blob_client = BlobClient("https://test.storage", "container", "file.csv")
+        downloader = blob_client.download_blob(offset=2)
+        chunks = resume_chunks(
+            blob_client,
+            _failing_chunks(downloader.chunks(), fail_after=2),
+            offset=2,
+            length=downloader.size,
+            etag=downloader.properties.etag,
+            attempts=1,
+        )
+        assert b"".join(chunks) == FAKE_BLOB_DATA[2:]
+
+    def test_blob_replaced(self, patch_azure_blob_download):
+        blob_client = BlobClient("https://test.storage", "container", "file.csv")
+        chunks = resume_chunks(
+            blob_client,
+            _failing_chunks([b"0123"], fail_after=0),
+            offset=0,
+            length=len(FAKE_BLOB_DATA),
+            etag="other",  # the blob was replaced
+            attempts=3,
+        )
+        with pytest.raises(Exception, match="condition"):
+            list(chunks)
+
+    def test_client_download(self, monkeypatch, patch_azure_blob_download, api_request_fp_mdw):
+        download_blob = BlobClient.download_blob
+        failed = []
+
+        def _download_blob(self, **kwargs):
+            downloader = download_blob(self, **kwargs)
+            if not failed:
+                failed.append(True)
+                downloader.chunks = lambda: _failing_chunks(
+                    type(downloader).chunks(downloader), fail_after=1
+                )
+            return downloader
+
+        monkeypatch.setattr(BlobClient, "download_blob", _download_blob)
+        client = ConfidentialDataClient(
+            base_url="https://test.confidential-storage", resume_attempts=1
+        )
+        with client.call(api_request_fp_mdw("/file.csv")) as stream:
+            assert stream.read() == FAKE_BLOB_DATA
+
+
+class FakeResponse:
+    def __init__(self, status_code: int = 200):
+        self.status_code = status_code
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def respond(raw_response_hook, status_code: int = 200) -> FakeResponse:
+    """Let the fake request receive its response headers, like the SDK pipeline does."""
+    response = FakeResponse(status_code)
+    raw_response_hook(SimpleNamespace(http_response=response))
+    return response
+
+
+class TestHedger:
+    def _hedger(self, duration: float) -> Hedger:
+        hedger = Hedger(percentile=90, min_delay=0, min_samples=2)
+        hedger.record(duration)
+        hedger.record(duration)
+        return hedger
+
+    def test_not_hedged(self):
+        hedger = Hedger(percentile=90, min_samples=2)
+        assert hedger.get_delay() is None
+        hedger.call(respond)
+        hedger.call(respond)
+        assert hedger.get_delay() is not None
+
+    def test_headers_timed(self):
+        """Only the time until the headers counts, not reading the first chunk"""
+        hedger = Hedger(percentile=90, min_samples=1)
+
+        def fetch(raw_response_hook):
+            respond(raw_response_hook)
+            time.sleep(0.2)
+
+        hedger.call(fetch)
+        assert hedger.get_delay() < 0.1
+
+    def test_hedged(self):
+        """The second request wins when the first one stalls, the first one is aborted"""
+        hedger = self._hedger(0.01)
+        stalled = threading.Event()
+        responses = []
+
+        def fetch(raw_response_hook):
+            response = FakeResponse()
+            responses.append(response)
+            if len(responses) == 1:
+                stalled.wait()
+            raw_response_hook(SimpleNamespace(http_response=response))
+            return response
+
+        winner = hedger.call(fetch)
+        stalled.set()
+        for _ in range(100):
+            if responses[0].closed:
+                break
+            time.sleep(0.01)
+
+        assert winner is responses[1]
+        assert not winner.closed
+        assert responses[0].closed
+
+    def test_answer(self):
+        """A 404 is the answer, so it doesn't wait for the second request"""
+        hedger = self._hedger(0.01)
+
+        def fetch(raw_response_hook):
+            time.sleep(0.05)
+            respond(raw_response_hook, 404)
+            raise ResourceNotFoundError("The specified blob does not exist.")
+
+        with pytest.raises(ResourceNotFoundError):
+            hedger.call(fetch)
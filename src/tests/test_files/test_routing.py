@@ -0,0 +1,113 @@
+import pytest
+from azure.storage.blob import BlobClient
+from django.core.exceptions import ImproperlyConfigured
+from django.http import Http404
+from django.urls import resolve
+
+from vertrouwelijke_data_proxy.files.routing import (
+    Dataset,
+    RoutingTable,
+    compile_routes,
+    get_routing_table,
+    resolve_path,
+)
+from vertrouwelijke_data_proxy.files.views import ProxyConfidentialDataView, ZipBundleView
+
+DEFAULT = Dataset("bulk-data-fp-mdw", frozenset({"FP/MDW"}))
+OTHER = Dataset("other", frozenset({"OTHER/R"}), account_url="https://other.storage")
+
+
+class TestRoutingTable:
+    def test_longest_prefix(self):
+        table = RoutingTable({"": DEFAULT, "other/": OTHER, "other/nested/": DEFAULT})
+        assert table.match("file.csv") == (DEFAULT, "file.csv")
+        assert table.match("other/dir/file.csv") == (OTHER, "dir/file.csv")
+        assert table.match("other/nested/file.csv") == (DEFAULT, "file.csv")
+        assert table.match("otherfile.csv") == (DEFAULT, "otherfile.csv")
+        assert table.match("other") == (OTHER, "")
+        assert table.prefixes == ["", "other/", "other/nested/"]
+
+    def test_no_match(self):
+        table = RoutingTable({"other": OTHER})
+        assert table.match("file.csv") is None
+        assert table.match("other/file.csv") == (OTHER, "file.csv")
+
+    def test_shared_dataset(self):
+        table = compile_routes(
+            [
+                {"prefix": "a/", "container": "c", "scopes": ["S"]},
+                {"prefix": "b/", "container": "c", "scopes": ["S"]},
+            ]
+        )
+        assert table.match("a/x")[0] == table.match("b/x")[0]
+
+    @pytest.mark.parametrize(
+        "route",
+        [
+            {"prefix": "a/"},
+            {"prefix": "a/", "container": "c"},
+            {"prefix": "a/", "container": "c", "scopes": []},
+            {"prefix": "a/", "container": "c", "scopes": "FP/MDW"},
+            {"prefix": "a/", "container": "c", "scopes": [1]},
+        ],
+    )
+    def test_invalid(self, route):
+        with pytest.raises(ImproperlyConfigured):
+            compile_routes([route])
+
+    @pytest.mark.parametrize("prefix", ["_proxy/", "/_proxy/bundle/", "_proxy"])
+    def test_reserved(self, prefix):
+        with pytest.raises(ImproperlyConfigured):
+            compile_routes([{"prefix": prefix, "container": "c", "scopes": ["S"]}])
+
+    def test_reserved_path(self):
+        with pytest.raises(Http404):
+            resolve_path("/_proxy/file.csv")
+        assert resolve_path("/_proxy.csv")[1] == "_proxy.csv"
+
+    @pytest.mark.parametrize("path", ["/_bundle", "/dir/_bundle", "/metrics"])
+    def test_blob_names(self, path):
+        """Blobs with the names of the proxy endpoints are still downloaded."""
+        assert resolve(path).url_name == "confidential-data-index"
+
+
+@pytest.fixture()
+def other_dataset(settings):
+    settings.DATASET_ROUTES = [
+        {"prefix": "", "container": "bulk-data-fp-mdw", "scopes": ["FP/MDW"]},
+        {"prefix": "other/", "container": "other", "scopes": ["OTHER/R"]},
+    ]
+    get_routing_table.cache_clear()
+    yield
+    get_routing_table.cache_clear()
+
+
+class TestDatasetViews:
+    def test_scopes(self, other_dataset, patch_azure_blob_download, api_request_fp_mdw):
+        request = api_request_fp_mdw("/other/file.csv")
+        request.is_authorized_for = lambda *scopes: "FP/MDW" in scopes
+        response = ProxyConfidentialDataView.as_view()(request)
+        assert response.status_code == 403
+
+    def test_bundle_scopes(self, other_dataset, api_request_fp_mdw):
+        request = api_request_fp_mdw("/_proxy/bundle/other/", QUERY_STRING="path=/other/a.csv")
+        request.is_authorized_for = lambda *scopes: "FP/MDW" in scopes
+        response = ZipBundleView.as_view()(request)
+        assert response.status_code == 403
+
+    def test_container(
+        self, monkeypatch, other_dataset, patch_azure_blob_download, api_request_fp_mdw
+    ):
+        containers = []
+        download_blob = BlobClient.download_blob
+
+        def _download_blob(self, **kwargs):
+            containers.append((self.container_name, self.blob_name))
+            return download_blob(self, **kwargs)
+
+        monkeypatch.setattr(BlobClient, "download_blob", _download_blob)
+        request = api_request_fp_mdw("/other/dir/file.csv")
+        request.get_token_scopes = ["OTHER/R"]
+        response = ProxyConfidentialDataView.as_view()(request)
+        assert response.status_code == 200
+        assert containers == [("other", "dir/file.csv")]
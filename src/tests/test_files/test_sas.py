@@ -0,0 +1,64 @@
+import time
+from datetime import UTC, datetime, timedelta
+from urllib.parse import parse_qs, urlsplit
+
+from azure.storage.blob import BlobServiceClient
+
+from vertrouwelijke_data_proxy.files.sas import UserDelegationKeyCache, generate_download_url
+
+
+class FakeServiceClient:
+    def __init__(self):
+        self.calls = 0
+
+    def get_user_delegation_key(self, key_start_time, key_expiry_time):
+        self.calls += 1
+        return f"key{self.calls}"
+
+
+class TestUserDelegationKeyCache:
+    def test_reuse(self):
+        service_client = FakeServiceClient()
+        key_cache = UserDelegationKeyCache(service_client, lifetime=3600)
+        assert key_cache.get_key(min_validity=300) == "key1"
+        assert key_cache.get_key(min_validity=300) == "key1"
+        assert service_client.calls == 1
+
+    def test_expires_too_soon(self):
+        """A key that expires before the SAS would, is fetched again"""
+        key_cache = UserDelegationKeyCache(FakeServiceClient(), lifetime=3600)
+        key_cache.get_key(min_validity=300)
+        key_cache._expiry = datetime.now(UTC) + timedelta(seconds=60)
+        assert key_cache.get_key(min_validity=300) == "key2"
+
+    def test_refresh_in_background(self):
+        """Halfway its lifetime, the current key is still returned while it's renewed"""
+        key_cache = UserDelegationKeyCache(FakeServiceClient(), lifetime=3600)
+        key_cache.get_key(min_validity=300)
+        key_cache._expiry = datetime.now(UTC) + timedelta(seconds=1000)
+        assert key_cache.get_key(min_validity=300) == "key1"
+
+        for _ in range(100):
+            if not key_cache._refreshing.is_set():
+                break
+            time.sleep(0.01)
+        assert key_cache.get_key(min_validity=300) == "key2"
+
+
+def test_generate_download_url(patch_azure_delegation_key):
+    service_client = BlobServiceClient("https://account.blob.core.windows.net")
+    blob_client = service_client.get_blob_client("container", "dir/file.csv")
+    now = datetime.now(UTC)
+    key = service_client.get_user_delegation_key(now, now + timedelta(hours=1))
+
+    url = generate_download_url(blob_client, key, lifetime=300, filename="file.csv")
+    parts = urlsplit(url)
+    assert parts.netloc == "account.blob.core.windows.net"
+    assert parts.path == "/container/dir/file.csv"
+
+    query = parse_qs(parts.query)
+    assert query["sp"] == ["r"]
+    assert query["sr"] == ["b"]
+    assert query["spr"] == ["https"]
+    assert query["rscd"] == ['attachment; filename="file.csv"']
+    assert "sig" in query
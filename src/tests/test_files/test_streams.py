@@ -0,0 +1,35 @@
+import pytest
+
+from vertrouwelijke_data_proxy.files.streams import ChunkedStream, read_ahead
+
+
+class TestChunkedStream:
+    def test_read_returns_chunks_unsliced(self):
+        chunks = [b"aaaa", b"bbbb"]
+        stream = ChunkedStream(chunks, size=8)
+        first = stream.read(10)
+        assert first is chunks[0]
+        assert stream.read(10) == b"bbbb"
+        assert stream.read(10) == b""
+
+    def test_read_small_blocks(self):
+        stream = ChunkedStream([b"abcde", b"fg"])
+        assert stream.read(2) == b"ab"
+        assert stream.read(2) == b"cd"
+        assert stream.read() == b"efg"
+
+
+class TestReadAhead:
+    def test_order_preserved(self):
+        chunks = [str(i).encode() for i in range(50)]
+        assert list(read_ahead(iter(chunks), max_chunks=2)) == chunks
+
+    def test_error_reraised(self):
+        def failing():
+            yield b"ok"
+            raise OSError("connection reset")
+
+        stream = read_ahead(failing(), max_chunks=2)
+        assert next(stream) == b"ok"
+        with pytest.raises(OSError, match="connection reset"):
+            next(stream)
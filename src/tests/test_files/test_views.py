@@ -1,5 +1,23 @@
+import io
+import json
+import zipfile
+from types import SimpleNamespace
+
+import pytest
+from asgiref.sync import async_to_sync
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import BlobClient, ContainerClient
+from azure.storage.blob.aio import BlobClient as AsyncBlobClient
 from django.urls import reverse
-from vertrouwelijke_data_proxy.files.views import ProxyConfidentialDataView
+
+from tests.conftest import FAKE_BLOB_PROPERTIES
+from vertrouwelijke_data_proxy.files.views import (
+    AsyncProxyConfidentialDataView,
+    ProxyConfidentialDataView,
+    ZipBundleView,
+)
+
+ENDPOINT = "https://test.confidential-storage"
 
 
 class TestProxyConfidentialDataView:
@@ -13,13 +31,104 @@ class TestProxyConfidentialDataView:
         response = api_client.get(url)
         assert response.status_code == 403
 
-    def test_authorized_400_on_index(self, api_request_fp_mdw):
-        """Not requesting file shows 400"""
+    def test_authorized_listing_on_index(self, patch_azure_blob_listing, api_request_fp_mdw):
+        """Not requesting file shows the folder listing"""
         url = reverse("confidential-data-index")
         request = api_request_fp_mdw(url)
         response = ProxyConfidentialDataView().get(request)
+        assert response.status_code == 200
+        assert json.loads(response.content)["prefix"] == ""
+
+    def test_listing_pages(self, patch_azure_blob_listing, api_request_fp_mdw):
+        """Folder listings are paginated with a cursor, and cached"""
+        url = reverse("confidential-data-index")
+        request = api_request_fp_mdw(url + "dir/")
+        response = ProxyConfidentialDataView().get(request)
+        assert response.status_code == 200
+        data = json.loads(response.content)
+        assert data["directories"] == ["dir/sub/"]
+        assert data["files"] == [
+            {
+                "name": "dir/a.csv",
+                "size": 16,
+                "etag": '"0x8DC0000000000"',
+                "last_modified": "2024-01-01T00:00:00+00:00",
+            }
+        ]
+        assert data["next"] == "http://testserver/dir/?cursor=1"
+
+        request = api_request_fp_mdw(url + "dir/", QUERY_STRING="cursor=1")
+        data = json.loads(ProxyConfidentialDataView().get(request).content)
+        assert [file["name"] for file in data["files"]] == ["dir/b.csv"]
+        assert data["next"] is None
+
+        # Repeated requests are served from the cache
+        ProxyConfidentialDataView().get(api_request_fp_mdw(url + "dir/"))
+        assert patch_azure_blob_listing == [("dir/", None), ("dir/", "1")]
+
+    def test_redirect(self, settings, patch_azure_delegation_key, api_request_fp_mdw):
+        """Downloads can be redirected to a short-lived SAS URL"""
+        settings.AZURE_STORAGE_REDIRECT = True
+        settings.AZURE_STORAGE_CONTAINER_ENDPOINT = "https://account.blob.core.windows.net"
+        request = api_request_fp_mdw("/bulk-data-fp-mdw/dir/file.csv")
+        response = ProxyConfidentialDataView().get(request)
+        assert response.status_code == 302
+        assert response["Location"].startswith(
+            "https://account.blob.core.windows.net/bulk-data-fp-mdw/dir/file.csv?"
+        )
+        assert "sp=r&" in response["Location"]
+        assert "no-store" in response["Cache-Control"]
+
+        # The delegation key is reused
+        ProxyConfidentialDataView().get(api_request_fp_mdw("/other.csv"))
+        assert len(patch_azure_delegation_key) == 1
+
+    def test_redirect_head(
+        self, settings, patch_azure_delegation_key, patch_azure_blob_download, api_request_fp_mdw
+    ):
+        """A HEAD request is answered by the proxy, without handing out a SAS URL"""
+        settings.AZURE_STORAGE_REDIRECT = True
+        request = api_request_fp_mdw("/file.csv", method="head")
+        response = ProxyConfidentialDataView().get(request)
+        assert response.status_code == 200
+        assert response["Content-Length"] == "16"
+        assert not response.has_header("Location")
+        assert patch_azure_delegation_key == []
+
+    def test_bundle_paths(self, patch_azure_blob_download, api_request_fp_mdw):
+        url = reverse("confidential-data-bundle")
+        request = api_request_fp_mdw(url, QUERY_STRING="path=a.csv&path=/bulk-data-fp-mdw/b.csv")
+        response = ZipBundleView().get(request)
+        assert response.status_code == 200
+        assert response["Content-Type"] == "application/zip"
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as archive:
+            assert archive.namelist() == ["a.csv", "b.csv"]
+            assert archive.read("b.csv") == patch_azure_blob_download
+
+    def test_bundle_prefix(self, monkeypatch, patch_azure_blob_download, api_request_fp_mdw):
+        monkeypatch.setattr(
+            ContainerClient,
+            "list_blob_names",
+            lambda _self, name_starts_with: iter(["dir/", "dir/a.csv", "dir/sub/b.csv"]),
+        )
+        url = reverse("confidential-data-bundle")
+        request = api_request_fp_mdw(url, QUERY_STRING="prefix=dir/")
+        response = ZipBundleView().get(request)
+        assert response["Content-Disposition"] == 'attachment; filename="dir.zip"'
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as archive:
+            assert archive.namelist() == ["dir/a.csv", "dir/sub/b.csv"]
+
+    def test_bundle_400(self, api_request_fp_mdw):
+        url = reverse("confidential-data-bundle")
+        response = ZipBundleView().get(api_request_fp_mdw(url))
         assert response.status_code == 400
 
+    def test_listing_404(self, patch_azure_blob_listing, api_request_fp_mdw):
+        url = reverse("confidential-data-index")
+        request = api_request_fp_mdw(url + "unknown/")
+        response = ProxyConfidentialDataView().get(request)
+        assert response.status_code == 404
+
     def test_authorized_404_on_non_existent_file(
         self, patch_azure_blob_doesnt_exist, api_request_fp_mdw
     ):
@@ -36,3 +145,296 @@ class TestProxyConfidentialDataView:
         assert response.status_code == 200
         assert response.filename == "file.zip"
         assert response.file_to_stream.read() == b"0000"
+
+    def test_file_download_streaming(self, patch_azure_blob_download, api_request_fp_mdw):
+        """The blob is streamed in chunks, instead of being buffered first."""
+        url = reverse("confidential-data-index")
+        request = api_request_fp_mdw(url + "file.csv")
+        response = ProxyConfidentialDataView().get(request)
+        assert response.status_code == 200
+        assert response.streaming
+        assert response["Content-Length"] == str(len(patch_azure_blob_download))
+        assert b"".join(response.streaming_content) == patch_azure_blob_download
+
+    def test_precompressed_variant(
+        self, monkeypatch, settings, patch_azure_blob_download, api_request_fp_mdw
+    ):
+        """A file.csv.gz is served when the client accepts gzip, instead of compressing."""
+        settings.PRECOMPRESSED_ENCODINGS = ["br", "gzip"]
+        download_blob = BlobClient.download_blob
+        requested = []
+
+        def only_gzip(blob_client, *args, **kwargs):
+            requested.append(blob_client.blob_name)
+            if blob_client.blob_name.endswith(".br"):
+                raise ResourceNotFoundError("The specified blob does not exist.")
+            return download_blob(blob_client, *args, **kwargs)
+
+        monkeypatch.setattr(BlobClient, "download_blob", only_gzip)
+        request = api_request_fp_mdw("/file.csv", HTTP_ACCEPT_ENCODING="gzip, br")
+        response = ProxyConfidentialDataView().get(request)
+        assert response.status_code == 200
+        assert requested == ["file.csv.br", "file.csv.gz"]
+        assert response["Content-Encoding"] == "gzip"
+        assert response["Content-Type"] == "text/csv"
+        assert response["Vary"] == "Accept-Encoding"
+
+    def test_precompressed_disabled(
+        self, monkeypatch, patch_azure_blob_download, api_request_fp_mdw
+    ):
+        """By default, no sibling blobs are looked up."""
+        download_blob = BlobClient.download_blob
+        requested = []
+
+        def record(blob_client, *args, **kwargs):
+            requested.append(blob_client.blob_name)
+            return download_blob(blob_client, *args, **kwargs)
+
+        monkeypatch.setattr(BlobClient, "download_blob", record)
+        request = api_request_fp_mdw("/file.csv", HTTP_ACCEPT_ENCODING="gzip, br")
+        response = ProxyConfidentialDataView().get(request)
+        assert response.status_code == 200
+        assert requested == ["file.csv"]
+        assert not response.has_header("Content-Encoding")
+
+    def test_precompressed_not_for_zip(
+        self, settings, patch_azure_blob_download, api_request_fp_mdw
+    ):
+        settings.PRECOMPRESSED_ENCODINGS = ["br", "gzip"]
+        request = api_request_fp_mdw("/file.zip", HTTP_ACCEPT_ENCODING="gzip, br")
+        response = ProxyConfidentialDataView().get(request)
+        assert response.status_code == 200
+        assert not response.has_header("Content-Encoding")
+
+    def test_range_single(self, patch_azure_blob_download, api_request_fp_mdw):
+        url = reverse("confidential-data-index")
+        request = api_request_fp_mdw(url + "file.csv", HTTP_RANGE="bytes=2-5")
+        response = ProxyConfidentialDataView().get(request)
+        assert response.status_code == 206
+        assert response["Content-Range"] == "bytes 2-5/16"
+        assert response["Content-Length"] == "4"
+        assert b"".join(response.streaming_content) == b"2345"
+
+    def test_range_multiple(self, patch_azure_blob_download, api_request_fp_mdw):
+        url = reverse("confidential-data-index")
+        request = api_request_fp_mdw(url + "file.csv", HTTP_RANGE="bytes=0-1,-2")
+        response = ProxyConfidentialDataView().get(request)
+        assert response.status_code == 206
+        assert response["Content-Type"].startswith("multipart/byteranges; boundary=")
+        body = b"".join(response.streaming_content)
+        assert len(body) == int(response["Content-Length"])
+        assert b"Content-Range: bytes 0-1/16\r\n\r\n01\r\n" in body
+        assert b"Content-Range: bytes 14-15/16\r\n\r\nef\r\n" in body
+
+    def test_range_not_satisfiable(self, patch_azure_blob_download, api_request_fp_mdw):
+        url = reverse("confidential-data-index")
+        request = api_request_fp_mdw(url + "file.csv", HTTP_RANGE="bytes=100-")
+        response = ProxyConfidentialDataView().get(request)
+        assert response.status_code == 416
+        assert response["Content-Range"] == "bytes */16"
+
+    def test_range_if_range_mismatch(self, patch_azure_blob_download, api_request_fp_mdw):
+        """When the file changed, the whole file is returned."""
+        url = reverse("confidential-data-index")
+        request = api_request_fp_mdw(
+            url + "file.csv", HTTP_RANGE="bytes=2-5", HTTP_IF_RANGE='"0xOLD"'
+        )
+        response = ProxyConfidentialDataView().get(request)
+        assert response.status_code == 200
+        assert b"".join(response.streaming_content) == patch_azure_blob_download
+
+    def test_validators(self, patch_azure_blob_download, api_request_fp_mdw):
+        url = reverse("confidential-data-index")
+        request = api_request_fp_mdw(url + "file.csv")
+        response = ProxyConfidentialDataView().get(request)
+        assert response.status_code == 200
+        assert response["ETag"] == '"0x8DC0000000000"'
+        assert response["Last-Modified"] == "Mon, 01 Jan 2024 00:00:00 GMT"
+
+    def test_if_none_match_304(self, patch_azure_blob_download, api_request_fp_mdw):
+        url = reverse("confidential-data-index")
+        request = api_request_fp_mdw(url + "file.csv", HTTP_IF_NONE_MATCH='"0x8DC0000000000"')
+        response = ProxyConfidentialDataView().get(request)
+        assert response.status_code == 304
+        assert response["ETag"] == '"0x8DC0000000000"'
+
+    def test_if_none_match_range_304(self, patch_azure_blob_download, api_request_fp_mdw):
+        url = reverse("confidential-data-index")
+        request = api_request_fp_mdw(
+            url + "file.csv", HTTP_RANGE="bytes=0-1", HTTP_IF_NONE_MATCH='"0x8DC0000000000"'
+        )
+        response = ProxyConfidentialDataView().get(request)
+        assert response.status_code == 304
+
+    @pytest.mark.parametrize("headers", [{}, {"HTTP_RANGE": "bytes=0-1"}])
+    def test_if_match_412(self, patch_azure_blob_download, api_request_fp_mdw, headers):
+        """Another version of the file fails, for the whole file and for its ranges"""
+        request = api_request_fp_mdw("/file.csv", HTTP_IF_MATCH='"0xOLD"', **headers)
+        response = ProxyConfidentialDataView().get(request)
+        assert response.status_code == 412
+
+    def test_if_match(self, patch_azure_blob_download, api_request_fp_mdw):
+        request = api_request_fp_mdw("/file.csv", HTTP_IF_MATCH='"0x8DC0000000000"')
+        response = ProxyConfidentialDataView().get(request)
+        assert response.status_code == 200
+        assert b"".join(response.streaming_content) == patch_azure_blob_download
+
+    def test_head(
+        self, monkeypatch, properties_cache, patch_azure_blob_download, api_request_fp_mdw
+    ):
+        """HEAD is answered from the cached properties, without a download"""
+        monkeypatch.setattr(BlobClient, "download_blob", None)
+        request = api_request_fp_mdw("/file.csv", method="head")
+        response = ProxyConfidentialDataView.as_view()(request)
+        assert response.status_code == 200
+        assert response["Content-Length"] == "16"
+        assert response["Content-Type"] == "text/csv"
+        assert response["ETag"] == '"0x8DC0000000000"'
+        assert response["Accept-Ranges"] == "bytes"
+        assert response.content == b""
+
+        monkeypatch.setattr(BlobClient, "get_blob_properties", None)
+        request = api_request_fp_mdw(
+            "/file.csv", method="head", HTTP_IF_NONE_MATCH='"0x8DC0000000000"'
+        )
+        assert ProxyConfidentialDataView.as_view()(request).status_code == 304
+
+    def test_404_remembered(self, monkeypatch, properties_cache, api_request_fp_mdw):
+        calls = []
+
+        def nope(_self, **kwargs):
+            calls.append(1)
+            raise ResourceNotFoundError("The specified blob does not exist.")
+
+        monkeypatch.setattr(BlobClient, "download_blob", nope)
+        for _ in range(2):
+            response = ProxyConfidentialDataView().get(api_request_fp_mdw("/typo.csv"))
+            assert response.status_code == 404
+        assert calls == [1]
+
+    def test_304_from_cached_properties(
+        self, monkeypatch, properties_cache, patch_azure_blob_download, api_request_fp_mdw
+    ):
+        ProxyConfidentialDataView().get(api_request_fp_mdw("/file.csv")).close()
+        monkeypatch.setattr(BlobClient, "download_blob", None)
+        request = api_request_fp_mdw("/file.csv", HTTP_IF_NONE_MATCH='"0x8DC0000000000"')
+        assert ProxyConfidentialDataView().get(request).status_code == 304
+
+    def test_range_outdated_properties(
+        self, properties_cache, patch_azure_blob_download, api_request_fp_mdw
+    ):
+        """A range of a replaced blob is served from the current version"""
+        outdated = SimpleNamespace(**{**vars(FAKE_BLOB_PROPERTIES), "etag": '"0xOLD"'})
+        properties_cache.store(f"{ENDPOINT}/bulk-data-fp-mdw/file.csv", outdated)
+        request = api_request_fp_mdw("/file.csv", HTTP_RANGE="bytes=2-5")
+        response = ProxyConfidentialDataView().get(request)
+        assert response.status_code == 206
+        assert response["ETag"] == '"0x8DC0000000000"'
+        assert b"".join(response.streaming_content) == b"2345"
+        assert properties_cache.get(f"{ENDPOINT}/bulk-data-fp-mdw/file.csv") is not outdated
+
+
+class TestAsyncProxyConfidentialDataView:
+    """Prove that the async view serves the same downloads."""
+
+    @staticmethod
+    async def read_body(response):
+        return b"".join([chunk async for chunk in response.streaming_content])
+
+    def test_unauthorized_403(self, api_request_fp_mdw):
+        request = api_request_fp_mdw("/file.csv")
+        request.get_token_scopes = []
+        request.is_authorized_for = lambda *scopes: False
+        response = async_to_sync(AsyncProxyConfidentialDataView().get)(request)
+        assert response.status_code == 403
+
+    def test_redirect(self, settings, patch_azure_delegation_key, api_request_fp_mdw):
+        settings.AZURE_STORAGE_REDIRECT = True
+        settings.AZURE_STORAGE_CONTAINER_ENDPOINT = "https://account.blob.core.windows.net"
+        request = api_request_fp_mdw("/file.csv")
+        response = async_to_sync(AsyncProxyConfidentialDataView().get)(request)
+        assert response.status_code == 302
+        assert "/bulk-data-fp-mdw/file.csv?" in response["Location"]
+
+    def test_redirect_head(
+        self,
+        settings,
+        patch_azure_delegation_key,
+        patch_azure_async_blob_download,
+        api_request_fp_mdw,
+    ):
+        settings.AZURE_STORAGE_REDIRECT = True
+        request = api_request_fp_mdw("/file.csv", method="head")
+        response = async_to_sync(AsyncProxyConfidentialDataView().get)(request)
+        assert response.status_code == 200
+        assert not response.has_header("Location")
+        assert patch_azure_delegation_key == []
+
+    def test_file_download(self, patch_azure_async_blob_download, api_request_fp_mdw):
+        request = api_request_fp_mdw("/file.csv")
+        response = async_to_sync(AsyncProxyConfidentialDataView().get)(request)
+        assert response.status_code == 200
+        assert response["Content-Length"] == str(len(patch_azure_async_blob_download))
+        assert response["ETag"] == '"0x8DC0000000000"'
+        assert async_to_sync(self.read_body)(response) == patch_azure_async_blob_download
+
+    def test_range_single(self, patch_azure_async_blob_download, api_request_fp_mdw):
+        request = api_request_fp_mdw("/file.csv", HTTP_RANGE="bytes=2-5")
+        response = async_to_sync(AsyncProxyConfidentialDataView().get)(request)
+        assert response.status_code == 206
+        assert response["Content-Range"] == "bytes 2-5/16"
+        assert async_to_sync(self.read_body)(response) == b"2345"
+
+    def test_if_match_412(self, patch_azure_async_blob_download, api_request_fp_mdw):
+        request = api_request_fp_mdw("/file.csv", HTTP_IF_MATCH='"0xOLD"')
+        response = async_to_sync(AsyncProxyConfidentialDataView().get)(request)
+        assert response.status_code == 412
+
+    def test_head(self, properties_cache, patch_azure_async_blob_download, api_request_fp_mdw):
+        request = api_request_fp_mdw("/file.csv", method="head")
+        response = async_to_sync(AsyncProxyConfidentialDataView().get)(request)
+        assert response.status_code == 200
+        assert response["Content-Length"] == "16"
+        assert response["ETag"] == '"0x8DC0000000000"'
+        assert response.content == b""
+
+    def test_precompressed_variant(
+        self, monkeypatch, settings, patch_azure_async_blob_download, api_request_fp_mdw
+    ):
+        """The async view serves a file.csv.gz just like the sync view."""
+        settings.PRECOMPRESSED_ENCODINGS = ["br", "gzip"]
+        download_blob = AsyncBlobClient.download_blob
+        requested = []
+
+        async def only_gzip(blob_client, *args, **kwargs):
+            requested.append(blob_client.blob_name)
+            if blob_client.blob_name.endswith(".br"):
+                raise ResourceNotFoundError("The specified blob does not exist.")
+            return await download_blob(blob_client, *args, **kwargs)
+
+        monkeypatch.setattr(AsyncBlobClient, "download_blob", only_gzip)
+        request = api_request_fp_mdw("/file.csv", HTTP_ACCEPT_ENCODING="gzip, br")
+        response = async_to_sync(AsyncProxyConfidentialDataView().get)(request)
+        assert response.status_code == 200
+        assert requested == ["file.csv.br", "file.csv.gz"]
+        assert response["Content-Encoding"] == "gzip"
+        assert response["Content-Type"] == "text/csv"
+        assert response["Vary"] == "Accept-Encoding"
+        assert async_to_sync(self.read_body)(response) == patch_azure_async_blob_download
+
+    def test_precompressed_disabled(
+        self, monkeypatch, patch_azure_async_blob_download, api_request_fp_mdw
+    ):
+        download_blob = AsyncBlobClient.download_blob
+        requested = []
+
+        async def record(blob_client, *args, **kwargs):
+            requested.append(blob_client.blob_name)
+            return await download_blob(blob_client, *args, **kwargs)
+
+        monkeypatch.setattr(AsyncBlobClient, "download_blob", record)
+        request = api_request_fp_mdw("/file.csv", HTTP_ACCEPT_ENCODING="gzip, br")
+        response = async_to_sync(AsyncProxyConfidentialDataView().get)(request)
+        assert response.status_code == 200
+        assert requested == ["file.csv"]
+        assert not response.has_header("Content-Encoding")
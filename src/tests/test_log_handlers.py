@@ -0,0 +1,108 @@
+import ctypes
+import io
+import logging
+import os
+import signal
+import threading
+import time
+
+import pytest
+from prometheus_client import REGISTRY
+
+from vertrouwelijke_data_proxy.log_handlers import QueuedStreamHandler
+
+
+def make_logger(handler: logging.Handler) -> logging.Logger:
+    logger = logging.getLogger("tests.queued")
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    return logger
+
+
+class TestQueuedStreamHandler:
+    def test_write(self):
+        stream = io.StringIO()
+        handler = QueuedStreamHandler(stream)
+        logger = make_logger(handler)
+        items = ["a"]
+        logger.info("items: %s", items)
+        items.append("b")  # changed before the record is written
+
+        logger.info("second")
+        handler.flush()
+        assert stream.getvalue() == "items: ['a']\nsecond\n"
+        handler.close()
+
+    def test_full_queue(self):
+        """Records are dropped instead of blocking the request"""
+        stream = io.StringIO()
+        handler = QueuedStreamHandler(stream, maxsize=2, batch_size=1)
+        logger = make_logger(handler)
+        logger.info("started")
+        handler.flush()
+        before = REGISTRY.get_sample_value("proxy_log_records_dropped_total") or 0
+
+        with handler._writing:
+            # The writer takes the first record, and then waits for the lock.
+            logger.info("record 0")
+            for _ in range(100):
+                if handler.queue.empty():
+                    break
+                time.sleep(0.01)
+            for i in range(1, 10):
+                logger.info("record %d", i)
+            dropped = REGISTRY.get_sample_value("proxy_log_records_dropped_total") - before
+
+        handler.close()
+        assert dropped == 7
+        assert stream.getvalue() == "started\nrecord 0\nrecord 1\nrecord 2\n"
+
+    def test_full_queue_blocks(self):
+        """With ``block``, the request waits until there's room in the queue"""
+        stream = io.StringIO()
+        handler = QueuedStreamHandler(stream, maxsize=1, batch_size=1, block=True)
+        logger = make_logger(handler)
+        logger.info("started")
+        handler.flush()
+
+        done = threading.Event()
+
+        def log():
+            for i in range(3):
+                logger.info("record %d", i)
+            done.set()
+
+        with handler._writing:
+            threading.Thread(target=log).start()
+            assert not done.wait(0.1)
+        assert done.wait(5)
+        handler.close()
+        assert stream.getvalue() == "started\nrecord 0\nrecord 1\nrecord 2\n"
+
+    @pytest.mark.parametrize(
+        "fork",
+        [os.fork, ctypes.CDLL(None).fork],  # libc fork() skips the hooks, just like uWSGI
+        ids=["os", "libc"],
+    )
+    def test_fork(self, tmp_path, fork):
+        """A forked worker starts its own writer, also when the fork hooks didn't run"""
+        path = tmp_path / "log"
+        with open(path, "w") as stream:
+            handler = QueuedStreamHandler(stream)
+            logger = make_logger(handler)
+            logger.info("parent")
+            handler.flush()
+
+            if (pid := fork()) == 0:
+                signal.alarm(5)  # don't hang when the writer doesn't run
+                for i in range(3):
+                    logger.info("child %d", i)
+                handler.flush()
+                os._exit(0)
+
+            _, status = os.waitpid(pid, 0)
+            handler.close()
+
+        assert os.waitstatus_to_exitcode(status) == 0
+        assert path.read_text() == "parent\nchild 0\nchild 1\nchild 2\n"
@@ -0,0 +1,194 @@
+import json
+import tempfile
+import time
+
+import pytest
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory
+from jwcrypto.jwk import JWK
+from jwcrypto.jwt import JWT
+from prometheus_client import REGISTRY
+
+from vertrouwelijke_data_proxy.middleware import (
+    CachedAuthorizationMiddleware,
+    CompressionMiddleware,
+    MetricsMiddleware,
+    ProfilingMiddleware,
+)
+
+
+@pytest.mark.parametrize(
+    ("content_type", "status", "compressed"),
+    [
+        ("text/csv", 200, True),
+        ("application/json", 200, True),
+        ("application/zip", 200, False),
+        ("application/gzip", 200, False),
+        ("text/csv", 206, False),
+    ],
+)
+def test_compression_middleware(content_type, status, compressed):
+    response = HttpResponse(b"a" * 1000, content_type=content_type, status=status)
+    middleware = CompressionMiddleware(lambda request: response)
+    request = RequestFactory().get("/file", HTTP_ACCEPT_ENCODING="gzip")
+    response = middleware(request)
+    assert (response.get("Content-Encoding") == "gzip") == compressed
+
+
+def make_token(scopes, expires_in=3600) -> str:
+    """Create a token, signed with the test key."""
+    key = JWK(**json.loads(settings.DATAPUNT_AUTHZ["JWKS"])["keys"][0])
+    token = JWT(
+        header={"alg": "ES256", "kid": key.kid},
+        claims={"sub": "test@example.com", "scopes": scopes, "exp": int(time.time()) + expires_in},
+    )
+    token.make_signed_token(key)
+    return token.serialize()
+
+
+class TestOptionsMiddleware:
+    def test_options(self, client):
+        """OPTIONS is answered without a token, and without reaching the view"""
+        response = client.options("/file.csv")
+        assert response.status_code == 200
+        assert response["Allow"] == "GET, HEAD, OPTIONS"
+
+    def test_preflight(self, client):
+        response = client.options(
+            "/file.csv",
+            HTTP_ORIGIN="http://localhost:3000",
+            HTTP_ACCESS_CONTROL_REQUEST_METHOD="GET",
+        )
+        assert response.status_code == 200
+        assert response["Access-Control-Allow-Methods"] == "GET, HEAD, OPTIONS"
+
+
+class TestCachedAuthorizationMiddleware:
+    def test_token_verified_once(self, monkeypatch):
+        middleware = CachedAuthorizationMiddleware(lambda request: HttpResponse())
+        calls = []
+        decode_token = middleware._decode_token
+        monkeypatch.setattr(
+            middleware, "_decode_token", lambda raw: calls.append(raw) or decode_token(raw)
+        )
+        header = f"Bearer {make_token(['FP/MDW'])}"
+
+        for _ in range(3):
+            request = RequestFactory().get("/file.csv", HTTP_AUTHORIZATION=header)
+            middleware(request)
+            assert request.get_token_scopes == frozenset({"FP/MDW"})
+            assert request.get_token_subject == "test@example.com"
+        assert len(calls) == 1
+
+        # Reloading the keys invalidates the cache
+        middleware.jwks.init_keyset()
+        middleware(RequestFactory().get("/file.csv", HTTP_AUTHORIZATION=header))
+        assert len(calls) == 2
+
+    def test_expired_token_not_cached(self):
+        middleware = CachedAuthorizationMiddleware(lambda request: HttpResponse())
+        header = f"Bearer {make_token(['FP/MDW'], expires_in=-60)}"
+        request = RequestFactory().get("/file.csv", HTTP_AUTHORIZATION=header)
+        response = middleware(request)
+        assert response.status_code == 401
+        assert not middleware._cache
+
+
+class TestMetricsMiddleware:
+    def _value(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_streaming_response(self):
+        middleware = MetricsMiddleware(lambda request: StreamingHttpResponse([b"ab", b"cd"]))
+        route = {"route": "confidential-data-index"}
+        sent = self._value("proxy_response_bytes_total", **route)
+        ttfb = self._value("proxy_time_to_first_byte_seconds_count", **route)
+        in_progress = self._value("proxy_requests_in_progress")
+
+        response = middleware(RequestFactory().get("/file.csv"))
+        assert self._value("proxy_requests_in_progress") == in_progress + 1
+        assert b"".join(response.streaming_content) == b"abcd"
+        response.close()
+
+        assert self._value("proxy_response_bytes_total", **route) == sent + 4
+        assert self._value("proxy_time_to_first_byte_seconds_count", **route) == ttfb + 1
+        assert self._value("proxy_requests_in_progress") == in_progress
+
+    def test_unread_response_closed(self):
+        middleware = MetricsMiddleware(lambda request: StreamingHttpResponse([b"ab"]))
+        in_progress = self._value("proxy_requests_in_progress")
+        middleware(RequestFactory().get("/file.csv")).close()
+        assert self._value("proxy_requests_in_progress") == in_progress
+
+    def test_sendfile_response(self):
+        """A file response is kept intact, so the server can use sendfile()"""
+        with tempfile.TemporaryFile() as file:
+            file.write(b"abcd")
+            file.seek(0)
+            middleware = MetricsMiddleware(lambda request: FileResponse(file))
+            route = {"route": "confidential-data-index"}
+            sent = self._value("proxy_response_bytes_total", **route)
+
+            response = middleware(RequestFactory().get("/file.csv"))
+            assert response.file_to_stream is file
+            response.close()
+            assert file.closed
+            assert self._value("proxy_response_bytes_total", **route) == sent + 4
+
+    def test_metrics_view(self, client, settings):
+        settings.METRICS_TOKEN = "secret"
+        client.get("/status/")
+        response = client.get("/_proxy/metrics", HTTP_X_METRICS_TOKEN="secret")
+        assert response.status_code == 200
+        assert b'proxy_responses_total{route="status",status="200"}' in response.content
+
+    @pytest.mark.parametrize(
+        ["metrics_token", "headers"],
+        [
+            (None, {}),
+            (None, {"HTTP_X_METRICS_TOKEN": ""}),
+            ("secret", {}),
+            ("secret", {"HTTP_X_METRICS_TOKEN": "guess"}),
+        ],
+    )
+    def test_metrics_view_denied(self, client, settings, metrics_token, headers):
+        """The metrics are not public, they reveal the routes and the load of the server."""
+        settings.METRICS_TOKEN = metrics_token
+        response = client.get("/_proxy/metrics", **headers)
+        assert response.status_code == 404
+
+
+class TestProfilingMiddleware:
+    @pytest.fixture()
+    def profile_dir(self, settings, tmp_path):
+        settings.PROFILE_DIR = str(tmp_path)
+        settings.PROFILE_TOKEN = "secret"
+        settings.PROFILE_INTERVAL = 0.001
+        return tmp_path
+
+    def _get_response(self, request):
+        time.sleep(0.05)
+        return HttpResponse(b"abcd")
+
+    def test_not_used(self):
+        with pytest.raises(MiddlewareNotUsed):
+            ProfilingMiddleware(self._get_response)
+
+    def test_profile(self, profile_dir):
+        middleware = ProfilingMiddleware(self._get_response)
+        middleware(RequestFactory().get("/file.csv", HTTP_X_PROFILE="secret")).close()
+        for _ in range(100):
+            if profiles := list(profile_dir.iterdir()):
+                break
+            time.sleep(0.01)
+
+        assert len(profiles) == 1
+        assert "_get_response" in profiles[0].read_text()
+
+    def test_invalid_token(self, profile_dir):
+        middleware = ProfilingMiddleware(self._get_response)
+        request = RequestFactory().get("/file.csv", HTTP_X_PROFILE="guess")
+        middleware(request).close()
+        assert not hasattr(request, "_profiler")
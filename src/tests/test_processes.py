@@ -0,0 +1,31 @@
+import os
+import threading
+import time
+
+from vertrouwelijke_data_proxy.processes import PerProcess
+
+
+class Resettable(PerProcess):
+    def __init__(self):
+        self.resets = 0
+
+    def _reset(self):
+        self.resets += 1
+        time.sleep(0.01)  # other threads arrive during the reset
+
+
+class TestPerProcess:
+    def test_reset_once_per_process(self, monkeypatch):
+        """Threads that use the object in a new process wait for a single reset"""
+        state = Resettable()
+        state._check_pid()
+        state._check_pid()
+        assert state.resets == 1
+
+        monkeypatch.setattr(os, "getpid", lambda: state._pid + 1)
+        threads = [threading.Thread(target=state._check_pid) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert state.resets == 2
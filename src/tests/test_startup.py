@@ -0,0 +1,62 @@
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from vertrouwelijke_data_proxy import startup
+from vertrouwelijke_data_proxy.files.clients import client_registry
+
+
+def test_warm_up(monkeypatch, settings):
+    """The storage SDK is imported, and the loaded objects are frozen for the workers."""
+    frozen = []
+    monkeypatch.setattr(startup.gc, "freeze", lambda: frozen.append(True))
+    settings.ASYNC_DOWNLOADS = True
+
+    startup.warm_up()
+    assert "azure.storage.blob" in sys.modules
+    assert "azure.storage.blob.aio" in sys.modules
+    assert frozen == [True]
+
+
+class TestPrefetchToken:
+    @pytest.fixture()
+    def prefetched(self, monkeypatch):
+        calls = []
+        monkeypatch.setattr(client_registry, "prefetch_token", lambda: calls.append(True))
+        return calls
+
+    def _fake_uwsgi(self, monkeypatch, **opt) -> list:
+        postfork = []
+        monkeypatch.setitem(sys.modules, "uwsgi", SimpleNamespace(opt=opt))
+        monkeypatch.setitem(
+            sys.modules, "uwsgidecorators", SimpleNamespace(postfork=postfork.append)
+        )
+        return postfork
+
+    def test_without_uwsgi(self, monkeypatch, prefetched):
+        monkeypatch.setitem(sys.modules, "uwsgi", None)
+        startup.prefetch_token()
+        assert prefetched == [True]
+
+    def test_forked_workers(self, monkeypatch, prefetched):
+        """The application is loaded in the master, so each worker fetches after the fork"""
+        postfork = self._fake_uwsgi(monkeypatch)
+        startup.prefetch_token()
+        assert prefetched == []
+        postfork[0]()
+        assert prefetched == [True]
+
+    @pytest.mark.parametrize("opt", [{"lazy-apps": True}, {"lazy-apps": b"1"}, {"lazy": True}])
+    def test_lazy_apps(self, monkeypatch, prefetched, opt):
+        """The application is loaded in the worker itself, so the token is fetched right away"""
+        postfork = self._fake_uwsgi(monkeypatch, **opt)
+        startup.prefetch_token()
+        assert prefetched == [True]
+        assert postfork == []
+
+    def test_lazy_apps_disabled(self, monkeypatch, prefetched):
+        postfork = self._fake_uwsgi(monkeypatch, **{"lazy-apps": b"false"})
+        startup.prefetch_token()
+        assert prefetched == []
+        assert len(postfork) == 1
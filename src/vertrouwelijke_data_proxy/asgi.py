@@ -0,0 +1,21 @@
+"""
+ASGI config for vertrouwelijke_data_proxy project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Downloads are served by async views here, so slow clients don't occupy a thread each.
+"""
+
+import os
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "vertrouwelijke_data_proxy.settings")
+os.environ.setdefault("ASYNC_DOWNLOADS", "true")
+
+application = get_asgi_application()
+
+if settings.STARTUP_WARM_UP:
+    from vertrouwelijke_data_proxy.startup import warm_up
+
+    warm_up()
@@ -0,0 +1,248 @@
+"""Admission control of the downloads.
+
+A few users with parallel bulk downloads can otherwise occupy every worker.
+The number of concurrent downloads is limited globally and per token subject,
+requests beyond those limits receive a ``429 Too Many Requests`` with ``Retry-After``.
+Optionally, the streamed bytes per user are shaped to a maximum rate.
+
+The state is kept in the configured Django cache, which should be a shared backend
+(e.g. Redis or Memcached) so the limits apply across all uWSGI workers.
+The taken download slots are counted per time window of ``DOWNLOAD_SLOT_TIMEOUT``,
+and a streaming response moves its slot to the next window. This way, the slots
+of a crashed worker become available again, once their window is over.
+"""
+
+import asyncio
+import hashlib
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponseBase
+from rest_framework.throttling import BaseThrottle
+
+from .streams import call_on_close, is_sendfile_response
+
+# Per-user byte counts are kept per time window of this many seconds.
+RATE_WINDOW = 1
+
+
+def get_subject_key(request) -> str:
+    """Identify the user of the token, without putting the subject itself in the cache."""
+    subject = getattr(request, "get_token_subject", None) or "anonymous"
+    return hashlib.sha256(subject.encode()).hexdigest()[:32]
+
+
+class Admission:
+    """The download slots that a request holds, until its response is sent."""
+
+    def __init__(self, subject_key: str):
+        self.subject_key = subject_key
+        self.cache = caches[settings.DOWNLOAD_ADMISSION_CACHE]
+        self.slots = []
+        self._window = None
+
+    def acquire(self) -> bool:
+        """Take a slot of the user, and a global slot. Nothing is taken when either is full."""
+        limits = [
+            (f"download-slot:user:{self.subject_key}", settings.DOWNLOAD_MAX_CONCURRENT_PER_USER),
+            ("download-slot:global", settings.DOWNLOAD_MAX_CONCURRENT),
+        ]
+        self._window = get_slot_window()
+        for pool, size in limits:
+            if not size:
+                continue
+            if not self._acquire_slot(pool, size):
+                self.release()
+                return False
+            self.slots.append(pool)
+        return True
+
+    def _acquire_slot(self, pool: str, size: int) -> bool:
+        # The incr() is atomic, so two workers can't both take the last free slot.
+        taken = self._add(pool, self._window, 1)
+        previous = self.cache.get(f"{pool}:{self._window - 1}", 0)
+        if taken + previous <= size:
+            return True
+        self._add(pool, self._window, -1)
+        return False
+
+    def _add(self, pool: str, window: int, delta: int) -> int:
+        """Change the number of taken slots in the window, and return the new number."""
+        key = f"{pool}:{window}"
+        # The count is also needed during the next window, to include the running downloads.
+        self.cache.add(key, 0, timeout=settings.DOWNLOAD_SLOT_TIMEOUT * 2)
+        try:
+            return self.cache.incr(key, delta)
+        except ValueError:
+            return 0  # the window just expired, so its slots are no longer counted
+
+    def needs_renewal(self) -> bool:
+        return bool(self.slots) and get_slot_window() != self._window
+
+    def renew(self):
+        """Move the slots to the current window, while the response is still streaming."""
+        if self.needs_renewal():
+            window = get_slot_window()
+            for pool in self.slots:
+                self._add(pool, window, 1)
+                self._add(pool, self._window, -1)
+            self._window = window
+
+    def release(self):
+        for pool in self.slots:
+            self._add(pool, self._window, -1)
+        self.slots = []
+
+
+def get_slot_window() -> int:
+    return int(time.time() // settings.DOWNLOAD_SLOT_TIMEOUT)
+
+
+class ByteRateLimiter:
+    """Shape the downloads of a user to ``rate`` bytes per second, across all workers.
+
+    The sent bytes are counted per window, the stream sleeps when it's over budget.
+    They're added to the shared count once a tenth of the budget was sent, or when
+    a new window starts, so most chunks don't need a cache round trip.
+    """
+
+    def __init__(self, subject_key: str, rate: int):
+        self.subject_key = subject_key
+        self.rate = rate
+        self.cache = caches[settings.DOWNLOAD_ADMISSION_CACHE]
+        self.flush_size = max(1, rate * RATE_WINDOW // 10)
+        self._window = None
+        self._sent = 0
+        self._pending = 0
+
+    def consume(self, size: int) -> float:
+        """Count the sent bytes, and tell how many seconds to wait before sending more."""
+        now = time.time()
+        window = int(now // RATE_WINDOW)
+        self._pending += size
+        if window != self._window or self._pending >= self.flush_size:
+            self._flush(window)
+        sent = self._sent + self._pending
+
+        budget = self.rate * RATE_WINDOW
+        if sent <= budget:
+            return 0.0
+        # Wait until the next window, and as long as the excess takes at this rate.
+        return (window + 1) * RATE_WINDOW - now + (sent - budget) / self.rate
+
+    def _flush(self, window: int):
+        """Add the pending bytes to the count of the window, which all workers share."""
+        key = f"download-bytes:{self.subject_key}:{window}"
+        try:
+            sent = self.cache.incr(key, self._pending)
+        except ValueError:
+            # The first bytes of the window, or the window expired just now.
+            if self.cache.add(key, self._pending, timeout=RATE_WINDOW * 2):
+                sent = self._pending
+            else:
+                try:
+                    sent = self.cache.incr(key, self._pending)
+                except ValueError:
+                    # Keep the bytes pending, so they count for the next window.
+                    self._window = None
+                    self._sent = 0
+                    return
+
+        self._window = window
+        self._sent = sent
+        self._pending = 0
+
+
+class ConcurrentDownloadThrottle(BaseThrottle):
+    """DRF throttle that takes the download slots, which are released by ``admit_response()``.
+    The taken slots are stored as ``view.admission``.
+    """
+
+    def allow_request(self, request, view) -> bool:
+        if not settings.DOWNLOAD_MAX_CONCURRENT and not settings.DOWNLOAD_MAX_CONCURRENT_PER_USER:
+            return True
+        if request.method == "HEAD":
+            return True  # only reads the properties, e.g. a download manager probing the size
+
+        admission = Admission(get_subject_key(request))
+        if not admission.acquire():
+            return False
+        view.admission = admission
+        return True
+
+    def wait(self) -> float:
+        return settings.DOWNLOAD_RETRY_AFTER
+
+
+def admit_response(request, response: HttpResponseBase, admission: Admission | None):
+    """Hold the slots until the response is sent, and shape its streamed body."""
+    limiter = None
+    if settings.DOWNLOAD_USER_RATE and response.streaming:
+        limiter = ByteRateLimiter(get_subject_key(request), settings.DOWNLOAD_USER_RATE)
+
+    if not response.streaming:
+        if admission is not None:
+            admission.release()
+    elif limiter is None and is_sendfile_response(response):
+        # Keep the file, so the server can send it with sendfile(). It isn't renewed meanwhile.
+        if admission is not None:
+            call_on_close(response, admission.release)
+    elif admission is not None or limiter is not None:
+        stream_class = _AsyncAdmittedStream if response.is_async else _AdmittedStream
+        response.streaming_content = stream_class(response.streaming_content, admission, limiter)
+
+
+class _AdmittedContent:
+    """Pass the chunks through, and release the slots when the response is closed.
+
+    This is an iterator class instead of a generator, so ``close()`` also releases
+    the slots when the response was never iterated over.
+    """
+
+    def __init__(self, admission: Admission | None, limiter: ByteRateLimiter | None):
+        self._admission = admission
+        self._limiter = limiter
+
+    def close(self):
+        if self._admission is not None:
+            self._admission.release()
+
+
+class _AdmittedStream(_AdmittedContent):
+    def __init__(self, content, admission: Admission | None, limiter: ByteRateLimiter | None):
+        super().__init__(admission, limiter)
+        self._content = iter(content)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        chunk = next(self._content)
+        if self._admission is not None:
+            self._admission.renew()
+        if self._limiter is not None and (delay := self._limiter.consume(len(chunk))):
+            time.sleep(delay)
+        return chunk
+
+
+class _AsyncAdmittedStream(_AdmittedContent):
+    """The same admission, for the streaming responses of async views."""
+
+    def __init__(self, content, admission: Admission | None, limiter: ByteRateLimiter | None):
+        super().__init__(admission, limiter)
+        self._content = content.__aiter__()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        chunk = await self._content.__anext__()
+        if self._admission is not None and self._admission.needs_renewal():
+            await sync_to_async(self._admission.renew)()
+        if self._limiter is not None and (
+            delay := await sync_to_async(self._limiter.consume)(len(chunk))
+        ):
+            await asyncio.sleep(delay)
+        return chunk
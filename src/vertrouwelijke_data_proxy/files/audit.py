@@ -0,0 +1,122 @@
+"""Audit records of the downloads.
+
+Each download is logged once, when its response is completely sent or aborted,
+with the user, the file, the number of bytes sent and the duration.
+A redirect to the storage account is logged right away, as the proxy doesn't see
+that download. The records are written by the ``vertrouwelijke_data_proxy.audit`` logger.
+"""
+
+import logging
+import time
+from functools import partial
+
+from django.http import HttpResponseBase
+
+from .streams import call_on_close, is_sendfile_response
+
+audit_logger = logging.getLogger("vertrouwelijke_data_proxy.audit")
+
+
+def audit_response(request, response: HttpResponseBase):
+    """Log the download when its response is sent."""
+    if not audit_logger.isEnabledFor(logging.INFO):
+        return
+
+    record = _DownloadRecord(request, response)
+    if response.status_code == 302:
+        record.finish(0, complete=True, event="redirect")
+    elif is_sendfile_response(response):
+        # The server sends the file by itself, so it's unknown whether the client received all.
+        call_on_close(response, partial(record.finish, record.size, complete=None))
+    elif response.streaming:
+        stream_class = _AsyncAuditedStream if response.is_async else _AuditedStream
+        response.streaming_content = stream_class(response.streaming_content, record)
+
+
+class _DownloadRecord:
+    def __init__(self, request, response: HttpResponseBase):
+        self.start = time.perf_counter()
+        self.subject = getattr(request, "get_token_subject", None)
+        self.path = request.path
+        self.status = response.status_code
+        self.size = (
+            int(response["Content-Length"]) if response.has_header("Content-Length") else None
+        )
+        self.finished = False
+
+    def finish(self, sent: int, complete: bool | None, event: str = "download"):
+        if self.finished:
+            return
+        self.finished = True
+        audit_logger.info(
+            "%s %s",
+            event,
+            self.path,
+            extra={
+                "event": event,
+                "subject": self.subject,
+                "path": self.path,
+                "status": self.status,
+                "bytes": sent,
+                "size": self.size,
+                "complete": complete,
+                "duration": round(time.perf_counter() - self.start, 3),
+            },
+        )
+
+
+class _AuditedContent:
+    """Count the sent bytes, and log the download when the response is closed.
+
+    This is an iterator class instead of a generator, so ``close()`` also logs
+    the download when the response was never iterated over.
+    """
+
+    def __init__(self, record: _DownloadRecord):
+        self._record = record
+        self._sent = 0
+
+    def _done(self):
+        self._record.finish(self._sent, complete=True)
+
+    def close(self):
+        # When the client disconnected, the response is closed before it was exhausted.
+        self._record.finish(self._sent, complete=False)
+
+
+class _AuditedStream(_AuditedContent):
+    def __init__(self, content, record: _DownloadRecord):
+        super().__init__(record)
+        self._content = iter(content)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self._content)
+        except StopIteration:
+            self._done()
+            raise
+        self._sent += len(chunk)
+        return chunk
+
+
+class _AsyncAuditedStream(_AuditedContent):
+    """The same audit, for the streaming responses of async views."""
+
+    def __init__(self, content, record: _DownloadRecord):
+        super().__init__(record)
+        self._content = content.__aiter__()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            chunk = await self._content.__anext__()
+        except StopAsyncIteration:
+            self._done()
+            raise
+        self._sent += len(chunk)
+        return chunk
@@ -0,0 +1,75 @@
+"""Streaming of multiple blobs as a single ZIP archive."""
+
+import io
+import mimetypes
+import zipfile
+from collections.abc import Iterable, Iterator
+from contextlib import closing
+
+from .content_types import is_incompressible
+
+
+class _ZipOutput(io.RawIOBase):
+    """Unseekable file object, that collects what the ``ZipFile`` writes.
+
+    As the output is not seekable, the ``ZipFile`` writes the sizes and checksums
+    in a data descriptor after each entry, so nothing has to be written in advance.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        """Return the data that was written since the previous call."""
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def get_compress_type(name: str) -> int:
+    """Tell how the file should be stored in the archive.
+    Files that are already compressed are stored as-is, which saves CPU time.
+    """
+    content_type, encoding = mimetypes.guess_type(name)
+    if encoding or is_incompressible(content_type or "application/octet-stream"):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def stream_zip(files: Iterable[tuple[str, io.RawIOBase]], chunk_size: int) -> Iterator[bytes]:
+    """Generate the ZIP archive for the ``(name, stream)`` pairs.
+
+    Each stream needs to have the blob ``properties``. The files are read one at a time,
+    and every chunk is passed on directly. This way memory stays constant for any
+    number of files, except for the small central directory at the end of the archive.
+    """
+    output = _ZipOutput()
+    with zipfile.ZipFile(output, "w", allowZip64=True) as archive:
+        for name, stream in files:
+            with closing(stream):
+                properties = stream.properties
+                info = zipfile.ZipInfo(name, date_time=properties.last_modified.timetuple()[:6])
+                info.compress_type = get_compress_type(name)
+                info.file_size = properties.size  # decides whether ZIP64 is needed.
+                with archive.open(info, "w") as entry:
+                    for chunk in iter(lambda s=stream: s.read(chunk_size), b""):
+                        entry.write(chunk)
+                        if data := output.take():
+                            yield data
+            if data := output.take():
+                yield data  # the data descriptor
+
+    yield output.take()  # the central directory
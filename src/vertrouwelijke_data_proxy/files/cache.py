@@ -0,0 +1,137 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from functools import cache
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+TEMP_PREFIX = ".tmp-"
+STALE_TEMP_AGE = 3600  # seconds, for leftovers of killed workers
+
+
+class BlobCache:
+    """Local disk cache for downloaded blobs, with a size budget and LRU eviction.
+
+    Each file is stored under a hash of the blob name *and* its ETag. That way, a lookup
+    with the current ETag (from the blob properties) revalidates the entry, and outdated
+    versions are never served; they're just evicted over time.
+
+    Files are written to a temporary file first, and renamed when complete.
+    Other workers can therefore never read a partially written file.
+    The modification time is updated on every hit, which makes it usable for LRU eviction
+    across all worker processes that share the directory.
+    """
+
+    def __init__(self, directory: str | Path, max_size: int):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @property
+    def stats(self) -> dict:
+        """Hit, miss and eviction counters of this process."""
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, name: str, value: int = 1):
+        with self._lock:
+            self._stats[name] += value
+
+    def get_path(self, blob_name: str, etag: str) -> Path:
+        key = hashlib.sha256(f"{blob_name}\n{etag}".encode()).hexdigest()
+        return self.directory / key
+
+    def open(self, blob_name: str, etag: str):
+        """Open the cached file, or return ``None`` when it's not cached."""
+        path = self.get_path(blob_name, etag)
+        try:
+            file = path.open("rb")
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            pass  # evicted by another worker, the open file remains readable.
+        self._count("hits")
+        return file
+
+    def store(self, blob_name: str, etag: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Pass the chunks through, while writing them into the cache.
+
+        The file is only added when all chunks are read. When the client disconnects
+        halfway, or the disk is full, the partial file is removed, but the chunks still
+        reach the client.
+        """
+        fd, temp_name = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=self.directory)
+        file = os.fdopen(fd, "wb")
+        try:
+            for chunk in chunks:
+                if file is not None:
+                    try:
+                        file.write(chunk)
+                    except OSError as e:
+                        logger.warning("Unable to write blob cache file: %s", e)
+                        file.close()
+                        file = None
+                yield chunk
+
+            if file is not None:
+                file.close()
+                os.replace(temp_name, self.get_path(blob_name, etag))
+                self.evict()
+        finally:
+            if file is not None and not file.closed:
+                file.close()
+            if os.path.exists(temp_name):
+                os.remove(temp_name)
+
+    def evict(self):
+        """Remove the least recently used files, until the cache fits in its budget."""
+        entries = []
+        total_size = 0
+        now = time.time()
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # removed by another worker
+                if entry.name.startswith(TEMP_PREFIX):
+                    if stat.st_mtime < now - STALE_TEMP_AGE:
+                        _remove(entry.path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            _remove(path)
+            total_size -= size
+            self._count("evictions")
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+@cache
+def get_blob_cache() -> BlobCache | None:
+    """Provide the blob cache for this process, if it's enabled in the settings."""
+    if not settings.BLOB_CACHE_DIR:
+        return None
+    return BlobCache(settings.BLOB_CACHE_DIR, max_size=settings.BLOB_CACHE_MAX_SIZE)
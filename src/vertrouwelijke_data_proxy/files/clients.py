@@ -1,41 +1,719 @@
+from __future__ import annotations
+
 import io
 import logging
+import threading
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from functools import partial
+from typing import TYPE_CHECKING
 
-from azure.identity import DefaultAzureCredential
-from azure.storage.blob import BlobServiceClient
+import requests
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    HttpResponseError,
+    ResourceModifiedError,
+    ResourceNotFoundError,
+    ResourceNotModifiedError,
+)
+from django.conf import settings
 from django.core.exceptions import BadRequest
+from django.utils.http import http_date
+from requests.adapters import HTTPAdapter
 from rest_framework.request import Request
+from urllib3 import Retry
+
+from vertrouwelijke_data_proxy.metrics import azure_call
+from vertrouwelijke_data_proxy.processes import PerProcess
+from vertrouwelijke_data_proxy.tracing import traced_chunks
+
+from .cache import BlobCache
+from .coalescing import DownloadCoalescer
+from .credentials import PrefetchingCredential
+from .properties import PropertiesCache
+from .resilience import Hedger, resume_chunks
+from .routing import resolve
+from .sas import UserDelegationKeyCache, generate_download_url
+from .streams import ChunkedStream, read_ahead, spool
+
+if TYPE_CHECKING:
+    # The storage SDK takes a while to import, so it's loaded on first use
+    # (or up front by the warm-up, see vertrouwelijke_data_proxy.startup).
+    from azure.core.pipeline.transport import RequestsTransport
+    from azure.storage.blob import BlobClient, BlobProperties, StorageStreamDownloader
+    from azure.storage.blob.aio import BlobClient as AsyncBlobClient
+    from azure.storage.blob.aio import StorageStreamDownloader as AsyncStorageStreamDownloader
 
 logger = logging.getLogger(__name__)
 
 USER_AGENT = "Amsterdam-Vertrouwelijke-Data-Proxy/1.0"
+# The container of the default dataset route (see DATASET_ROUTES).
+CONTAINER_NAME = "bulk-data-fp-mdw"
+
+
+class BlobNotModified(Exception):
+    """The blob didn't change since the client downloaded it (HTTP 304)."""
+
+    def __init__(self, etag: str | None = None, last_modified: str | None = None):
+        super().__init__("Blob not modified")
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class ClientRegistry(PerProcess):
+    """Process-wide pool of ``BlobServiceClient`` objects, keyed by account URL.
+
+    Constructing a client per request means a new credential (and token request),
+    and a new HTTP session with fresh TLS handshakes for every download.
+    All clients share the same credential, so its token cache is shared too.
+
+    Sockets and locks can't be shared with a forked child, so the registry
+    is cleared on its first use in every new worker process.
+    """
+
+    def __init__(self):
+        self._check_pid()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._credential = None
+        self._clients = {}
+        self._key_caches = {}
+
+    def get_credential(self):
+        self._check_pid()
+        with self._lock:
+            if self._credential is None:
+                self._credential = self._create_credential()
+            return self._credential
+
+    def _create_credential(self):
+        from azure.identity import DefaultAzureCredential
+
+        return PrefetchingCredential(
+            DefaultAzureCredential(), refresh_margin=settings.AZURE_TOKEN_REFRESH_MARGIN
+        )
+
+    def prefetch_token(self):
+        """Fetch the storage token in the background, so the first download doesn't wait.
+        This is called when a worker process starts.
+        """
+        credential = self.get_credential()
+        threading.Thread(target=credential.prefetch, name="token-prefetch", daemon=True).start()
+
+    def get_blob_service_client(self, account_url: str, chunk_size: int):
+        """Return the shared client for the storage account."""
+        self._check_pid()
+        key = (account_url, chunk_size)
+        try:
+            return self._clients[key]
+        except KeyError:
+            pass
+
+        credential = self.get_credential()
+        with self._lock:
+            if (client := self._clients.get(key)) is None:
+                logger.debug("Creating service client for %s", account_url)
+                client = self._create_service_client(
+                    account_url=account_url,
+                    credential=credential,
+                    **self._get_client_options(),
+                    user_agent=USER_AGENT,
+                    # Keep the initial GET as small as the other chunks, so memory stays flat.
+                    max_single_get_size=chunk_size,
+                    max_chunk_get_size=chunk_size,
+                )
+                self._clients[key] = client
+            return client
+
+    def _create_service_client(self, **kwargs):
+        from azure.storage.blob import BlobServiceClient
+
+        return BlobServiceClient(**kwargs)
+
+    def get_delegation_key_cache(self, service_client) -> UserDelegationKeyCache:
+        """Return the shared user delegation key of the storage account."""
+        self._check_pid()
+        with self._lock:
+            if (key_cache := self._key_caches.get(service_client.url)) is None:
+                key_cache = UserDelegationKeyCache(
+                    service_client, lifetime=settings.AZURE_DELEGATION_KEY_LIFETIME
+                )
+                self._key_caches[service_client.url] = key_cache
+            return key_cache
+
+    def _get_client_options(self) -> dict:
+        return {"transport": self._get_transport()}
+
+    def _get_transport(self) -> RequestsTransport:
+        """Create an HTTP transport that keeps enough connections alive for all threads."""
+        from azure.core.pipeline.transport import RequestsTransport
+
+        session = requests.Session()
+        # Retries are done by the Azure SDK pipeline, not by urllib3.
+        adapter = HTTPAdapter(
+            pool_connections=settings.AZURE_STORAGE_POOL_SIZE,
+            pool_maxsize=settings.AZURE_STORAGE_POOL_SIZE,
+            max_retries=Retry(total=False, redirect=False, raise_on_status=False),
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        # The read timeout applies to each socket read, so a stalled download fails early.
+        return RequestsTransport(
+            session=session,
+            session_owner=False,
+            read_timeout=settings.AZURE_STORAGE_READ_TIMEOUT,
+        )
+
+
+class AsyncClientRegistry(ClientRegistry):
+    """The registry for the ``azure.storage.blob.aio`` clients.
+    Their aiohttp session already keeps a connection pool for the event loop.
+    """
+
+    def _create_credential(self):
+        from azure.identity.aio import DefaultAzureCredential
+
+        # The async credential refreshes its tokens without blocking a thread.
+        return DefaultAzureCredential()
+
+    def _create_service_client(self, **kwargs):
+        from azure.storage.blob.aio import BlobServiceClient
+
+        return BlobServiceClient(**kwargs)
+
+    def _get_client_options(self) -> dict:
+        return {"read_timeout": settings.AZURE_STORAGE_READ_TIMEOUT}
+
+
+client_registry = ClientRegistry()
+async_client_registry = AsyncClientRegistry()
+
+
+def _get_request_path(request: Request) -> str:
+    """Translate the request path into the path within its dataset."""
+    return resolve(request)[1]
+
+
+def is_directory_path(request: Request) -> bool:
+    """Tell whether the request path refers to a folder instead of a file."""
+    path = _get_request_path(request)
+    return not path or path.endswith("/")
+
+
+def get_blob_path(request: Request) -> str:
+    """Translate the request path into the blob name."""
+    blob_path = _get_request_path(request)
+    if not blob_path or blob_path.endswith("/"):
+        raise BadRequest()
+
+    return blob_path
+
+
+def get_directory_prefix(request: Request) -> str:
+    """Translate the request path into the prefix of the blobs in that folder."""
+    return _get_request_path(request)
+
+
+def _get_cache_name(blob_client: BlobClient) -> str:
+    """Name the blob in the disk cache, blobs of other accounts can have the same name."""
+    return f"{blob_client.primary_hostname}/{blob_client.container_name}/{blob_client.blob_name}"
+
+
+def _get_match_conditions(if_none_match: str | None, if_match: str | None) -> dict:
+    if if_none_match:
+        return {"etag": if_none_match, "match_condition": MatchConditions.IfModified}
+    elif if_match:
+        return {"etag": if_match, "match_condition": MatchConditions.IfNotModified}
+    else:
+        return {}
+
+
+def _check_not_modified(
+    properties: BlobProperties, if_none_match: str | None, if_modified_since: datetime | None
+):
+    """Evaluate the conditions of the request, when the properties are already known."""
+    if (if_none_match and if_none_match in (properties.etag, "*")) or (
+        not if_none_match and if_modified_since and properties.last_modified <= if_modified_since
+    ):
+        raise BlobNotModified(properties.etag, http_date(properties.last_modified.timestamp()))
+
+
+def _check_known_properties(
+    properties_cache: PropertiesCache | None,
+    blob_client: BlobClient | AsyncBlobClient,
+    if_none_match: str | None,
+    if_modified_since: datetime | None,
+):
+    """Answer with a 404 or 304 when the cached properties already tell so."""
+    if properties_cache is None:
+        return
+    if (properties := properties_cache.get(blob_client.url)) is not None:
+        _check_not_modified(properties, if_none_match, if_modified_since)
+
+
+@contextmanager
+def _translate_errors(
+    blob_client: BlobClient | AsyncBlobClient, properties_cache: PropertiesCache | None = None
+):
+    """Translate the Azure errors into the exceptions that the views handle.
+    A missing blob is remembered, so the next request doesn't ask again.
+    """
+    try:
+        yield
+    except ResourceNotFoundError as e:
+        if properties_cache is not None:
+            properties_cache.store_missing(blob_client.url)
+        raise FileNotFoundError(f"{blob_client.blob_name} does not exist") from e
+    except HttpResponseError as e:
+        # The SDK raises a plain HttpResponseError for the 304 of the storage account.
+        if not isinstance(e, ResourceNotModifiedError) and e.status_code != 304:
+            raise
+        headers = e.response.headers if e.response is not None else {}
+        raise BlobNotModified(headers.get("ETag"), headers.get("Last-Modified")) from e
 
 
 class ConfidentialDataClient:
-    def __init__(self, base_url) -> None:
+    def __init__(
+        self,
+        base_url,
+        streaming: bool = True,
+        chunk_size: int = 4 * 1024 * 1024,
+        read_ahead_chunks: int = 2,
+        cache: BlobCache | None = None,
+        concurrency: int = 1,
+        segment_size: int = 8 * 1024 * 1024,
+        coalescer: DownloadCoalescer | None = None,
+        properties_cache: PropertiesCache | None = None,
+        container: str = CONTAINER_NAME,
+        spool_threshold: int = 0,
+        spool_dir: str | None = None,
+        resume_attempts: int = 0,
+        hedger: Hedger | None = None,
+    ) -> None:
         """Initialize the client configuration.
 
         :param base_url: Base URL of the Search Backend
+        :param streaming: Whether to stream the blob in chunks, instead of buffering it.
+        :param chunk_size: Size of each ranged GET to the storage account.
+        :param read_ahead_chunks: How many chunks to prefetch while streaming.
+        :param cache: Optional local disk cache for complete downloads.
+        :param concurrency: How many segments of a large blob to fetch in parallel.
+        :param segment_size: Size of each parallel fetched segment.
+        :param coalescer: Optional sharing of concurrent downloads of the same blob.
+        :param properties_cache: Optional in-memory cache of the blob properties.
+        :param container: The container of the dataset.
+        :param spool_threshold: Without streaming, larger blobs are buffered on disk.
+        :param spool_dir: Folder for the temporary files of buffered blobs.
+        :param resume_attempts: How often a failed download is continued where it stopped.
+        :param hedger: Optional repeating of downloads of which the first byte is late.
         """
-        azure_credential = DefaultAzureCredential()
-        self.blob_service_client = BlobServiceClient(
-            account_url=base_url, credential=azure_credential
+        self.streaming = streaming
+        self.read_ahead_chunks = read_ahead_chunks
+        self.cache = cache
+        self.concurrency = concurrency
+        self.segment_size = segment_size
+        self.coalescer = coalescer
+        self.properties_cache = properties_cache
+        self.container = container
+        self.spool_threshold = spool_threshold
+        self.spool_dir = spool_dir
+        self.resume_attempts = resume_attempts
+        self.hedger = hedger
+        self.blob_service_client = client_registry.get_blob_service_client(
+            base_url, chunk_size=chunk_size
         )
 
-    def call(self, request: Request) -> io.BytesIO:
-        stream = io.BytesIO()
-        blob_path = request.path[1:]  # path always starts with a '/'
-        if blob_path.startswith("bulk-data-fp-mdw"):  # this matches the ingress.yaml
-            blob_path = blob_path.split("/", 1)[1]  # just keep the part after 'bulk-data-fp-mdw/'
+    def call(
+        self,
+        request: Request,
+        if_none_match: str | None = None,
+        if_modified_since: datetime | None = None,
+        suffix: str = "",
+    ) -> io.RawIOBase:
+        """Download the blob of the request path.
 
-        if not blob_path or blob_path.endswith("/"):
-            raise BadRequest()
+        There is no separate ``exists()`` check; the download itself reports a missing blob.
+        The conditions are checked by the storage account, so a 304 doesn't transfer any data.
+        The suffix allows to download a variant of the blob, e.g. a pre-compressed ``.gz`` file.
+        """
+        return self.open(
+            self.get_blob_client(request, suffix=suffix),
+            if_none_match=if_none_match,
+            if_modified_since=if_modified_since,
+        )
+
+    def open(
+        self,
+        blob_client: BlobClient,
+        if_none_match: str | None = None,
+        if_modified_since: datetime | None = None,
+    ) -> io.RawIOBase:
+        """Download the blob, or read it from the local disk cache when that's enabled.
+        Concurrent downloads of the same blob are shared, also when they fill the cache.
+        """
+        if self.cache is not None:
+            return self.call_cached(blob_client, if_none_match, if_modified_since)
+        elif self.coalescer is not None:
+            return self.call_coalesced(blob_client, if_none_match, if_modified_since)
 
-        blob_client = self.blob_service_client.get_blob_client("bulk-data-fp-mdw", blob_path)
+        return self.download(
+            blob_client, if_none_match=if_none_match, if_modified_since=if_modified_since
+        )
+
+    def call_cached(
+        self,
+        blob_client: BlobClient,
+        if_none_match: str | None = None,
+        if_modified_since: datetime | None = None,
+    ):
+        """Serve the blob from the local disk cache, or download it into the cache.
+        The properties are fetched first, so the cache entry is revalidated by its ETag.
+        """
+        properties = self.get_properties(blob_client)
+        _check_not_modified(properties, if_none_match, if_modified_since)
 
-        if not blob_client.exists():
-            raise FileNotFoundError(f"{blob_path} does not exist")
+        cache_name = _get_cache_name(blob_client)
+        if (file := self.cache.open(cache_name, properties.etag)) is not None:
+            file.properties = properties
+            return file
 
-        blob_client.download_blob().readinto(stream)
+        try:
+            # Only store the file when it's still the version that matches the ETag.
+            if self.coalescer is not None:
+                # Concurrent misses share a single download, which fills the cache.
+                return self._open_shared(blob_client, properties.etag, store_in_cache=True)
+            return self.download(blob_client, if_match=properties.etag, store_in_cache=True)
+        except ResourceModifiedError:
+            # The blob was replaced in the meantime, just stream the new version.
+            return self.download(blob_client)
 
+    def call_coalesced(
+        self,
+        blob_client: BlobClient,
+        if_none_match: str | None = None,
+        if_modified_since: datetime | None = None,
+    ) -> io.RawIOBase:
+        """Share the download with concurrent requests for the same version of the blob.
+        The properties are fetched first, so the conditions are checked locally,
+        and a request never attaches to the download of a blob that was replaced since.
+        """
+        properties = self.get_properties(blob_client)
+        _check_not_modified(properties, if_none_match, if_modified_since)
+        try:
+            return self._open_shared(blob_client, properties.etag)
+        except ResourceModifiedError:
+            # The cached properties are outdated, so the current version is shared instead.
+            properties = self.get_properties(blob_client, refresh=True)
+            _check_not_modified(properties, if_none_match, if_modified_since)
+            return self._open_shared(blob_client, properties.etag)
+
+    def _open_shared(
+        self, blob_client: BlobClient, etag: str, store_in_cache: bool = False
+    ) -> io.RawIOBase:
+        """Attach to the download of this version of the blob, or start it.
+        The download is pinned to the ETag, so all readers receive the same version.
+        """
+        return self.coalescer.open(
+            (blob_client.url, etag),
+            partial(self.download, blob_client, if_match=etag, store_in_cache=store_in_cache),
+        )
+
+    def get_blob_client(self, request: Request, suffix: str = "") -> BlobClient:
+        """Translate the request path into the client for the blob."""
+        return self.get_blob_client_for(get_blob_path(request) + suffix)
+
+    def get_blob_client_for(self, blob_name: str) -> BlobClient:
+        """Provide the client for a blob in the container."""
+        return self.blob_service_client.get_blob_client(self.container, blob_name)
+
+    def get_download_url(self, blob_client: BlobClient, filename: str, lifetime: int) -> str:
+        """Create a short-lived, read-only URL to download the blob directly from storage.
+        The blob isn't checked, a missing blob gives a 404 from the storage account.
+        """
+        key_cache = client_registry.get_delegation_key_cache(self.blob_service_client)
+        return generate_download_url(
+            blob_client, key_cache.get_key(min_validity=lifetime), lifetime, filename
+        )
+
+    def list_blob_names(self, prefix: str, max_results: int) -> list[str]:
+        """List the names of all blobs that start with the prefix, including subfolders.
+
+        :raises BadRequest: When there are more than ``max_results`` blobs.
+        """
+        container_client = self.blob_service_client.get_container_client(self.container)
+        names = []
+        with azure_call("list", prefix=prefix):
+            for name in container_client.list_blob_names(name_starts_with=prefix):
+                if len(names) >= max_results:
+                    raise BadRequest(f"More than {max_results} files in {prefix}")
+                names.append(name)
+        return names
+
+    def list_directory(self, prefix: str, cursor: str | None = None, page_size: int = 1000):
+        """List one page of the files and subfolders that start with the prefix.
+
+        The ``next`` cursor of the result is the continuation token of the storage account,
+        which can be passed again to retrieve the next page.
+        """
+        container_client = self.blob_service_client.get_container_client(self.container)
+        pages = container_client.walk_blobs(
+            name_starts_with=prefix, delimiter="/", results_per_page=page_size
+        ).by_page(continuation_token=cursor)
+
+        try:
+            with azure_call("list", prefix=prefix):
+                page = list(next(pages, []))
+        except HttpResponseError as e:
+            if e.status_code == 400:
+                raise BadRequest("Invalid cursor") from e  # e.g. a tampered continuation token
+            raise
+
+        from azure.storage.blob import BlobPrefix
+
+        directories = []
+        files = []
+        for item in page:
+            if isinstance(item, BlobPrefix):
+                directories.append(item.name)
+            else:
+                files.append(
+                    {
+                        "name": item.name,
+                        "size": item.size,
+                        "etag": item.etag,
+                        "last_modified": item.last_modified.isoformat(),
+                    }
+                )
+
+        return {
+            "prefix": prefix,
+            "directories": directories,
+            "files": files,
+            "next": pages.continuation_token or None,
+        }
+
+    def get_properties(self, blob_client: BlobClient, refresh: bool = False) -> BlobProperties:
+        """Retrieve the size, ETag and modification date of the blob.
+        These are taken from the properties cache, unless a ``refresh`` is requested.
+        """
+        if self.properties_cache is None:
+            return self._get_properties(blob_client)
+        if refresh:
+            self.properties_cache.discard(blob_client.url)
+        return self.properties_cache.fetch(
+            blob_client.url, partial(self._get_properties, blob_client)
+        )
+
+    def _get_properties(self, blob_client: BlobClient) -> BlobProperties:
+        call = azure_call("properties", blob=blob_client.blob_name)
+        with _translate_errors(blob_client), call:
+            return blob_client.get_blob_properties()
+
+    def download(
+        self,
+        blob_client: BlobClient,
+        offset: int | None = None,
+        length: int | None = None,
+        if_none_match: str | None = None,
+        if_modified_since: datetime | None = None,
+        if_match: str | None = None,
+        store_in_cache: bool = False,
+    ) -> io.RawIOBase:
+        """Download the blob, or only the byte range of it when an offset is given.
+        The returned stream has the blob ``properties`` from the download response.
+        """
+        if offset is None:
+            _check_known_properties(
+                self.properties_cache, blob_client, if_none_match, if_modified_since
+            )
+        fetch = partial(
+            blob_client.download_blob,
+            offset=offset,
+            length=length,
+            if_modified_since=if_modified_since,
+            **_get_match_conditions(if_none_match, if_match),
+        )
+        call = azure_call("download", blob=blob_client.blob_name, offset=offset, length=length)
+        with _translate_errors(blob_client, self.properties_cache), call:
+            # The initial request also fetches the first chunk, so this is the first byte.
+            downloader = self.hedger.call(fetch) if self.hedger is not None else fetch()
+        if offset is None and self.properties_cache is not None:
+            self.properties_cache.store(blob_client.url, downloader.properties)
+
+        if self.concurrency > 1 and downloader.size > self.segment_size * 2:
+            chunks = self._get_segmented_chunks(blob_client, downloader, offset or 0)
+        else:
+            chunks = downloader.chunks()
+            if self.resume_attempts:
+                chunks = resume_chunks(
+                    blob_client,
+                    chunks,
+                    offset=offset or 0,
+                    length=downloader.size,
+                    etag=downloader.properties.etag,
+                    attempts=self.resume_attempts,
+                )
+            if self.streaming:
+                chunks = read_ahead(chunks, self.read_ahead_chunks)
+
+        if store_in_cache and downloader.size <= self.cache.max_size:
+            cache_name = _get_cache_name(blob_client)
+            chunks = self.cache.store(cache_name, downloader.properties.etag, chunks)
+
+        chunks = traced_chunks(chunks, "proxy.stream", {"blob": blob_client.blob_name})
+        if self.streaming:
+            stream = ChunkedStream(chunks, size=downloader.size)
+        elif self.spool_threshold and downloader.size > self.spool_threshold:
+            # A real file can be sent by the WSGI server with sendfile(), bypassing Python.
+            stream = spool(chunks, self.spool_dir)
+        else:
+            stream = io.BytesIO()
+            for chunk in chunks:
+                stream.write(chunk)
+            stream.seek(0)
+
+        stream.properties = downloader.properties
         return stream
+
+    def _get_segmented_chunks(
+        self, blob_client: BlobClient, downloader: StorageStreamDownloader, offset: int
+    ) -> Iterator[bytes]:
+        """Stream the first chunk that the initial request already fetched,
+        and fetch the remainder in parallel segments.
+        """
+        first_chunk = next(downloader.chunks(), b"")
+        yield first_chunk
+        yield from segmented_download(
+            blob_client,
+            offset=offset + len(first_chunk),
+            length=downloader.size - len(first_chunk),
+            etag=downloader.properties.etag,
+            segment_size=self.segment_size,
+            concurrency=self.concurrency,
+            resume_attempts=self.resume_attempts,
+        )
+
+
+def segmented_download(
+    blob_client: BlobClient,
+    offset: int,
+    length: int,
+    etag: str,
+    segment_size: int,
+    concurrency: int,
+    resume_attempts: int = 0,
+) -> Iterator[bytes]:
+    """Download a byte range as parallel ranged segments, and yield them in order.
+
+    At most ``concurrency`` segments are in flight or waiting to be sent,
+    so fast segments can't pile up in memory while the client is slow.
+    All segments are pinned to the ETag, so the content can't change halfway.
+    A segment that fails halfway is continued where it stopped.
+    """
+
+    def _fetch(start: int, size: int) -> bytes:
+        with azure_call("segment", blob=blob_client.blob_name, offset=start, length=size):
+            downloader = blob_client.download_blob(
+                offset=start,
+                length=size,
+                etag=etag,
+                match_condition=MatchConditions.IfNotModified,
+            )
+        if not resume_attempts:
+            return downloader.readall()
+        return b"".join(
+            resume_chunks(blob_client, downloader.chunks(), start, size, etag, resume_attempts)
+        )
+
+    segments = (
+        (start, min(segment_size, offset + length - start))
+        for start in range(offset, offset + length, segment_size)
+    )
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="blob-segment")
+    pending = deque()
+    try:
+        for segment in segments:
+            pending.append(executor.submit(_fetch, *segment))
+            if len(pending) >= concurrency:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # Also stop fetching when the client disconnected.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+class AsyncConfidentialDataClient:
+    """Async variant of the :class:`ConfidentialDataClient`, used by the ASGI view.
+
+    The downloader only fetches the next chunk when the previous one is consumed,
+    so a slow client naturally slows down the download from the storage account.
+    """
+
+    def __init__(
+        self,
+        base_url,
+        chunk_size: int = 4 * 1024 * 1024,
+        properties_cache: PropertiesCache | None = None,
+        container: str = CONTAINER_NAME,
+    ) -> None:
+        self.properties_cache = properties_cache
+        self.container = container
+        self.blob_service_client = async_client_registry.get_blob_service_client(
+            base_url, chunk_size=chunk_size
+        )
+
+    def get_blob_client(self, request: Request, suffix: str = "") -> AsyncBlobClient:
+        """Translate the request path into the client for the blob."""
+        return self.blob_service_client.get_blob_client(
+            self.container, get_blob_path(request) + suffix
+        )
+
+    async def get_properties(
+        self, blob_client: AsyncBlobClient, refresh: bool = False
+    ) -> BlobProperties:
+        """Retrieve the size, ETag and modification date of the blob.
+        These are taken from the properties cache, unless a ``refresh`` is requested.
+        """
+        if self.properties_cache is not None:
+            if refresh:
+                self.properties_cache.discard(blob_client.url)
+            elif (properties := self.properties_cache.get(blob_client.url)) is not None:
+                return properties
+
+        call = azure_call("properties", blob=blob_client.blob_name)
+        with _translate_errors(blob_client, self.properties_cache), call:
+            properties = await blob_client.get_blob_properties()
+        if self.properties_cache is not None:
+            self.properties_cache.store(blob_client.url, properties)
+        return properties
+
+    async def download(
+        self,
+        blob_client: AsyncBlobClient,
+        offset: int | None = None,
+        length: int | None = None,
+        if_none_match: str | None = None,
+        if_modified_since: datetime | None = None,
+        if_match: str | None = None,
+    ) -> AsyncStorageStreamDownloader:
+        """Start the download, the ``chunks()`` of the result provide the data."""
+        if offset is None:
+            _check_known_properties(
+                self.properties_cache, blob_client, if_none_match, if_modified_since
+            )
+        call = azure_call("download", blob=blob_client.blob_name, offset=offset, length=length)
+        with _translate_errors(blob_client, self.properties_cache), call:
+            downloader = await blob_client.download_blob(
+                offset=offset,
+                length=length,
+                if_modified_since=if_modified_since,
+                **_get_match_conditions(if_none_match, if_match),
+            )
+        if offset is None and self.properties_cache is not None:
+            self.properties_cache.store(blob_client.url, downloader.properties)
+        return downloader
@@ -0,0 +1,197 @@
+import io
+import logging
+import os
+import tempfile
+import threading
+from collections.abc import Callable, Hashable
+from functools import cache
+
+from django.conf import settings
+
+from vertrouwelijke_data_proxy import metrics
+from vertrouwelijke_data_proxy.processes import PerProcess
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadCoalescer(PerProcess):
+    """Share a single download from the storage account between concurrent requests.
+
+    The first request for a blob starts the download. A background thread writes it into
+    an anonymous temporary file, and every request reads from that file at its own pace.
+    Requests for the same blob that arrive while the download is in progress attach to it,
+    so a burst of requests for a newly published file results in a single download.
+    Memory use stays flat, slow clients only take disk space until they're done.
+    """
+
+    def __init__(self, spool_dir: str | None = None, chunk_size: int = 4 * 1024 * 1024):
+        self.spool_dir = spool_dir
+        self.chunk_size = chunk_size
+        self._check_pid()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def open(self, key: Hashable, download: Callable[[], io.RawIOBase]) -> "SharedDownloadReader":
+        """Attach to the download in progress, or start it.
+
+        The ``download`` callable starts the download, and returns a stream with the
+        ``size`` and ``properties`` of the blob. Its errors are raised to the caller.
+        """
+        self._check_pid()
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = _Flight(self, key)
+                self._flights[key] = flight
+                is_leader = True
+            else:
+                is_leader = False
+
+        if is_leader:
+            try:
+                stream = download()
+            except BaseException as e:
+                self._finish(flight)
+                flight.fail(e)
+                raise
+            flight.start(stream, self.spool_dir, self.chunk_size)
+        elif not flight.wait_started():
+            # The first request failed (e.g. a 304 for its conditions), so do it separately.
+            return download()
+        else:
+            metrics.COALESCED_DOWNLOADS.inc()
+
+        return SharedDownloadReader(flight)
+
+    def _finish(self, flight: "_Flight"):
+        """Let new requests start a new download."""
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+
+class _Flight:
+    """The shared download of one blob, and its spool file."""
+
+    def __init__(self, coalescer: DownloadCoalescer, key: Hashable):
+        self.coalescer = coalescer
+        self.key = key
+        self.size = None
+        self.properties = None
+        self.written = 0
+        self.done = False
+        self.error = None
+        self.readers = 0
+        self._file = None
+        self._started = threading.Event()
+        self._condition = threading.Condition()
+
+    def start(self, stream: io.RawIOBase, spool_dir: str | None, chunk_size: int):
+        self.size = getattr(stream, "size", None)
+        self.properties = getattr(stream, "properties", None)
+        # The spool file has no name, and it's closed when the last reader is done.
+        self._file = tempfile.TemporaryFile(dir=spool_dir)  # noqa: SIM115
+        self.readers = 1  # the first request
+        self._started.set()
+        threading.Thread(
+            target=self._fetch, args=(stream, chunk_size), name="blob-coalesce", daemon=True
+        ).start()
+
+    def fail(self, error: BaseException):
+        self.error = error
+        self._started.set()
+
+    def wait_started(self) -> bool:
+        """Wait until the first request started the download, and attach to it."""
+        self._started.wait()
+        with self._condition:
+            if self._file is None or self.readers == 0:
+                return False  # the download failed, or was abandoned
+            self.readers += 1
+            return True
+
+    def _fetch(self, stream: io.RawIOBase, chunk_size: int):
+        """Write the download into the spool file, until it's complete or nobody reads it."""
+        try:
+            while chunk := stream.read(chunk_size):
+                os.pwrite(self._file.fileno(), chunk, self.written)
+                with self._condition:
+                    self.written += len(chunk)
+                    self._condition.notify_all()
+                    if self.readers == 0:
+                        return  # all clients disconnected
+        except Exception as e:  # noqa: BLE001, raised in the readers
+            logger.warning("Shared download of %s failed: %s", self.key, e)
+            with self._condition:
+                self.error = e
+        finally:
+            self.coalescer._finish(self)
+            stream.close()
+            with self._condition:
+                self.done = True
+                self._condition.notify_all()
+                if self.readers == 0:
+                    self._file.close()
+
+    def read(self, offset: int, size: int) -> bytes:
+        """Read from the spool file, and wait when the download didn't reach the offset yet."""
+        with self._condition:
+            while offset >= self.written and not self.done:
+                self._condition.wait()
+            if offset >= self.written:
+                if self.error is not None:
+                    raise self.error
+                return b""
+            size = min(size, self.written - offset)
+        return os.pread(self._file.fileno(), size, offset)
+
+    def detach(self):
+        with self._condition:
+            self.readers -= 1
+            if self.readers == 0 and self.done:
+                self._file.close()
+
+
+class SharedDownloadReader(io.RawIOBase):
+    """A file-like object that reads the shared download, with the blob ``size`` and
+    ``properties`` just like the stream of a regular download.
+    """
+
+    def __init__(self, flight: _Flight):
+        super().__init__()
+        self._flight = flight
+        self._offset = 0
+        self.size = flight.size
+        self.properties = flight.properties
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            return self.readall()
+        data = self._flight.read(self._offset, size)
+        self._offset += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._flight.detach()
+        super().close()
+
+
+@cache
+def get_download_coalescer() -> DownloadCoalescer | None:
+    """Provide the download coalescer for this process, if it's enabled in the settings."""
+    if not settings.COALESCE_DOWNLOADS:
+        return None
+    return DownloadCoalescer(
+        settings.COALESCE_SPOOL_DIR, chunk_size=settings.AZURE_STORAGE_CHUNK_SIZE
+    )
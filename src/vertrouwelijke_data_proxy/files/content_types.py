@@ -0,0 +1,25 @@
+"""Properties of content types, shared by the compression and the ZIP bundles."""
+
+# Content types that don't get any smaller by compressing them again.
+INCOMPRESSIBLE_CONTENT_TYPES = {
+    "application/gzip",
+    "application/octet-stream",
+    "application/vnd.apache.parquet",
+    "application/x-7z-compressed",
+    "application/x-brotli",
+    "application/x-bzip",
+    "application/x-bzip2",
+    "application/x-compress",
+    "application/x-gzip",
+    "application/x-xz",
+    "application/zip",
+    "application/zstd",
+}
+INCOMPRESSIBLE_PREFIXES = ("image/", "audio/", "video/", "application/vnd.openxmlformats")
+
+
+def is_incompressible(content_type: str) -> bool:
+    """Tell whether the content is already compressed."""
+    return content_type in INCOMPRESSIBLE_CONTENT_TYPES or content_type.startswith(
+        INCOMPRESSIBLE_PREFIXES
+    )
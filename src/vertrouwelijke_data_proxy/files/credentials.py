@@ -0,0 +1,101 @@
+import logging
+import threading
+import time
+
+from azure.core.credentials import AccessToken, TokenCredential
+
+logger = logging.getLogger(__name__)
+
+STORAGE_SCOPE = "https://storage.azure.com/.default"
+
+# Tokens are used until shortly before they expire, when the refresh failed.
+MIN_VALIDITY = 30
+RETRY_INTERVAL = 30
+
+
+class PrefetchingCredential:
+    """Token credential that keeps the tokens fresh in a background thread.
+
+    The wrapped credential (e.g. ``DefaultAzureCredential``) probes its chain on the first
+    token request, and keeps using the credential of the chain that worked after that.
+    Tokens are refreshed ``refresh_margin`` seconds before they expire, so the SDK pipeline
+    always receives a valid token from memory, and requests never wait for a token.
+    Only the very first request (or a claims challenge) fetches the token inline.
+    """
+
+    def __init__(self, credential: TokenCredential, refresh_margin: float = 600):
+        self._credential = credential
+        self.refresh_margin = refresh_margin
+        self._tokens = {}
+        self._refresh_at = {}
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def prefetch(self, *scopes: str):
+        """Fetch the token in advance, e.g. when the worker process starts."""
+        try:
+            self.get_token(*(scopes or (STORAGE_SCOPE,)))
+        except Exception as e:  # noqa: BLE001, the first download will try again
+            logger.warning("Unable to prefetch token: %s", e)
+
+    def get_token(self, *scopes: str, claims: str | None = None, **kwargs) -> AccessToken:
+        if claims:
+            # A claims challenge needs a new token, which shouldn't be cached.
+            return self._credential.get_token(*scopes, claims=claims, **kwargs)
+
+        key = (scopes, frozenset(kwargs.items()))
+        token = self._tokens.get(key)
+        if token is None or token.expires_on - time.time() < MIN_VALIDITY:
+            with self._fetch_lock:
+                # Another thread could have fetched it in the meantime.
+                token = self._tokens.get(key)
+                if token is None or token.expires_on - time.time() < MIN_VALIDITY:
+                    token = self._fetch(key)
+        return token
+
+    def _fetch(self, key) -> AccessToken:
+        scopes, kwargs = key
+        token = self._credential.get_token(*scopes, **dict(kwargs))
+        self._store(key, token)
+        self._start_refresh()
+        return token
+
+    def _store(self, key, token: AccessToken):
+        now = time.time()
+        lifetime = token.expires_on - now
+        with self._lock:
+            self._tokens[key] = token
+            # Short-lived tokens are refreshed halfway their lifetime.
+            self._refresh_at[key] = now + max(lifetime - self.refresh_margin, lifetime / 2)
+
+    def _start_refresh(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._refresh_loop, name="token-refresh", daemon=True
+                )
+                self._thread.start()
+            else:
+                self._wakeup.set()  # recalculate the next refresh time
+
+    def _refresh_loop(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            with self._lock:
+                due = [key for key, refresh_at in self._refresh_at.items() if refresh_at <= now]
+
+            for key in due:
+                scopes, kwargs = key
+                try:
+                    self._store(key, self._credential.get_token(*scopes, **dict(kwargs)))
+                except Exception as e:  # noqa: BLE001, the current token is still valid
+                    logger.warning("Unable to refresh token, retrying: %s", e)
+                    with self._lock:
+                        self._refresh_at[key] = now + RETRY_INTERVAL
+
+            with self._lock:
+                next_refresh = min(self._refresh_at.values())
+            self._wakeup.wait(timeout=max(next_refresh - time.time(), 1))
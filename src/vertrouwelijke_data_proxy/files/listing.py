@@ -0,0 +1,81 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from functools import cache
+
+from django.conf import settings
+
+from vertrouwelijke_data_proxy.processes import PerProcess
+
+logger = logging.getLogger(__name__)
+
+
+class ListingCache(PerProcess):
+    """In-memory cache for directory listings, that refreshes its entries in the background.
+
+    Entries are fresh for ``ttl`` seconds. After that, the previous listing is still
+    returned for at most ``stale_ttl`` seconds while a background thread fetches it again.
+    This way, heavy listing traffic leads to at most one storage call per page per TTL,
+    and clients never wait for a refresh. Only entries that are too old are fetched inline.
+    """
+
+    def __init__(self, ttl: float, stale_ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._check_pid()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._refreshing = set()
+
+    def get(self, key: Hashable, fetch: Callable[[], dict]) -> dict:
+        """Return the cached value, or fetch it when it's missing or expired."""
+        self._check_pid()
+        now = time.monotonic()
+        with self._lock:
+            if (entry := self._entries.get(key)) is not None:
+                fetched_at, value = entry
+                age = now - fetched_at
+                if age < self.ttl + self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    if age >= self.ttl and key not in self._refreshing:
+                        self._refreshing.add(key)
+                        threading.Thread(
+                            target=self._refresh, args=(key, fetch), daemon=True
+                        ).start()
+                    return value
+
+        value = fetch()
+        self._store(key, value)
+        return value
+
+    def _refresh(self, key: Hashable, fetch: Callable[[], dict]):
+        try:
+            self._store(key, fetch())
+        except Exception as e:  # noqa: BLE001, keep serving the previous listing
+            logger.warning("Unable to refresh listing %r: %s", key, e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _store(self, key: Hashable, value: dict):
+        self._check_pid()
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+@cache
+def get_listing_cache() -> ListingCache:
+    """Provide the listing cache for this process."""
+    return ListingCache(
+        ttl=settings.LISTING_CACHE_TTL,
+        stale_ttl=settings.LISTING_CACHE_TTL,
+        max_entries=settings.LISTING_CACHE_SIZE,
+    )
@@ -1,23 +1,29 @@
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.permissions import BasePermission
 
+from .routing import resolve
 
-class IsFpMdw(BasePermission):
-    """Permission check, wrapped in a DRF permissions adapter"""
+
+class HasDatasetScopes(BasePermission):
+    """Permission check for the scopes of the dataset in the request path,
+    wrapped in a DRF permissions adapter.
+    """
 
     message = "Required scope not given."
 
     def has_permission(self, request, view):
-        """Check whether the user has fp_mdw scope"""
+        """Check whether the user has the scopes of the dataset (e.g. fp_mdw)"""
+        # The scopes are a frozenset per route, compiled from the DATASET_ROUTES setting.
+        needed_scopes = resolve(request)[0].scopes
+
         # When the access is granted, this skips going into the authorization middleware.
         # This is solely done to avoid incorrect log messages of "access granted",
         # because additional checks may still deny access.
-        needed_scope = frozenset({"FP/MDW"})
-        user_scopes = set(request.get_token_scopes)
-        if user_scopes.issuperset(needed_scope):
+        # The cached token scopes are a frozenset already, so these are not copied again.
+        if needed_scopes.issubset(request.get_token_scopes):
             return True
 
-        if not request.is_authorized_for(*needed_scope):
+        if not request.is_authorized_for(*needed_scopes):
             # Raise explicit error to provide error message
             raise PermissionDenied(self.message)
         else:
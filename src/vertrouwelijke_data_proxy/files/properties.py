@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from functools import cache
+from typing import TYPE_CHECKING
+
+from django.conf import settings
+
+from vertrouwelijke_data_proxy.processes import PerProcess
+
+if TYPE_CHECKING:
+    from azure.storage.blob import BlobProperties
+
+
+class PropertiesCache(PerProcess):
+    """In-memory cache for the properties of blobs, including the blobs that don't exist.
+
+    Entries expire after ``ttl`` seconds, a missing blob is remembered for ``negative_ttl``
+    seconds. This way, repeated requests for the same file (or a flood of requests for
+    a mistyped name) don't need a metadata round trip to the storage account.
+    A replaced blob is noticed after at most the TTL; downloads that depend on
+    the cached ETag are pinned to it, so they fail instead of mixing versions.
+    """
+
+    def __init__(self, ttl: float, negative_ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._check_pid()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key: Hashable) -> BlobProperties | None:
+        """Return the cached properties, or ``None`` when they're unknown.
+
+        :raises FileNotFoundError: When the blob is known not to exist.
+        """
+        self._check_pid()
+        with self._lock:
+            if (entry := self._entries.get(key)) is None:
+                return None
+            expires_at, properties = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+
+        if properties is None:
+            raise FileNotFoundError(f"{key} does not exist")
+        return properties
+
+    def fetch(self, key: Hashable, fetch: Callable[[], BlobProperties]) -> BlobProperties:
+        """Return the cached properties, or fetch them when they're missing or expired."""
+        if (properties := self.get(key)) is not None:
+            return properties
+
+        try:
+            properties = fetch()
+        except FileNotFoundError:
+            self.store_missing(key)
+            raise
+        self.store(key, properties)
+        return properties
+
+    def store(self, key: Hashable, properties: BlobProperties):
+        self._store(key, properties, self.ttl)
+
+    def store_missing(self, key: Hashable):
+        if self.negative_ttl:
+            self._store(key, None, self.negative_ttl)
+
+    def discard(self, key: Hashable):
+        self._check_pid()
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _store(self, key: Hashable, properties: BlobProperties | None, ttl: float):
+        self._check_pid()
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, properties)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+@cache
+def get_properties_cache() -> PropertiesCache | None:
+    """Provide the properties cache for this process, unless it's disabled in the settings."""
+    if not settings.PROPERTIES_CACHE_TTL:
+        return None
+    return PropertiesCache(
+        ttl=settings.PROPERTIES_CACHE_TTL,
+        negative_ttl=settings.PROPERTIES_CACHE_NEGATIVE_TTL,
+        max_entries=settings.PROPERTIES_CACHE_SIZE,
+    )
@@ -0,0 +1,101 @@
+"""Parsing of the HTTP ``Range`` header (RFC 9110, section 14)."""
+
+import re
+from datetime import datetime
+
+from django.http import HttpRequest
+from django.utils.http import parse_http_date_safe
+
+# Avoid that a client can request thousands of tiny ranges, that each need an Azure call.
+MAX_RANGES = 20
+
+RE_RANGE_SPEC = re.compile(r"^(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(ValueError):
+    """None of the requested ranges overlap with the file."""
+
+
+def parse_range_header(header: str, size: int) -> list[tuple[int, int]] | None:
+    """Parse the ``Range`` header into a list of ``(start, end)`` byte ranges.
+
+    The ``end`` position is inclusive, just like in the header itself.
+    Overlapping and adjacent ranges are merged. This returns ``None`` when the header
+    must be ignored (unknown unit or invalid syntax), which means the whole file is served.
+
+    :raises RangeNotSatisfiable: When none of the ranges overlap with the file.
+    """
+    unit, _, range_set = header.partition("=")
+    if unit.strip().lower() != "bytes" or not range_set:
+        return None
+
+    ranges = []
+    for spec in range_set.split(","):
+        if not (match := RE_RANGE_SPEC.match(spec.strip())):
+            return None
+
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+            if last and end < start:
+                return None  # invalid syntax, header is ignored
+        elif last:
+            # Suffix range: the last N bytes
+            if not int(last):
+                continue  # "-0" can never be satisfied
+            start = max(size - int(last), 0)
+            end = size - 1
+        else:
+            return None
+
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    ranges = _merge_ranges(ranges)
+    return ranges if len(ranges) <= MAX_RANGES else None
+
+
+def _merge_ranges(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_matches(header: str, etag: str, last_modified: datetime) -> bool:
+    """Tell whether the ``If-Range`` condition holds, so the ``Range`` header can be used.
+
+    Only strong validators are allowed here, so weak ETags never match.
+    """
+    header = header.strip()
+    if header.startswith('"'):
+        return header == etag
+    elif header.startswith("W/"):
+        return False
+    else:
+        timestamp = parse_http_date_safe(header)
+        return timestamp is not None and timestamp == int(last_modified.timestamp())
+
+
+def get_requested_ranges(request: HttpRequest, properties) -> list[tuple[int, int]] | None:
+    """Tell which byte ranges should be served for the request.
+    This returns ``None`` when the whole file should be served instead.
+
+    :raises RangeNotSatisfiable: When none of the ranges overlap with the file.
+    """
+    if_range = request.headers.get("If-Range")
+    if if_range and not if_range_matches(if_range, properties.etag, properties.last_modified):
+        return None  # file changed since the previous partial download.
+
+    return parse_range_header(request.headers["Range"], properties.size)
+
+
+def content_range(start: int, end: int, size: int) -> str:
+    return f"bytes {start}-{end}/{size}"
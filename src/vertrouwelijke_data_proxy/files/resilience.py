@@ -0,0 +1,214 @@
+"""Protection against slow and failing downloads from the storage account.
+
+A download that drops halfway is continued from the last byte that was delivered,
+pinned to the ETag of the blob, so the client receives the same file without noticing.
+Stalled reads are ended by the read timeout of the HTTP transport (see ``ClientRegistry``).
+Optionally, a second request is started when the first byte takes longer than usual,
+and the first response that arrives is used.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache, partial
+from typing import TYPE_CHECKING, TypeVar
+
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseError
+from django.conf import settings
+
+from vertrouwelijke_data_proxy import metrics
+from vertrouwelijke_data_proxy.metrics import azure_call
+
+if TYPE_CHECKING:
+    from azure.storage.blob import BlobClient
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def is_transient(error: BaseException) -> bool:
+    """Tell whether the request can be repeated, as the error is caused by the connection
+    or the storage account. A 404, 304 or 412 is an answer, not a failure.
+    """
+    if isinstance(error, (ServiceRequestError, ServiceResponseError)):
+        return True
+    return isinstance(error, HttpResponseError) and (
+        error.status_code is None or error.status_code >= 500
+    )
+
+
+def resume_chunks(
+    blob_client: BlobClient,
+    chunks: Iterable[bytes],
+    offset: int,
+    length: int,
+    etag: str,
+    attempts: int,
+) -> Iterator[bytes]:
+    """Yield the chunks of a download, and continue at the last delivered byte when it fails.
+
+    The continued download is pinned to the ETag, so a blob that was replaced in the meantime
+    raises a ``ResourceModifiedError`` instead of mixing two versions.
+    """
+    position = offset
+    end = offset + length
+    failures = 0
+    chunks = iter(chunks)
+    while True:
+        try:
+            if chunks is None:
+                with azure_call("resume", blob=blob_client.blob_name, offset=position):
+                    downloader = blob_client.download_blob(
+                        offset=position,
+                        length=end - position,
+                        etag=etag,
+                        match_condition=MatchConditions.IfNotModified,
+                    )
+                chunks = downloader.chunks()
+            chunk = next(chunks, None)
+        except (ServiceRequestError, ServiceResponseError, HttpResponseError) as e:
+            if not is_transient(e) or failures >= attempts:
+                raise
+            failures += 1
+            metrics.DOWNLOAD_RESUMES.inc()
+            logger.warning(
+                "Download of %s failed at byte %d, resuming: %s",
+                blob_client.blob_name,
+                position,
+                e,
+            )
+            chunks = None
+            continue
+
+        if chunk is None:
+            return
+        position += len(chunk)
+        yield chunk
+
+
+class Hedger:
+    """Start a second request when the first one takes longer than most recent requests.
+
+    The delay is the ``percentile`` of the latest times to the response headers, so only
+    the slowest requests are repeated (e.g. 5% for the 95th percentile), and the extra
+    load stays small. The request whose headers arrive first is used. The other request
+    is aborted as soon as its headers arrive, before its body is read.
+    Until enough response times are known, requests aren't hedged.
+    """
+
+    def __init__(
+        self,
+        percentile: float,
+        min_delay: float = 0.05,
+        samples: int = 200,
+        min_samples: int = 20,
+        max_workers: int = 10,
+    ):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._durations = deque(maxlen=samples)
+        self._executor = None
+
+    def get_delay(self) -> float | None:
+        """Tell how long to wait for the first request, ``None`` when that's still unknown."""
+        with self._lock:
+            if len(self._durations) < self.min_samples:
+                return None
+            durations = sorted(self._durations)
+        index = min(len(durations) - 1, int(len(durations) * self.percentile / 100))
+        return max(self.min_delay, durations[index])
+
+    def record(self, duration: float):
+        with self._lock:
+            self._durations.append(duration)
+
+    def call(self, fetch: Callable[..., T]) -> T:
+        """Perform the request, and repeat it in parallel when its headers are late.
+        The ``fetch`` callable receives the ``raw_response_hook`` of the Azure SDK.
+        """
+        race = _Race(self)
+        if (delay := self.get_delay()) is None:
+            return fetch(raw_response_hook=race.get_hook(0))
+
+        executor = self._get_executor()
+        futures = [executor.submit(fetch, raw_response_hook=race.get_hook(0))]
+        futures[0].add_done_callback(race.notify)
+        if not race.changed.wait(delay):
+            metrics.HEDGED_REQUESTS.inc()
+            futures.append(executor.submit(fetch, raw_response_hook=race.get_hook(1)))
+            futures[1].add_done_callback(race.notify)
+
+        while True:
+            race.changed.clear()
+            if race.winner is not None:
+                return futures[race.winner].result()
+            if all(future.done() for future in futures):
+                # Neither request received a response, e.g. both connections failed.
+                return futures[0].result()
+            race.changed.wait()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="blob-hedge"
+                )
+            return self._executor
+
+
+class _RequestAbandoned(Exception):
+    """The other hedged request received its response first."""
+
+
+class _Race:
+    """Pick the request of which the response headers arrive first."""
+
+    def __init__(self, hedger: Hedger):
+        self.hedger = hedger
+        self.start = time.monotonic()
+        self.winner = None
+        self.changed = threading.Event()
+        self._lock = threading.Lock()
+
+    def get_hook(self, attempt: int) -> Callable:
+        return partial(self._on_response, attempt)
+
+    def notify(self, future=None):
+        self.changed.set()
+
+    def _on_response(self, attempt: int, pipeline_response):
+        """Called by the SDK for every response, before its body is read."""
+        status = pipeline_response.http_response.status_code
+        if status >= 500 or status in (408, 429):
+            return  # retried by the SDK pipeline
+
+        with self._lock:
+            if self.winner is None:
+                self.winner = attempt
+                self.hedger.record(time.monotonic() - self.start)
+            won = self.winner == attempt
+        if not won:
+            # Stop the transfer, this closes the connection instead of reading the body.
+            pipeline_response.http_response.close()
+            raise _RequestAbandoned()
+        self.notify()
+
+
+@cache
+def get_hedger() -> Hedger | None:
+    """Provide the hedging of the downloads for this process, if it's enabled in the settings."""
+    if not settings.AZURE_STORAGE_HEDGE_PERCENTILE:
+        return None
+    return Hedger(
+        settings.AZURE_STORAGE_HEDGE_PERCENTILE, max_workers=settings.AZURE_STORAGE_POOL_SIZE * 2
+    )
@@ -0,0 +1,146 @@
+"""Routing of the request paths to the datasets.
+
+Each route maps a path prefix to a dataset: a container in a storage account,
+and the scopes that a token needs to read it. The routes are configured in the
+``DATASET_ROUTES`` setting, and compiled once into a trie of path segments.
+A lookup only follows the segments of the path, regardless of the number of routes.
+The longest matching prefix wins, the remainder of the path is the blob name.
+
+Paths under ``/_proxy/`` belong to the proxy itself (e.g. the ZIP bundles),
+so blobs are never served from there and no route can use that prefix.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import Http404
+
+# Path segment of the endpoints of the proxy itself, outside of the blob paths.
+RESERVED_SEGMENT = "_proxy"
+# A bundle is requested per dataset route, e.g. /_proxy/bundle/other/?path=...
+BUNDLE_PREFIX = f"{RESERVED_SEGMENT}/bundle/"
+
+
+@dataclass(frozen=True)
+class Dataset:
+    """A container of confidential data, and the scopes that are needed to read it."""
+
+    container: str
+    scopes: frozenset[str]
+    # Without an account, the AZURE_STORAGE_CONTAINER_ENDPOINT is used.
+    account_url: str | None = None
+
+    def get_account_url(self) -> str:
+        return self.account_url or settings.AZURE_STORAGE_CONTAINER_ENDPOINT
+
+
+class _Node:
+    __slots__ = ("children", "dataset")
+
+    def __init__(self):
+        self.children = {}
+        self.dataset = None
+
+
+class RoutingTable:
+    """Prefix trie of the routes, by path segment."""
+
+    def __init__(self, routes: dict[str, Dataset]):
+        self.prefixes = []
+        self._root = _Node()
+        for prefix, dataset in routes.items():
+            segments = [segment for segment in prefix.split("/") if segment]
+            node = self._root
+            for segment in segments:
+                node = node.children.setdefault(segment, _Node())
+            node.dataset = dataset
+            self.prefixes.append("".join(f"{segment}/" for segment in segments))
+
+    def match(self, path: str) -> tuple[Dataset, str] | None:
+        """Find the dataset of the path (without leading slash), and the path within it."""
+        node = self._root
+        found = (node.dataset, path) if node.dataset is not None else None
+        start = 0
+        while (end := path.find("/", start)) != -1:
+            if (node := node.children.get(path[start:end])) is None:
+                return found
+            start = end + 1
+            if node.dataset is not None:
+                found = (node.dataset, path[start:])
+
+        # The prefix itself, without a trailing slash, is the root folder of the dataset.
+        if (node := node.children.get(path[start:])) is not None and node.dataset is not None:
+            found = (node.dataset, "")
+        return found
+
+
+def compile_routes(routes: list[dict]) -> RoutingTable:
+    """Translate the ``DATASET_ROUTES`` setting into the routing table.
+    Routes with the same container, account and scopes share the same ``Dataset``.
+
+    :raises ImproperlyConfigured: When a route misses its container or scopes,
+        or uses the reserved prefix of the proxy.
+    """
+    for route in routes:
+        if _is_reserved(str(route.get("prefix", ""))):
+            raise ImproperlyConfigured(
+                f"Invalid DATASET_ROUTES: the prefix /{RESERVED_SEGMENT}/ is reserved"
+            )
+    try:
+        return RoutingTable(
+            {
+                route.get("prefix", ""): Dataset(
+                    container=route["container"],
+                    scopes=_get_scopes(route),
+                    account_url=route.get("account"),
+                )
+                for route in routes
+            }
+        )
+    except (KeyError, TypeError) as e:
+        raise ImproperlyConfigured(f"Invalid DATASET_ROUTES: {e}") from e
+
+
+def _get_scopes(route: dict) -> frozenset[str]:
+    # Without scopes, anyone could read the container, even without a token.
+    scopes = route["scopes"]
+    if not scopes or not isinstance(scopes, list) or not all(isinstance(s, str) for s in scopes):
+        raise ImproperlyConfigured(
+            f"Invalid DATASET_ROUTES: the scopes of {route.get('prefix', '')!r}"
+            " should be a non-empty list of strings"
+        )
+    return frozenset(scopes)
+
+
+def _is_reserved(path: str) -> bool:
+    return path.lstrip("/").partition("/")[0] == RESERVED_SEGMENT
+
+
+@cache
+def get_routing_table() -> RoutingTable:
+    """Provide the routing table, which is compiled on first use (or by the warm-up)."""
+    return compile_routes(settings.DATASET_ROUTES)
+
+
+def resolve_path(path: str) -> tuple[Dataset, str]:
+    """Find the dataset of a path, and the blob name (or folder) within it.
+
+    :raises Http404: When no route matches the path, or it's reserved for the proxy.
+    """
+    if _is_reserved(path) or (found := get_routing_table().match(path.lstrip("/"))) is None:
+        raise Http404("No dataset at this path")
+    return found
+
+
+def resolve(request) -> tuple[Dataset, str]:
+    """Find the dataset of the request path.
+    For a bundle, this is the dataset of the path after the bundle prefix.
+    """
+    path = request.path.lstrip("/")
+    if path.startswith(BUNDLE_PREFIX):
+        path = path[len(BUNDLE_PREFIX) :]
+    return resolve_path(path)
@@ -0,0 +1,98 @@
+"""Short-lived SAS URLs, so clients can download a blob directly from the storage account.
+
+The SAS is signed with a user delegation key, which the storage account hands out
+to the Entra ID identity of the proxy. No account key is needed, and the key is
+only valid for a limited time. It's requested once, and renewed in the background.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from datetime import UTC, datetime, timedelta
+from typing import TYPE_CHECKING
+
+from django.utils.http import content_disposition_header
+
+from vertrouwelijke_data_proxy.metrics import azure_call
+
+if TYPE_CHECKING:
+    from azure.storage.blob import BlobClient, BlobServiceClient, UserDelegationKey
+
+logger = logging.getLogger(__name__)
+
+# Allow for clock differences between the proxy and the storage account.
+CLOCK_SKEW = timedelta(minutes=5)
+
+
+class UserDelegationKeyCache:
+    """Provide the user delegation key of the storage account.
+
+    The key is renewed in a background thread when half of its lifetime has passed,
+    so signing a URL doesn't wait for the storage account. Only the first request,
+    or a key that's about to expire, fetches the key inline.
+    """
+
+    def __init__(self, service_client: BlobServiceClient, lifetime: int = 24 * 3600):
+        self.service_client = service_client
+        self.lifetime = timedelta(seconds=lifetime)
+        self._key = None
+        self._expiry = None
+        self._fetch_lock = threading.Lock()
+        self._refreshing = threading.Event()
+
+    def get_key(self, min_validity: int) -> UserDelegationKey:
+        """Return a key that is valid for at least ``min_validity`` seconds."""
+        now = datetime.now(UTC)
+        key, expiry = self._key, self._expiry
+        if key is None or expiry - now < timedelta(seconds=min_validity) + CLOCK_SKEW:
+            with self._fetch_lock:
+                # Another thread could have fetched it in the meantime.
+                key, expiry = self._key, self._expiry
+                if key is None or expiry - now < timedelta(seconds=min_validity) + CLOCK_SKEW:
+                    key = self._fetch()
+        elif expiry - now < self.lifetime / 2 and not self._refreshing.is_set():
+            self._refreshing.set()
+            threading.Thread(target=self._refresh, name="delegation-key", daemon=True).start()
+        return key
+
+    def _fetch(self) -> UserDelegationKey:
+        now = datetime.now(UTC)
+        with azure_call("delegation_key"):
+            key = self.service_client.get_user_delegation_key(
+                key_start_time=now - CLOCK_SKEW, key_expiry_time=now + self.lifetime
+            )
+        self._key, self._expiry = key, now + self.lifetime
+        return key
+
+    def _refresh(self):
+        try:
+            with self._fetch_lock:
+                self._fetch()
+        except Exception as e:  # noqa: BLE001, the current key is still valid
+            logger.warning("Unable to renew the user delegation key: %s", e)
+        finally:
+            self._refreshing.clear()
+
+
+def generate_download_url(
+    blob_client: BlobClient, key: UserDelegationKey, lifetime: int, filename: str
+) -> str:
+    """Create a read-only URL for a single blob, that expires after ``lifetime`` seconds.
+    The storage account returns the file as attachment, just like the proxy does.
+    """
+    from azure.storage.blob import BlobSasPermissions, generate_blob_sas
+
+    now = datetime.now(UTC)
+    sas = generate_blob_sas(
+        account_name=blob_client.account_name,
+        container_name=blob_client.container_name,
+        blob_name=blob_client.blob_name,
+        user_delegation_key=key,
+        permission=BlobSasPermissions(read=True),
+        start=now - CLOCK_SKEW,
+        expiry=now + timedelta(seconds=lifetime),
+        protocol="https" if blob_client.scheme == "https" else "https,http",
+        content_disposition=content_disposition_header(True, filename),
+    )
+    return f"{blob_client.url}?{sas}"
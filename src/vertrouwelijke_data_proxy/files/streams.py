@@ -0,0 +1,144 @@
+import io
+import queue
+import tempfile
+import threading
+from collections.abc import Callable, Iterable, Iterator
+
+from django.http import HttpResponseBase
+
+_DONE = object()
+
+
+def read_ahead(chunks: Iterable[bytes], max_chunks: int) -> Iterator[bytes]:
+    """Fetch the next chunks in a background thread, while the current chunk is being sent.
+
+    The buffer is bounded, so a slow client can't make it grow beyond ``max_chunks``.
+    When the consumer stops early (e.g. the client disconnects), the thread stops too.
+    """
+    if max_chunks <= 0:
+        yield from chunks
+        return
+
+    buffer = queue.Queue(maxsize=max_chunks)
+    stopped = threading.Event()
+    thread = threading.Thread(
+        target=_produce, args=(chunks, buffer, stopped), name="blob-read-ahead", daemon=True
+    )
+    thread.start()
+    try:
+        while (item := buffer.get()) is not _DONE:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+
+
+def _produce(chunks: Iterable[bytes], buffer: queue.Queue, stopped: threading.Event):
+    """Fill the read-ahead buffer, until all chunks are read or the consumer stopped."""
+    chunks = iter(chunks)
+    try:
+        for chunk in chunks:
+            if not _put(buffer, stopped, chunk):
+                return
+    except Exception as e:  # noqa: BLE001, reraised in the consumer thread
+        _put(buffer, stopped, e)
+    else:
+        _put(buffer, stopped, _DONE)
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()  # let generators clean up in this thread.
+
+
+def _put(buffer: queue.Queue, stopped: threading.Event, item) -> bool:
+    while not stopped.is_set():
+        try:
+            buffer.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+class ChunkedStream(io.RawIOBase):
+    """A read-only file-like object on top of an iterator of chunks.
+
+    This allows ``FileResponse`` to stream the data, while only the current chunk is kept
+    in memory. When the requested size covers the chunk, it's returned as-is without copying.
+    """
+
+    def __init__(self, chunks: Iterable[bytes], size: int | None = None):
+        super().__init__()
+        self._chunks = iter(chunks)
+        self._chunk = b""
+        self._offset = 0
+        self.size = size
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            return self.readall()
+
+        if self._offset >= len(self._chunk):
+            self._chunk = next(self._chunks, b"")
+            self._offset = 0
+
+        if self._offset == 0 and size >= len(self._chunk):
+            data = self._chunk
+        else:
+            data = self._chunk[self._offset : self._offset + size]
+        self._offset += len(data)
+        return data
+
+    def readall(self) -> bytes:
+        return b"".join(iter(lambda: self.read(io.DEFAULT_BUFFER_SIZE), b""))
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed and hasattr(self._chunks, "close"):
+            self._chunks.close()  # stops the read-ahead thread
+        super().close()
+
+
+def spool(chunks: Iterable[bytes], spool_dir: str | None = None) -> io.BufferedRandom:
+    """Write the chunks into a temporary file on local disk, and rewind it.
+    The file has no name, so its disk space is freed as soon as it's closed.
+    """
+    # Closed by the response, or here when the download fails.
+    file = tempfile.TemporaryFile(dir=spool_dir)  # noqa: SIM115
+    try:
+        for chunk in chunks:
+            file.write(chunk)
+        file.seek(0)
+    except BaseException:
+        file.close()
+        raise
+    return file
+
+
+def is_sendfile_response(response: HttpResponseBase) -> bool:
+    """Tell whether the WSGI server can send the file of the response by itself,
+    using ``wsgi.file_wrapper`` and ``os.sendfile()``.
+
+    Replacing the ``streaming_content`` of such a response would disable that,
+    so these responses are observed with :func:`call_on_close` instead.
+    """
+    if (file := getattr(response, "file_to_stream", None)) is None:
+        return False
+    try:
+        file.fileno()
+    except (AttributeError, OSError):
+        return False  # e.g. a BytesIO, or a stream of chunks
+    return True
+
+
+def call_on_close(response: HttpResponseBase, callback: Callable[[], None]):
+    """Call the function when the server closes the response, after it's sent."""
+    # Django has no public API for this, these are called by response.close().
+    response._resource_closers.append(callback)
@@ -1,11 +1,24 @@
+from django.conf import settings
 from django.urls import re_path
 
 from . import views
+from .routing import BUNDLE_PREFIX
+
+if settings.ASYNC_DOWNLOADS:
+    proxy_view = views.AsyncProxyConfidentialDataView
+else:
+    proxy_view = views.ProxyConfidentialDataView
 
 urlpatterns = [
+    re_path(
+        # Followed by the prefix of a dataset route, which the view resolves.
+        f"^{BUNDLE_PREFIX}",
+        views.ZipBundleView.as_view(),
+        name="confidential-data-bundle",
+    ),
     re_path(
         r"^.*",
-        views.ProxyConfidentialDataView.as_view(),
+        proxy_view.as_view(),
         name="confidential-data-index",
-    )
+    ),
 ]
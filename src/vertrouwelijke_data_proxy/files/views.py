@@ -1,46 +1,470 @@
+from __future__ import annotations
+
+import io
+import logging
+import mimetypes
+import uuid
+from collections.abc import Iterator
+from contextlib import closing
+from datetime import UTC, datetime
+from functools import partial
+from typing import TYPE_CHECKING
+
+from asgiref.sync import sync_to_async
+from azure.core.exceptions import ResourceModifiedError
 from django.conf import settings
 from django.core.exceptions import BadRequest
-from django.http import FileResponse, HttpResponseBadRequest, HttpResponseNotFound
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpRequest,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseNotFound,
+    HttpResponseNotModified,
+    HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.utils.cache import (
+    add_never_cache_headers,
+    get_conditional_response,
+    patch_vary_headers,
+)
+from django.utils.http import (
+    content_disposition_header,
+    http_date,
+    parse_etags,
+    parse_http_date_safe,
+)
+from django.views import View
+from rest_framework.exceptions import PermissionDenied, Throttled
 from rest_framework.generics import RetrieveAPIView
 from rest_framework.request import Request
+from rest_framework.utils.urls import replace_query_param
 
 from vertrouwelijke_data_proxy.files import permissions
-from vertrouwelijke_data_proxy.files.clients import ConfidentialDataClient
+from vertrouwelijke_data_proxy.files.admission import (
+    Admission,
+    ConcurrentDownloadThrottle,
+    admit_response,
+)
+from vertrouwelijke_data_proxy.files.audit import audit_response
+from vertrouwelijke_data_proxy.files.bundles import stream_zip
+from vertrouwelijke_data_proxy.files.cache import get_blob_cache
+from vertrouwelijke_data_proxy.files.clients import (
+    AsyncConfidentialDataClient,
+    BlobNotModified,
+    ConfidentialDataClient,
+    get_directory_prefix,
+    is_directory_path,
+)
+from vertrouwelijke_data_proxy.files.coalescing import get_download_coalescer
+from vertrouwelijke_data_proxy.files.listing import get_listing_cache
+from vertrouwelijke_data_proxy.files.properties import get_properties_cache
+from vertrouwelijke_data_proxy.files.ranges import (
+    RangeNotSatisfiable,
+    content_range,
+    get_requested_ranges,
+)
+from vertrouwelijke_data_proxy.files.resilience import get_hedger
+from vertrouwelijke_data_proxy.files.routing import Dataset, resolve, resolve_path
+from vertrouwelijke_data_proxy.tracing import span
+
+if TYPE_CHECKING:
+    from azure.storage.blob import BlobClient, BlobProperties
+
+logger = logging.getLogger(__name__)
+
+# Files that are worth compressing, and the blob suffix of each compressed variant.
+PRECOMPRESSED_EXTENSIONS = (".csv", ".json", ".geojson")
+PRECOMPRESSED_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+# The storage account doesn't return more results per page.
+MAX_LISTING_PAGE_SIZE = 5000
+
+
+def get_conditions(request: HttpRequest) -> dict:
+    """Translate the conditional request headers, so the storage account can evaluate them.
+    Only a single ETag can be passed on, otherwise the file is just downloaded.
+    """
+    if if_none_match := request.headers.get("If-None-Match"):
+        etags = parse_etags(if_none_match)
+        # If-None-Match uses the weak comparison, Azure only uses strong ETags.
+        return {"if_none_match": etags[0].removeprefix("W/")} if len(etags) == 1 else {}
+    elif (timestamp := parse_http_date_safe(request.headers.get("If-Modified-Since"))) is not None:
+        return {"if_modified_since": datetime.fromtimestamp(timestamp, tz=UTC)}
+    else:
+        return {}
+
+
+def get_precompressed_variants(request: HttpRequest, filename: str) -> list[tuple[str, str]]:
+    """Tell which pre-compressed sibling blobs (e.g. ``file.csv.gz``) may be served,
+    in the order of preference. This avoids compressing the file on the fly.
+    """
+    if not filename.lower().endswith(PRECOMPRESSED_EXTENSIONS):
+        return []
+
+    accepted = parse_accept_encoding(request.headers.get("Accept-Encoding", ""))
+    return [
+        (encoding, PRECOMPRESSED_SUFFIXES[encoding])
+        for encoding in settings.PRECOMPRESSED_ENCODINGS
+        if encoding in accepted
+    ]
+
+
+def parse_accept_encoding(header: str) -> set[str]:
+    """Parse the ``Accept-Encoding`` header, skipping the ones that are refused with q=0."""
+    accepted = set()
+    for item in header.split(","):
+        encoding, _, params = item.partition(";")
+        params = params.strip()
+        try:
+            quality = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            continue
+        if quality > 0:
+            accepted.add(encoding.strip().lower())
+    return accepted
+
+
+def has_preconditions(request: HttpRequest) -> bool:
+    """Tell whether the request should fail (412) for another version of the file.
+    The storage account only receives the ``If-None-Match`` and ``If-Modified-Since``.
+    """
+    return "If-Match" in request.headers or "If-Unmodified-Since" in request.headers
+
+
+def get_local_conditional_response(
+    request: HttpRequest, properties: BlobProperties
+) -> HttpResponse | None:
+    """Check the conditional headers when the properties are already known."""
+    response = get_conditional_response(
+        request,
+        etag=properties.etag,
+        last_modified=int(properties.last_modified.timestamp()),
+    )
+    if response is not None:
+        set_validators(response, properties)
+    return response
+
+
+def get_content_type(properties: BlobProperties, filename: str) -> str:
+    """Use the content type of the blob, unless that's just the default of the storage account."""
+    content_settings = getattr(properties, "content_settings", None)
+    content_type = getattr(content_settings, "content_type", None)
+    if content_type and content_type != "application/octet-stream":
+        return content_type
+    return mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+
+def set_validators(response: HttpResponse, properties: BlobProperties):
+    """Add the headers that clients need to cache or resume the download."""
+    response["ETag"] = properties.etag
+    response["Last-Modified"] = http_date(properties.last_modified.timestamp())
+
+
+def not_modified_response(error: BlobNotModified) -> HttpResponse:
+    response = HttpResponseNotModified()
+    if error.etag:
+        response["ETag"] = error.etag
+    if error.last_modified:
+        response["Last-Modified"] = error.last_modified
+    return response
+
+
+def range_not_satisfiable_response(size: int) -> HttpResponse:
+    response = HttpResponse(status=416)
+    response["Content-Range"] = f"bytes */{size}"
+    return response
+
+
+def get_listing_response(request: HttpRequest, client: ConfidentialDataClient) -> HttpResponse:
+    """List the files and subfolders of a folder path, one page at a time.
+    The listing is cached, so repeated requests don't list the container again.
+    """
+    prefix = get_directory_prefix(request)
+    cursor = request.GET.get("cursor") or None
+    try:
+        page_size = int(request.GET.get("page_size", settings.LISTING_PAGE_SIZE))
+    except ValueError:
+        raise BadRequest() from None
+    if not 0 < page_size <= MAX_LISTING_PAGE_SIZE:
+        raise BadRequest()
+
+    listing = get_listing_cache().get(
+        (client.blob_service_client.url, client.container, prefix, cursor, page_size),
+        partial(client.list_directory, prefix, cursor=cursor, page_size=page_size),
+    )
+    if prefix and not cursor and not listing["directories"] and not listing["files"]:
+        raise FileNotFoundError(f"{prefix} does not exist")
+
+    if listing["next"]:
+        next_url = replace_query_param(request.build_absolute_uri(), "cursor", listing["next"])
+    else:
+        next_url = None
+    return JsonResponse({**listing, "next": next_url})
+
+
+def get_head_response(
+    request: HttpRequest, properties: BlobProperties, filename: str
+) -> HttpResponse:
+    """Describe the file by its properties, without downloading it.
+    The properties are cached, so repeated HEAD requests don't reach the storage account.
+    """
+    if (response := get_local_conditional_response(request, properties)) is not None:
+        return response
+
+    response = HttpResponse(content_type=get_content_type(properties, filename))
+    response["Content-Length"] = properties.size
+    response["Content-Disposition"] = content_disposition_header(True, filename)
+    set_validators(response, properties)
+    return response
+
+
+def get_redirect_response(
+    request: HttpRequest, client: ConfidentialDataClient, filename: str
+) -> HttpResponse:
+    """Redirect the client to a short-lived SAS URL, so it downloads the file from storage.
+    The conditional and ``Range`` headers are then handled by the storage account.
+    """
+    url = client.get_download_url(
+        client.get_blob_client(request), filename, lifetime=settings.AZURE_SAS_LIFETIME
+    )
+    response = HttpResponseRedirect(url)
+    # The URL gives access to the file, so it shouldn't be stored by any cache.
+    add_never_cache_headers(response)
+    return response
 
 
 class ProxyConfidentialDataView(RetrieveAPIView):
 
     needed_scopes: set = None
     client: ConfidentialDataClient
+    admission: Admission | None = None
 
     permission_classes = []
+    throttle_classes = [ConcurrentDownloadThrottle]
 
     def initial(self, request: Request, *args, **kwargs):
         """DRF-level initialization for all request types."""
 
         # Perform authorization, permission checks and throttles.
-        super().initial(request, *args, **kwargs)
+        with span("proxy.authorize"):
+            super().initial(request, *args, **kwargs)
 
         self.user_scopes = set(request.get_token_scopes)
 
-    def get_client(self) -> ConfidentialDataClient:
-        """Provide the AzureSearchServiceClient. This can be overwritten per view if needed."""
+    def finalize_response(self, request: Request, response, *args, **kwargs):
+        """Release the download slots and log the download when the response is sent."""
+        response = super().finalize_response(request, response, *args, **kwargs)
+        admit_response(request, response, self.admission)
+        audit_response(request, response)
+        return response
+
+    def handle_exception(self, exc):
+        try:
+            return super().handle_exception(exc)
+        except BaseException:
+            # The response is not finalized, so the slots are released here.
+            if self.admission is not None:
+                self.admission.release()
+            raise
+
+    def get_client(self, request: Request) -> ConfidentialDataClient:
+        """Provide the AzureSearchServiceClient. This can be overwritten per view if needed.
+        The storage account and container are those of the dataset in the request path.
+        """
+        dataset = resolve(request)[0]
         return ConfidentialDataClient(
-            base_url=settings.AZURE_STORAGE_CONTAINER_ENDPOINT,
+            base_url=dataset.get_account_url(),
+            container=dataset.container,
+            streaming=settings.AZURE_STORAGE_STREAMING,
+            chunk_size=settings.AZURE_STORAGE_CHUNK_SIZE,
+            read_ahead_chunks=settings.AZURE_STORAGE_READ_AHEAD,
+            cache=get_blob_cache(),
+            concurrency=settings.AZURE_STORAGE_CONCURRENCY,
+            segment_size=settings.AZURE_STORAGE_SEGMENT_SIZE,
+            coalescer=get_download_coalescer(),
+            properties_cache=get_properties_cache(),
+            spool_threshold=settings.AZURE_STORAGE_SPOOL_THRESHOLD,
+            spool_dir=settings.AZURE_STORAGE_SPOOL_DIR,
+            resume_attempts=settings.AZURE_STORAGE_RESUME_ATTEMPTS,
+            hedger=get_hedger(),
         )
 
     def get(self, request: Request, *args, **kwargs):
-        self.client = self.get_client()
+        self.client = self.get_client(request)
+        filename = request.path.split("/")[-1]
         try:
-            stream = self.client.call(request=request)
+            if is_directory_path(request):
+                return get_listing_response(request, self.client)
+            elif request.method == "HEAD":
+                # Answered by the proxy, a signed URL is only handed out to download the file.
+                blob_client = self.client.get_blob_client(request)
+                response = get_head_response(
+                    request, self.client.get_properties(blob_client), filename
+                )
+            elif settings.AZURE_STORAGE_REDIRECT:
+                return get_redirect_response(request, self.client, filename)
+            else:
+                response = self.get_content_response(request, filename)
         except BadRequest:
             return HttpResponseBadRequest()
         except FileNotFoundError:
             return HttpResponseNotFound()
+        except BlobNotModified as e:
+            response = not_modified_response(e)
 
-        stream.seek(0)
-        filename = request.path.split("/")[-1]
-        return FileResponse(stream, as_attachment=True, filename=filename)
+        response["Accept-Ranges"] = "bytes"
+        return response
+
+    def get_content_response(self, request: Request, filename: str) -> HttpResponse:
+        """Serve the file, or the ranges of it, when the preconditions are met."""
+        if has_preconditions(request):
+            blob_client = self.client.get_blob_client(request)
+            properties = self.client.get_properties(blob_client)
+            if (response := get_local_conditional_response(request, properties)) is not None:
+                return response
+
+        if "Range" in request.headers:
+            return self.get_range_response(request, filename)
+        return self.get_full_response(request, filename)
+
+    def get_full_response(self, request: Request, filename: str) -> HttpResponse:
+        """Serve the whole file, or its pre-compressed variant when the client accepts it."""
+        conditions = get_conditions(request)
+        variants = get_precompressed_variants(request, filename)
+        for encoding, suffix in variants:
+            try:
+                stream = self.client.call(request=request, suffix=suffix, **conditions)
+            except FileNotFoundError:
+                continue
+            response = self.get_file_response(stream, filename, encoding=encoding)
+            break
+        else:
+            stream = self.client.call(request=request, **conditions)
+            response = self.get_file_response(stream, filename)
+
+        if variants:
+            patch_vary_headers(response, ["Accept-Encoding"])
+        return response
+
+    def get_file_response(
+        self, stream: io.RawIOBase, filename: str, status=200, encoding: str | None = None
+    ) -> FileResponse:
+        """Stream the (partial) file contents to the client.
+        For a pre-compressed variant, the content type follows the filename instead of the blob.
+        """
+        properties = getattr(stream, "properties", None)
+        content_type = None
+        if properties is not None and encoding is None:
+            content_type = get_content_type(properties, filename)
+
+        response = FileResponse(
+            stream, as_attachment=True, filename=filename, status=status, content_type=content_type
+        )
+        # Pass the chunks as-is, instead of re-slicing them in small blocks.
+        response.block_size = settings.AZURE_STORAGE_CHUNK_SIZE
+        if (size := getattr(stream, "size", None)) is not None:
+            response["Content-Length"] = size
+        if properties is not None:
+            set_validators(response, properties)
+        if encoding is not None:
+            response["Content-Encoding"] = encoding
+        return response
+
+    def get_range_response(self, request: Request, filename: str) -> HttpResponse:
+        """Serve the byte ranges from the ``Range`` header.
+        Each range is translated into a ranged download from the storage account,
+        which is pinned to the ETag so the ranges match the properties.
+        """
+        blob_client = self.client.get_blob_client(request)
+        properties = self.client.get_properties(blob_client)
+        try:
+            return self.get_ranges_response(request, blob_client, properties, filename)
+        except ResourceModifiedError:
+            # The cached properties are outdated, so the ranges are evaluated again.
+            properties = self.client.get_properties(blob_client, refresh=True)
+            return self.get_ranges_response(request, blob_client, properties, filename)
+
+    def get_ranges_response(
+        self, request: Request, blob_client: BlobClient, properties: BlobProperties, filename: str
+    ) -> HttpResponse:
+        size = properties.size
+
+        if (response := get_local_conditional_response(request, properties)) is not None:
+            return response
+
+        try:
+            ranges = get_requested_ranges(request, properties)
+        except RangeNotSatisfiable:
+            return range_not_satisfiable_response(size)
+
+        if not ranges:
+            # Header is ignored, or the file changed since the previous partial download.
+            return self.get_file_response(self.client.download(blob_client), filename)
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            stream = self.client.download(
+                blob_client, offset=start, length=end - start + 1, if_match=properties.etag
+            )
+            response = self.get_file_response(stream, filename, status=206)
+            response["Content-Range"] = content_range(start, end, size)
+            return response
+        else:
+            response = self.get_multipart_response(blob_client, ranges, properties, filename)
+            set_validators(response, properties)
+            return response
+
+    def get_multipart_response(
+        self,
+        blob_client: BlobClient,
+        ranges: list[tuple[int, int]],
+        properties: BlobProperties,
+        filename: str,
+    ) -> StreamingHttpResponse:
+        """Stream multiple ranges as ``multipart/byteranges`` body.
+        The ranges are only downloaded when the body reaches them.
+        """
+        boundary = uuid.uuid4().hex
+        size = properties.size
+        part_type = get_content_type(properties, filename)
+        part_headers = [
+            (
+                f"--{boundary}\r\n"
+                f"Content-Type: {part_type}\r\n"
+                f"Content-Range: {content_range(start, end, size)}\r\n\r\n"
+            ).encode()
+            for start, end in ranges
+        ]
+        trailer = f"--{boundary}--\r\n".encode()
+
+        def _stream_parts():
+            for (start, end), part_header in zip(ranges, part_headers, strict=True):
+                yield part_header
+                stream = self.client.download(
+                    blob_client, offset=start, length=end - start + 1, if_match=properties.etag
+                )
+                with closing(stream):
+                    yield from iter(
+                        lambda s=stream: s.read(settings.AZURE_STORAGE_CHUNK_SIZE), b""
+                    )
+                yield b"\r\n"
+            yield trailer
+
+        response = StreamingHttpResponse(
+            _stream_parts(),
+            status=206,
+            content_type=f"multipart/byteranges; boundary={boundary}",
+        )
+        response["Content-Length"] = (
+            sum(len(part_header) + 2 for part_header in part_headers)
+            + sum(end - start + 1 for start, end in ranges)
+            + len(trailer)
+        )
+        response["Content-Disposition"] = content_disposition_header(True, filename)
+        return response
 
     def get_permissions(self):
         """Collect the DRF permission checks.
@@ -49,5 +473,275 @@ class ProxyConfidentialDataView(RetrieveAPIView):
         """
 
         return super().get_permissions() + [
-            permissions.IsFpMdw(),
+            permissions.HasDatasetScopes(),
         ]
+
+
+class ZipBundleView(ProxyConfidentialDataView):
+    """Download multiple files as a single ZIP archive.
+
+    The files are given as ``?path=...&path=...``, or as all files under a ``?prefix=...``.
+    The archive is generated while the files are downloaded, so nothing is buffered.
+    """
+
+    def get(self, request: Request, *args, **kwargs):
+        self.client = self.get_client(request)
+        try:
+            names, filename = self.get_bundle_files(request)
+        except BadRequest:
+            return HttpResponseBadRequest()
+        if not names:
+            return HttpResponseNotFound()
+
+        response = StreamingHttpResponse(
+            stream_zip(self.open_files(names), chunk_size=settings.AZURE_STORAGE_CHUNK_SIZE),
+            content_type="application/zip",
+        )
+        response["Content-Disposition"] = content_disposition_header(True, filename)
+        return response
+
+    def get_bundle_files(self, request: Request) -> tuple[list[str], str]:
+        """Tell which blobs should be added to the archive, and how to name it.
+        All files should be in the dataset of the bundle path, as its scopes are checked.
+        """
+        paths = request.GET.getlist("path")
+        prefix = request.GET.get("prefix")
+        if bool(paths) == (prefix is not None):
+            raise BadRequest("Provide either path or prefix")
+
+        dataset = resolve(request)[0]
+        if prefix is not None:
+            prefix = self.get_dataset_path(dataset, prefix)
+            names = self.client.list_blob_names(prefix, max_results=settings.BUNDLE_MAX_FILES)
+            # Skip the placeholders of empty folders.
+            names = [name for name in names if not name.endswith("/")]
+            filename = prefix.rstrip("/").rpartition("/")[2] or dataset.container
+            return names, f"{filename}.zip"
+
+        names = list(dict.fromkeys(self.get_dataset_path(dataset, path) for path in paths))
+        if len(names) > settings.BUNDLE_MAX_FILES or any(
+            not name or name.endswith("/") for name in names
+        ):
+            raise BadRequest("Invalid paths")
+        return names, f"{dataset.container}.zip"
+
+    def get_dataset_path(self, dataset: Dataset, path: str) -> str:
+        """Translate a requested path into the blob name within the dataset."""
+        try:
+            path_dataset, name = resolve_path(path)
+        except Http404:
+            raise BadRequest("Unknown dataset") from None
+        if path_dataset != dataset:
+            raise BadRequest("Files of another dataset")
+        return name
+
+    def open_files(self, names: list[str]) -> Iterator[tuple[str, io.RawIOBase]]:
+        """Start the download of each file, when the archive reaches it."""
+        for name in names:
+            try:
+                yield name, self.client.open(self.client.get_blob_client_for(name))
+            except FileNotFoundError:
+                # The response has already started, so the file can only be left out.
+                logger.warning("Bundle file %s does not exist, skipped", name)
+
+
+class AsyncProxyConfidentialDataView(View):
+    """Async variant of the :class:`ProxyConfidentialDataView`, for the ASGI entry point.
+
+    Each download is a coroutine instead of a worker thread, so a single process can
+    serve many slow clients. Multiple ranges are not supported here; the whole file is
+    returned instead, which RFC 9110 allows.
+    """
+
+    permission_classes = [permissions.HasDatasetScopes]
+    throttle_classes = [ConcurrentDownloadThrottle]
+    admission: Admission | None = None
+
+    def get_client(self, request: HttpRequest) -> AsyncConfidentialDataClient:
+        dataset = resolve(request)[0]
+        return AsyncConfidentialDataClient(
+            base_url=dataset.get_account_url(),
+            chunk_size=settings.AZURE_STORAGE_CHUNK_SIZE,
+            properties_cache=get_properties_cache(),
+            container=dataset.container,
+        )
+
+    def get_sync_client(self, request: HttpRequest) -> ConfidentialDataClient:
+        dataset = resolve(request)[0]
+        return ConfidentialDataClient(
+            base_url=dataset.get_account_url(),
+            chunk_size=settings.AZURE_STORAGE_CHUNK_SIZE,
+            properties_cache=get_properties_cache(),
+            container=dataset.container,
+        )
+
+    def check_permissions(self, request: HttpRequest) -> HttpResponse | None:
+        """Perform the same permission checks as DRF would do."""
+        for permission_class in self.permission_classes:
+            permission = permission_class()
+            try:
+                if not permission.has_permission(request, self):
+                    raise PermissionDenied(permission.message)
+            except PermissionDenied as e:
+                return JsonResponse({"detail": str(e.detail)}, status=403)
+        return None
+
+    async def check_throttles(self, request: HttpRequest) -> HttpResponse | None:
+        """Take the download slots, just like DRF would do."""
+        for throttle_class in self.throttle_classes:
+            throttle = throttle_class()
+            if not await sync_to_async(throttle.allow_request)(request, self):
+                error = Throttled(throttle.wait())
+                response = JsonResponse({"detail": str(error.detail)}, status=error.status_code)
+                response["Retry-After"] = str(error.wait)
+                return response
+        return None
+
+    async def get(self, request: HttpRequest, *args, **kwargs):
+        with span("proxy.authorize"):
+            if (response := self.check_permissions(request)) is not None:
+                return response
+            if (response := await self.check_throttles(request)) is not None:
+                return response
+
+        try:
+            response = await self.get_download_response(request)
+        except BaseException:
+            if self.admission is not None:
+                await sync_to_async(self.admission.release)()
+            raise
+        await sync_to_async(admit_response)(request, response, self.admission)
+        audit_response(request, response)
+        return response
+
+    async def get_download_response(self, request: HttpRequest) -> HttpResponse:
+        client = self.get_client(request)
+        filename = request.path.split("/")[-1]
+        try:
+            if is_directory_path(request):
+                # Listings are cached, so these are fetched with the sync client in a thread.
+                return await sync_to_async(get_listing_response)(
+                    request, self.get_sync_client(request)
+                )
+            elif request.method == "HEAD":
+                blob_client = client.get_blob_client(request)
+                response = get_head_response(
+                    request, await client.get_properties(blob_client), filename
+                )
+            elif settings.AZURE_STORAGE_REDIRECT:
+                # The delegation key is cached, so this rarely waits for the storage account.
+                return await sync_to_async(get_redirect_response)(
+                    request, self.get_sync_client(request), filename
+                )
+            else:
+                response = await self.get_content_response(request, client, filename)
+        except BadRequest:
+            return HttpResponseBadRequest()
+        except FileNotFoundError:
+            return HttpResponseNotFound()
+        except BlobNotModified as e:
+            response = not_modified_response(e)
+
+        response["Accept-Ranges"] = "bytes"
+        return response
+
+    async def get_content_response(
+        self, request: HttpRequest, client: AsyncConfidentialDataClient, filename: str
+    ) -> HttpResponse:
+        """Serve the file, or a range of it, when the preconditions are met."""
+        blob_client = client.get_blob_client(request)
+        if has_preconditions(request):
+            properties = await client.get_properties(blob_client)
+            if (response := get_local_conditional_response(request, properties)) is not None:
+                return response
+
+        if "Range" in request.headers:
+            return await self.get_range_response(request, client, blob_client, filename)
+        return await self.get_full_response(request, client, filename)
+
+    async def get_full_response(
+        self, request: HttpRequest, client: AsyncConfidentialDataClient, filename: str
+    ) -> HttpResponse:
+        """Serve the whole file, or its pre-compressed variant when the client accepts it."""
+        conditions = get_conditions(request)
+        variants = get_precompressed_variants(request, filename)
+        for encoding, suffix in variants:
+            try:
+                downloader = await client.download(
+                    client.get_blob_client(request, suffix=suffix), **conditions
+                )
+            except FileNotFoundError:
+                continue
+            response = self.get_stream_response(downloader, filename, encoding=encoding)
+            break
+        else:
+            downloader = await client.download(client.get_blob_client(request), **conditions)
+            response = self.get_stream_response(downloader, filename)
+
+        if variants:
+            patch_vary_headers(response, ["Accept-Encoding"])
+        return response
+
+    async def get_range_response(
+        self, request: HttpRequest, client: AsyncConfidentialDataClient, blob_client, filename
+    ) -> HttpResponse:
+        """Serve a single byte range from the ``Range`` header."""
+        properties = await client.get_properties(blob_client)
+        try:
+            return await self.get_ranges_response(
+                request, client, blob_client, properties, filename
+            )
+        except ResourceModifiedError:
+            # The cached properties are outdated, so the ranges are evaluated again.
+            properties = await client.get_properties(blob_client, refresh=True)
+            return await self.get_ranges_response(
+                request, client, blob_client, properties, filename
+            )
+
+    async def get_ranges_response(
+        self,
+        request: HttpRequest,
+        client: AsyncConfidentialDataClient,
+        blob_client,
+        properties: BlobProperties,
+        filename: str,
+    ) -> HttpResponse:
+        if (response := get_local_conditional_response(request, properties)) is not None:
+            return response
+
+        try:
+            ranges = get_requested_ranges(request, properties)
+        except RangeNotSatisfiable:
+            return range_not_satisfiable_response(properties.size)
+
+        if ranges and len(ranges) == 1:
+            start, end = ranges[0]
+            downloader = await client.download(
+                blob_client, offset=start, length=end - start + 1, if_match=properties.etag
+            )
+            response = self.get_stream_response(downloader, filename, status=206)
+            response["Content-Range"] = content_range(start, end, properties.size)
+        else:
+            downloader = await client.download(blob_client)
+            response = self.get_stream_response(downloader, filename)
+
+        return response
+
+    def get_stream_response(
+        self, downloader, filename: str, status=200, encoding: str | None = None
+    ) -> StreamingHttpResponse:
+        """Stream the chunks of the async downloader to the client."""
+        if encoding is None:
+            content_type = get_content_type(downloader.properties, filename)
+        else:
+            content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+        response = StreamingHttpResponse(
+            downloader.chunks(), status=status, content_type=content_type
+        )
+        response["Content-Length"] = downloader.size
+        response["Content-Disposition"] = content_disposition_header(True, filename)
+        set_validators(response, downloader.properties)
+        if encoding is not None:
+            response["Content-Encoding"] = encoding
+        return response
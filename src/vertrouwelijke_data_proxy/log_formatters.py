@@ -0,0 +1,17 @@
+from pythonjsonlogger.json import JsonFormatter
+
+
+class CustomJsonFormatter(JsonFormatter):
+    def __init__(self, *args, **kwargs):
+        # Make sure some 'extra' fields are not included:
+        super().__init__(*args, **kwargs)
+        self._skip_fields.update({"request": "request", "taskName": "taskName"})
+
+    def add_fields(self, log_record: dict, record, message_dict: dict):
+        # The 'rename_fields' logic fails when fields are missing, this is easier.
+        # The record is still empty, so time/level appear first (easier for docker log scrolling)
+        log_record["time"] = record.asctime
+        log_record["level"] = record.levelname
+        super().add_fields(log_record, record, message_dict)
+        log_record.pop("asctime", None)
+        log_record.pop("levelname", None)
@@ -0,0 +1,131 @@
+import logging
+import os
+import queue
+import threading
+import weakref
+
+from . import metrics
+from .processes import PerProcess
+
+# Marks the end of the queue, when the handler is closed.
+_STOP = object()
+
+# The open handlers, of which the writing is paused while the process forks.
+_handlers = weakref.WeakSet()
+_paused = []
+
+
+def _before_fork():
+    for handler in list(_handlers):
+        if handler._is_running():
+            handler._writing.acquire()
+            _paused.append(handler._writing)
+
+
+def _after_fork_in_parent():
+    while _paused:
+        _paused.pop().release()
+
+
+os.register_at_fork(before=_before_fork, after_in_parent=_after_fork_in_parent)
+
+
+class QueuedStreamHandler(PerProcess, logging.StreamHandler):
+    """A ``StreamHandler`` that formats and writes the records in a background thread.
+
+    The request thread only puts the record in a bounded queue. The writer thread takes
+    all records that are waiting (at most ``batch_size``), formats them, and writes them
+    with a single write. When the queue is full, records are dropped and counted,
+    unless ``block`` is set (for audit records that shouldn't get lost).
+    """
+
+    def __init__(
+        self, stream=None, maxsize: int = 10000, batch_size: int = 256, block: bool = False
+    ):
+        super().__init__(stream)
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.block = block
+        _handlers.add(self)
+
+    def _reset(self):
+        """Start the writer thread of this process, the one of the parent isn't copied."""
+        self.queue = queue.Queue(self.maxsize)
+        # Held while writing, so os.fork() never happens halfway a write to the stream.
+        self._writing = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, args=(self.queue, self._writing), name="log-writer", daemon=True
+        )
+        self._thread.start()
+
+    def _is_running(self) -> bool:
+        return self._pid == os.getpid() and self._thread.is_alive()
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        """Put the record in the queue, without taking the handler lock."""
+        if not (rv := self.filter(record)):
+            return rv
+        self._check_pid()
+        if record.args:
+            # The caller may change the arguments before the record is formatted.
+            record.msg = record.getMessage()
+            record.args = None
+
+        try:
+            self.queue.put(record, block=self.block)
+        except queue.Full:
+            metrics.LOG_RECORDS_DROPPED.inc()
+        return rv
+
+    def emit(self, record: logging.LogRecord):
+        self._check_pid()
+        self._write([record], self._writing)
+
+    def _run(self, records: queue.Queue, writing: threading.Lock):
+        # The queue and lock are arguments, as a forked process replaces the attributes.
+        while True:
+            batch = [records.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(records.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._write([record for record in batch if record is not _STOP], writing)
+            finally:
+                for _ in batch:
+                    records.task_done()
+            if _STOP in batch:
+                return
+
+    def _write(self, records: list[logging.LogRecord], writing: threading.Lock):
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.format(record) + self.terminator)
+            except Exception:  # noqa: BLE001, reported like logging.Handler.emit() does
+                self.handleError(record)
+        if not lines:
+            return
+
+        with writing:
+            try:
+                self.stream.write("".join(lines))
+                self.stream.flush()
+            except Exception:  # noqa: BLE001, reported like logging.Handler.emit() does
+                self.handleError(records[-1])
+
+    def flush(self):
+        """Wait until the queued records are written."""
+        if self._is_running() and self._thread is not threading.current_thread():
+            self.queue.join()
+        super().flush()
+
+    def close(self):
+        """Write the remaining records, this is called by ``logging.shutdown()`` at exit."""
+        if self._is_running():
+            self.queue.put(_STOP)
+            self._thread.join(timeout=5)
+        _handlers.discard(self)
+        super().close()
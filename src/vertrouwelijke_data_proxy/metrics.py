@@ -0,0 +1,100 @@
+"""Prometheus metrics of the proxy.
+
+When the ``PROMETHEUS_MULTIPROC_DIR`` environment variable is set, each uWSGI worker
+writes its values to a memory-mapped file in that folder, and the ``/_proxy/metrics`` view
+aggregates the files of all workers. This folder should be empty when the server starts.
+"""
+
+import atexit
+import os
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from . import tracing
+
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+# Downloads of large files can take minutes.
+DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+REQUEST_DURATION = Histogram(
+    "proxy_request_duration_seconds",
+    "Time until the response is completely sent.",
+    ["route"],
+    buckets=DURATION_BUCKETS,
+)
+TIME_TO_FIRST_BYTE = Histogram(
+    "proxy_time_to_first_byte_seconds",
+    "Time until the first chunk of the response is sent.",
+    ["route"],
+)
+RESPONSES = Counter(
+    "proxy_responses_total", "Number of responses, by route and status code.", ["route", "status"]
+)
+RESPONSE_BYTES = Counter("proxy_response_bytes_total", "Bytes sent to clients.", ["route"])
+IN_PROGRESS = Gauge(
+    "proxy_requests_in_progress",
+    "Requests of which the response is not completely sent yet.",
+    multiprocess_mode="livesum",
+)
+AZURE_CALL_DURATION = Histogram(
+    "proxy_azure_call_duration_seconds",
+    "Duration of the calls to the storage account, until the response headers are received.",
+    ["operation"],
+)
+COALESCED_DOWNLOADS = Counter(
+    "proxy_coalesced_downloads_total",
+    "Downloads that were served from a download in progress for the same blob.",
+)
+DOWNLOAD_RESUMES = Counter(
+    "proxy_download_resumes_total",
+    "Downloads from the storage account that failed halfway, and were resumed.",
+)
+HEDGED_REQUESTS = Counter(
+    "proxy_hedged_requests_total",
+    "Downloads that were repeated in parallel, as the first byte took longer than usual.",
+)
+AUTHZ_TOKENS = Counter("proxy_authz_tokens_total", "Checked bearer tokens, by result.", ["result"])
+LOG_RECORDS_DROPPED = Counter(
+    "proxy_log_records_dropped_total", "Log records that were dropped because the queue was full."
+)
+
+
+@contextmanager
+def azure_call(operation: str, **attributes):
+    """Measure a call to the storage account, e.g. ``with azure_call("download"): ...``.
+    The call is also traced, the attributes (e.g. the blob name) are added to its span.
+    """
+    timer = AZURE_CALL_DURATION.labels(operation).time()
+    with tracing.span(f"azure.{operation}", attributes), timer:
+        yield
+
+
+def get_registry() -> CollectorRegistry:
+    """Provide the registry with the values to report."""
+    if not MULTIPROCESS:
+        return REGISTRY
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def generate() -> tuple[bytes, str]:
+    """Generate the metrics in the text format, and its content type."""
+    return generate_latest(get_registry()), CONTENT_TYPE_LATEST
+
+
+if MULTIPROCESS:
+    # Remove the values of live gauges when a worker is recycled.
+    atexit.register(lambda: multiprocess.mark_process_dead(os.getpid()))
@@ -0,0 +1,260 @@
+import hashlib
+import hmac
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from authorization_django.middleware import AuthorizationMiddleware
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.middleware.gzip import GZipMiddleware
+from django.urls import Resolver404, resolve
+from django.utils.deprecation import MiddlewareMixin
+
+from . import metrics
+from .files.content_types import is_incompressible
+from .files.streams import call_on_close, is_sendfile_response
+from .profiling import StackSampler
+from .tracing import span
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """GZip compression that skips content which is already compressed.
+
+    Compressing a ZIP file costs CPU on the worker, while the response doesn't get smaller.
+    Partial content is also left alone, as the ``Content-Range`` is about the original bytes.
+    """
+
+    def process_response(self, request, response):
+        if response.status_code == 206:
+            return response
+
+        content_type = response.get("Content-Type", "").partition(";")[0].strip().lower()
+        if is_incompressible(content_type):
+            return response
+
+        return super().process_response(request, response)
+
+
+class OptionsMiddleware(MiddlewareMixin):
+    """Answer ``OPTIONS`` requests before they reach the authorization and the views.
+
+    CORS preflight requests are already answered by the ``CorsMiddleware`` in front of this.
+    Other ``OPTIONS`` requests have no token, and all endpoints are read-only anyway.
+    """
+
+    def process_request(self, request):
+        if request.method == "OPTIONS":
+            return HttpResponse(headers={"Allow": "GET, HEAD, OPTIONS", "Content-Length": "0"})
+        return None
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    """Collect the request metrics, this should be the first middleware.
+
+    For streaming responses, the measurement ends when the last chunk is sent.
+    The byte count is only added at the end, so the chunks themselves are not slowed down.
+    """
+
+    def process_request(self, request):
+        request._metrics_start = time.perf_counter()
+        metrics.IN_PROGRESS.inc()
+
+    def process_response(self, request, response):
+        if (start := getattr(request, "_metrics_start", None)) is None:
+            return response  # process_request didn't run
+
+        route = get_route_name(request)
+        metrics.RESPONSES.labels(route, response.status_code).inc()
+        if not response.streaming:
+            _Measurement(route, start).finish(len(response.content))
+        elif is_sendfile_response(response):
+            # The server sends the file by itself, so the measurement ends when it's closed.
+            size = int(response.get("Content-Length", 0))
+            call_on_close(response, partial(_Measurement(route, start).finish, size))
+        elif response.is_async:
+            response.streaming_content = _AsyncMeasuredStream(
+                response.streaming_content, _Measurement(route, start)
+            )
+        else:
+            response.streaming_content = _MeasuredStream(
+                response.streaming_content, _Measurement(route, start)
+            )
+        return response
+
+
+def get_route_name(request) -> str:
+    """Tell which URL pattern the request is for, without using the path itself as label."""
+    if (match := request.resolver_match) is None:
+        # Middleware returned a response before the URL was resolved (e.g. HTTP 401).
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return "unknown"
+    return match.url_name or match.route
+
+
+class _Measurement:
+    def __init__(self, route: str, start: float):
+        self.route = route
+        self.start = start
+        self.finished = False
+
+    def first_byte(self):
+        metrics.TIME_TO_FIRST_BYTE.labels(self.route).observe(time.perf_counter() - self.start)
+
+    def finish(self, size: int):
+        if not self.finished:
+            self.finished = True
+            metrics.REQUEST_DURATION.labels(self.route).observe(time.perf_counter() - self.start)
+            metrics.RESPONSE_BYTES.labels(self.route).inc(size)
+            metrics.IN_PROGRESS.dec()
+
+
+class _MeasuredContent:
+    """Pass the chunks through, and measure when they are sent.
+
+    This is an iterator class instead of a generator, so ``close()`` also completes
+    the measurement when the response was never iterated over.
+    """
+
+    def __init__(self, measurement: _Measurement):
+        self._measurement = measurement
+        self._started = False
+        self._size = 0
+
+    def _sent(self, chunk: bytes):
+        if not self._started:
+            self._started = True
+            self._measurement.first_byte()
+        self._size += len(chunk)
+
+    def close(self):
+        self._measurement.finish(self._size)
+
+
+class _MeasuredStream(_MeasuredContent):
+    def __init__(self, content, measurement: _Measurement):
+        super().__init__(measurement)
+        self._content = iter(content)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self._content)
+        except StopIteration:
+            self.close()
+            raise
+        self._sent(chunk)
+        return chunk
+
+
+class _AsyncMeasuredStream(_MeasuredContent):
+    """The same measurement, for the streaming responses of async views."""
+
+    def __init__(self, content, measurement: _Measurement):
+        super().__init__(measurement)
+        self._content = content.__aiter__()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            chunk = await self._content.__anext__()
+        except StopAsyncIteration:
+            self.close()
+            raise
+        self._sent(chunk)
+        return chunk
+
+
+class ProfilingMiddleware(MiddlewareMixin):
+    """Profile a request with the sampling profiler, until its response is sent.
+
+    A request is profiled when its ``X-Profile`` header has the ``PROFILE_TOKEN``,
+    or when it's picked by the ``PROFILE_SAMPLE_RATE``. The profiles are written
+    to the ``PROFILE_DIR``; without it, this middleware is not used at all.
+    Only the request thread is sampled, so this is meant for the WSGI server.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILE_DIR:
+            raise MiddlewareNotUsed()
+        super().__init__(get_response)
+
+    def should_profile(self, request) -> bool:
+        if settings.PROFILE_TOKEN and (token := request.headers.get("X-Profile")):
+            return hmac.compare_digest(token.encode(), settings.PROFILE_TOKEN.encode())
+        return random.random() < settings.PROFILE_SAMPLE_RATE
+
+    def process_request(self, request):
+        if self.should_profile(request):
+            request._profiler = StackSampler(
+                threading.get_ident(), settings.PROFILE_DIR, interval=settings.PROFILE_INTERVAL
+            )
+            request._profiler.start()
+
+    def process_response(self, request, response):
+        if (profiler := getattr(request, "_profiler", None)) is not None:
+            call_on_close(response, partial(profiler.stop, f"{request.method} {request.path}"))
+        return response
+
+
+class CachedAuthorizationMiddleware(AuthorizationMiddleware):
+    """Authorization middleware that remembers the verified tokens.
+
+    Download managers send many requests with the same bearer token (e.g. for ranges or
+    retries). The signature is only verified once per token, the cached claims are used
+    until the token expires, or until the JWKS keys are reloaded.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.max_size = settings.AUTHZ_TOKEN_CACHE_SIZE
+        self.max_age = settings.AUTHZ_TOKEN_CACHE_TTL
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def parse_token(self, authz_header):
+        if not self.max_size:
+            return super().parse_token(authz_header)
+
+        # Only keep a digest, the tokens themselves are not kept in memory.
+        key = hashlib.sha256(authz_header.encode()).digest()
+        now = time.time()
+        with self._lock:
+            if (entry := self._cache.get(key)) is not None:
+                expires, keyset, result = entry
+                if expires > now and keyset is self.jwks.keyset:
+                    self._cache.move_to_end(key)
+                    metrics.AUTHZ_TOKENS.labels("cached").inc()
+                    return result
+                del self._cache[key]
+
+        # Expired or invalid tokens raise an exception here, so these are never cached.
+        try:
+            with span("proxy.verify_token"):
+                scopes, token_signature, sub, claims, account_id = super().parse_token(
+                    authz_header
+                )
+        except Exception:
+            metrics.AUTHZ_TOKENS.labels("invalid").inc()
+            raise
+        metrics.AUTHZ_TOKENS.labels("verified").inc()
+
+        # Scopes become a frozenset, so permission checks don't have to rebuild the set.
+        result = (frozenset(scopes), token_signature, sub, claims, account_id)
+        expires = min(claims.get("exp", math.inf), now + self.max_age)
+        with self._lock:
+            # A reloaded keyset is a new object, which invalidates all previous entries.
+            self._cache[key] = (expires, self.jwks.keyset, result)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return result
@@ -0,0 +1,33 @@
+"""State that belongs to a single worker process.
+
+uWSGI forks its workers from the master process without running the
+``os.register_at_fork()`` hooks. Objects that hold locks, threads or sockets
+therefore notice by the process id that they were copied into a new process.
+"""
+
+import os
+import threading
+
+# One lock per process, a lock that was copied from the parent could be held forever.
+_locks = {}
+
+
+class PerProcess:
+    """Mixin for objects of which the state is created again in every process.
+
+    Subclasses create their state in :meth:`_reset`, and call :meth:`_check_pid` before
+    they use it. The reset happens once per process, other threads wait until it's done.
+    """
+
+    _pid = None
+
+    def _check_pid(self):
+        if self._pid == (pid := os.getpid()):
+            return
+        with _locks.setdefault(pid, threading.Lock()):
+            if self._pid != pid:
+                self._reset()
+                self._pid = pid
+
+    def _reset(self):
+        raise NotImplementedError
@@ -0,0 +1,68 @@
+"""Sampling profiler for single requests in production.
+
+A background thread takes the stack of the request thread at a fixed interval.
+This costs little for the request itself, unlike a tracing profiler (``cProfile``),
+so the timings remain realistic. The profile is written in the collapsed stack format
+(one ``frame;frame;frame count`` line per stack), which tools like ``flamegraph.pl``
+and speedscope show as a flame graph.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+class StackSampler:
+    """Sample the stack of a thread, until :meth:`stop` is called.
+    The profile is then written to a new file in the ``profile_dir``.
+    """
+
+    def __init__(self, thread_id: int, profile_dir: str, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.profile_dir = profile_dir
+        self.interval = interval
+        self.stacks = Counter()
+        self.label = ""
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, label: str = ""):
+        """Stop sampling, the profile is written by the sampling thread."""
+        self.label = label
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            if (frame := sys._current_frames().get(self.thread_id)) is None:
+                return  # the thread has ended
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+        self._write()
+
+    def _write(self):
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:8]}.folded"
+        path = os.path.join(self.profile_dir, name)
+        try:
+            with open(path, "w") as file:
+                file.writelines(f"{stack} {count}\n" for stack, count in self.stacks.items())
+        except OSError as e:
+            logger.warning("Profile could not be written: %s", e)
+            return
+        logger.info(
+            "Profile of %s written to %s (%d samples)", self.label, path, self.stacks.total()
+        )
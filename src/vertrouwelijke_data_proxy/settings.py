@@ -2,7 +2,7 @@ from pathlib import Path
 
 import environ
 from corsheaders.defaults import default_headers
-from pythonjsonlogger import jsonlogger
+from django.core.exceptions import ImproperlyConfigured
 
 env = environ.Env()
 _USE_SECRET_STORE = Path("/mnt/secrets-store").exists()
@@ -40,14 +40,18 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
-    "django.middleware.gzip.GZipMiddleware",
+    "vertrouwelijke_data_proxy.middleware.MetricsMiddleware",
+    # OPTIONS requests are answered here, without going through the other middleware.
+    "corsheaders.middleware.CorsMiddleware",
+    "vertrouwelijke_data_proxy.middleware.OptionsMiddleware",
+    "vertrouwelijke_data_proxy.middleware.ProfilingMiddleware",
+    "vertrouwelijke_data_proxy.middleware.CompressionMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
-    "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "authorization_django.authorization_middleware",
+    "vertrouwelijke_data_proxy.middleware.CachedAuthorizationMiddleware",
 ]
 
 if DEBUG:
@@ -55,7 +59,11 @@ if DEBUG:
         "debug_toolbar",
         "django_extensions",
     ]
-    MIDDLEWARE.insert(1, "debug_toolbar.middleware.DebugToolbarMiddleware")
+    # The toolbar needs to be after the middleware that compresses the response.
+    MIDDLEWARE.insert(
+        MIDDLEWARE.index("vertrouwelijke_data_proxy.middleware.CompressionMiddleware") + 1,
+        "debug_toolbar.middleware.DebugToolbarMiddleware",
+    )
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
@@ -94,6 +102,14 @@ if not DEBUG:
     ]
 
 WSGI_APPLICATION = "vertrouwelijke_data_proxy.wsgi.application"
+ASGI_APPLICATION = "vertrouwelijke_data_proxy.asgi.application"
+
+# Serve downloads with async views, this is enabled by the ASGI entry point.
+ASYNC_DOWNLOADS = env.bool("ASYNC_DOWNLOADS", False)
+
+# Load the views and storage SDK when the application starts (in the uWSGI master),
+# instead of on the first request of each worker.
+STARTUP_WARM_UP = env.bool("STARTUP_WARM_UP", not DEBUG)
 
 # -- Services
 
@@ -107,34 +123,17 @@ locals().update(env.email_url(default="smtp://"))
 
 # -- Logging
 
-
-class CustomJsonFormatter(jsonlogger.JsonFormatter):
-    def __init__(self, *args, **kwargs):
-        # Make sure some 'extra' fields are not included:
-        super().__init__(*args, **kwargs)
-        self._skip_fields.update({"request": "request", "taskName": "taskName"})
-
-    def add_fields(self, log_record: dict, record, message_dict: dict):
-        # The 'rename_fields' logic fails when fields are missing, this is easier:
-        super().add_fields(log_record, record, message_dict)
-        # An in-place reordering, sotime/level appear first (easier for docker log scrolling)
-        ordered_dict = {
-            "time": log_record.pop("asctime", record.asctime),
-            "level": log_record.pop("levelname", record.levelname),
-            **log_record,
-        }
-        log_record.clear()
-        log_record.update(ordered_dict)
-
-
+# The formatter is referenced by name, so it's only imported when logging is configured.
 _json_log_formatter = {
-    "()": CustomJsonFormatter,
+    "()": "vertrouwelijke_data_proxy.log_formatters.CustomJsonFormatter",
     "format": "%(asctime)s $(levelname)s %(name)s %(message)s",  # parsed as a fields list.
 }
 
 DJANGO_LOG_LEVEL = env.str("DJANGO_LOG_LEVEL", "INFO").upper()
 LOG_LEVEL = env.str("LOG_LEVEL", "DEBUG" if DEBUG else "INFO").upper()
 AUDIT_LOG_LEVEL = env.str("AUDIT_LOG_LEVEL", "INFO").upper()
+# Records are formatted and written by a background thread, 0 writes them on the request thread.
+LOG_QUEUE_SIZE = env.int("LOG_QUEUE_SIZE", 10000)
 
 LOGGING = {
     "version": 1,
@@ -197,6 +196,17 @@ LOGGING = {
     },
 }
 
+if LOG_QUEUE_SIZE:
+    for _name in ("console", "audit_console"):
+        LOGGING["handlers"][_name] = {
+            "()": "vertrouwelijke_data_proxy.log_handlers.QueuedStreamHandler",
+            "level": "DEBUG",
+            "formatter": LOGGING["handlers"][_name]["formatter"],
+            "maxsize": LOG_QUEUE_SIZE,
+        }
+    # Audit records are not dropped when the queue is full, the request waits instead.
+    LOGGING["handlers"]["audit_console"]["block"] = True
+
 if DEBUG:
     # Print tracebacks without JSON formatting.
     LOGGING["loggers"]["django.request"] = {
@@ -297,6 +307,8 @@ CORS_ALLOWED_ORIGIN_REGEXES = env.list(
         else []
     ),
 )
+# All endpoints are read-only.
+CORS_ALLOW_METHODS = ["GET", "HEAD", "OPTIONS"]
 CORS_ALLOW_HEADERS = list(default_headers) + env.list(
     "CORS_ALLOW_HEADERS", default=["x-user", "x-correlation-id", "x-task-description"]
 )
@@ -333,8 +345,104 @@ DATAPUNT_AUTHZ = {
     "MIN_INTERVAL_KEYSET_UPDATE": 30 * 60,  # 30 minutes
 }
 
+# Remember verified tokens, so repeated requests skip the signature verification.
+AUTHZ_TOKEN_CACHE_SIZE = env.int("AUTHZ_TOKEN_CACHE_SIZE", 1000)
+AUTHZ_TOKEN_CACHE_TTL = env.int("AUTHZ_TOKEN_CACHE_TTL", 300)
+
 # -- Local app settings
 
 AZURE_STORAGE_CONTAINER_ENDPOINT = env.str("AZURE_STORAGE_CONTAINER_ENDPOINT", None)
 
+# The datasets that are served, by path prefix (longest prefix wins), as JSON list of
+# {"prefix": ..., "container": ..., "scopes": [...], "account": ...}. Without an account,
+# the AZURE_STORAGE_CONTAINER_ENDPOINT is used. The ingress passes the container name as prefix.
+DATASET_ROUTES = env.json(
+    "DATASET_ROUTES",
+    default=[
+        {"prefix": "bulk-data-fp-mdw/", "container": "bulk-data-fp-mdw", "scopes": ["FP/MDW"]},
+        {"prefix": "", "container": "bulk-data-fp-mdw", "scopes": ["FP/MDW"]},
+    ],
+)
+
+# Fetch the storage token when a worker starts, and refresh it in the background.
+AZURE_TOKEN_PREFETCH = env.bool("AZURE_TOKEN_PREFETCH", not DEBUG)
+AZURE_TOKEN_REFRESH_MARGIN = env.int("AZURE_TOKEN_REFRESH_MARGIN", 600)
+
+# Redirect downloads to a short-lived SAS URL, so clients download directly from storage.
+# The SAS is signed with a user delegation key, which is renewed halfway its lifetime.
+AZURE_STORAGE_REDIRECT = env.bool("AZURE_STORAGE_REDIRECT", False)
+AZURE_SAS_LIFETIME = env.int("AZURE_SAS_LIFETIME", 300)
+AZURE_DELEGATION_KEY_LIFETIME = env.int("AZURE_DELEGATION_KEY_LIFETIME", 24 * 3600)
+
+# Admission control: concurrent downloads (0 is unlimited) and bytes/s per user (0 is unlimited).
+# The limits are shared through the cache, so this needs a shared backend (e.g. redis://).
+DOWNLOAD_MAX_CONCURRENT = env.int("DOWNLOAD_MAX_CONCURRENT", 0)
+DOWNLOAD_MAX_CONCURRENT_PER_USER = env.int("DOWNLOAD_MAX_CONCURRENT_PER_USER", 0)
+DOWNLOAD_USER_RATE = env.int("DOWNLOAD_USER_RATE", 0)
+DOWNLOAD_RETRY_AFTER = env.int("DOWNLOAD_RETRY_AFTER", 10)
+DOWNLOAD_SLOT_TIMEOUT = env.int("DOWNLOAD_SLOT_TIMEOUT", 300)
+DOWNLOAD_ADMISSION_CACHE = env.str("DOWNLOAD_ADMISSION_CACHE", "default")
+if (DOWNLOAD_MAX_CONCURRENT or DOWNLOAD_MAX_CONCURRENT_PER_USER or DOWNLOAD_USER_RATE) and (
+    CACHES.get(DOWNLOAD_ADMISSION_CACHE, {}).get("BACKEND", "").endswith(".LocMemCache")
+):
+    # Every worker process would have its own counts, which multiplies the limits.
+    raise ImproperlyConfigured(
+        "The admission control needs a shared cache, e.g. CACHE_URL=redis://"
+    )
+
+# Stream downloads in chunks, instead of buffering the whole blob in worker memory.
+# Memory per download is roughly CHUNK_SIZE * (READ_AHEAD + 1).
+AZURE_STORAGE_STREAMING = env.bool("AZURE_STORAGE_STREAMING", True)
+AZURE_STORAGE_CHUNK_SIZE = env.int("AZURE_STORAGE_CHUNK_SIZE", 4 * 1024 * 1024)
+AZURE_STORAGE_READ_AHEAD = env.int("AZURE_STORAGE_READ_AHEAD", 2)
+# Without streaming, large blobs are buffered in a temporary file that uWSGI sends by sendfile().
+AZURE_STORAGE_SPOOL_THRESHOLD = env.int("AZURE_STORAGE_SPOOL_THRESHOLD", 8 * 1024 * 1024)
+AZURE_STORAGE_SPOOL_DIR = env.str("AZURE_STORAGE_SPOOL_DIR", None)
+# Keep-alive connections per storage account, should be at least uWSGI threads * CONCURRENCY.
+AZURE_STORAGE_POOL_SIZE = env.int("AZURE_STORAGE_POOL_SIZE", 10)
+# Fetch large blobs as parallel segments, memory per download is CONCURRENCY * SEGMENT_SIZE.
+AZURE_STORAGE_CONCURRENCY = env.int("AZURE_STORAGE_CONCURRENCY", 4)
+AZURE_STORAGE_SEGMENT_SIZE = env.int("AZURE_STORAGE_SEGMENT_SIZE", 8 * 1024 * 1024)
+# Seconds a read from the storage account may stall, before the download is resumed.
+AZURE_STORAGE_READ_TIMEOUT = env.int("AZURE_STORAGE_READ_TIMEOUT", 30)
+AZURE_STORAGE_RESUME_ATTEMPTS = env.int("AZURE_STORAGE_RESUME_ATTEMPTS", 3)
+# Repeat a download when its first byte is slower than this percentile (e.g. 95), 0 disables.
+AZURE_STORAGE_HEDGE_PERCENTILE = env.int("AZURE_STORAGE_HEDGE_PERCENTILE", 0)
+
+# Serve pre-compressed sibling blobs (e.g. file.csv.gz) when the client accepts them.
+# Only enable this (e.g. br,gzip) when the siblings exist, every lookup is a storage round trip.
+PRECOMPRESSED_ENCODINGS = env.list("PRECOMPRESSED_ENCODINGS", default=[])
+
+# Optional local disk cache for downloaded blobs, shared by all workers.
+BLOB_CACHE_DIR = env.str("BLOB_CACHE_DIR", None)
+BLOB_CACHE_MAX_SIZE = env.int("BLOB_CACHE_MAX_SIZE", 10 * 1024**3)
+
+# Share the download of a blob between concurrent requests, spooled to a temporary file.
+COALESCE_DOWNLOADS = env.bool("COALESCE_DOWNLOADS", False)
+COALESCE_SPOOL_DIR = env.str("COALESCE_SPOOL_DIR", None)
+
+# Blob properties (and missing blobs) are cached in memory, saving a metadata round trip.
+PROPERTIES_CACHE_TTL = env.int("PROPERTIES_CACHE_TTL", 30)
+PROPERTIES_CACHE_NEGATIVE_TTL = env.int("PROPERTIES_CACHE_NEGATIVE_TTL", 10)
+PROPERTIES_CACHE_SIZE = env.int("PROPERTIES_CACHE_SIZE", 10000)
+
+# Folder listings are cached in memory, and refreshed in the background after the TTL.
+LISTING_PAGE_SIZE = env.int("LISTING_PAGE_SIZE", 1000)
+LISTING_CACHE_TTL = env.int("LISTING_CACHE_TTL", 60)
+LISTING_CACHE_SIZE = env.int("LISTING_CACHE_SIZE", 1000)
+
+# Maximum number of files in a single ZIP bundle download.
+BUNDLE_MAX_FILES = env.int("BUNDLE_MAX_FILES", 1000)
+
+# The /_proxy/metrics page is only served to requests with an
+# "X-Metrics-Token: <METRICS_TOKEN>" header.
+METRICS_TOKEN = env.str("METRICS_TOKEN", None)
+
+# Profile requests with the sampling profiler, when they have an "X-Profile: <PROFILE_TOKEN>"
+# header or by a sample rate (e.g. 0.001). The profiles are written to PROFILE_DIR.
+PROFILE_DIR = env.str("PROFILE_DIR", None)
+PROFILE_TOKEN = env.str("PROFILE_TOKEN", None)
+PROFILE_SAMPLE_RATE = env.float("PROFILE_SAMPLE_RATE", 0.0)
+PROFILE_INTERVAL = env.float("PROFILE_INTERVAL", 0.005)
+
 DSO_API_BASE_URL = env.str("DSO_API_BASE_URL", None)
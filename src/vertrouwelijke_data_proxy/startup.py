@@ -0,0 +1,83 @@
+"""Warm-up of the application before the uWSGI workers are forked.
+
+The storage SDK is only imported when the first download starts. Without a warm-up,
+every forked worker imports it on its first request, and keeps its own copy in memory.
+When the modules are loaded in the uWSGI master instead, all workers share those
+memory pages copy-on-write, and the first request of a worker is as fast as the others.
+For the same reason, each worker fetches its storage token before its first request.
+"""
+
+import gc
+import importlib
+import logging
+import time
+
+from django.conf import settings
+from django.urls import get_resolver
+
+logger = logging.getLogger(__name__)
+
+# The modules that are deferred until first use, as they take a while to import.
+PRELOAD_MODULES = (
+    "azure.identity",
+    "azure.storage.blob",
+    "azure.core.pipeline.transport",
+)
+ASYNC_PRELOAD_MODULES = (
+    "azure.identity.aio",
+    "azure.storage.blob.aio",
+)
+
+
+def warm_up():
+    """Load the URLconf, the views and the storage SDK.
+
+    This only imports code: no connections or threads are created,
+    as these can't be shared with the forked workers.
+    """
+    start = time.perf_counter()
+    get_resolver().url_patterns  # noqa: B018, imports all views
+
+    modules = PRELOAD_MODULES
+    if settings.ASYNC_DOWNLOADS:
+        modules += ASYNC_PRELOAD_MODULES
+    for name in modules:
+        importlib.import_module(name)
+
+    # Keep the garbage collector from touching the loaded objects in the workers,
+    # which would copy the shared memory pages of the master.
+    gc.freeze()
+    logger.debug("Warm-up took %.0fms", (time.perf_counter() - start) * 1000)
+
+
+def prefetch_token():
+    """Fetch the storage token in every worker process, before its first request.
+
+    Each worker has its own credential, as the token refresh thread isn't copied by a fork.
+    With ``lazy-apps``, uWSGI loads the application in each worker after the fork,
+    so the token is fetched right away. Otherwise, the application is loaded
+    in the master, and the token is fetched after each worker is forked.
+    """
+    from vertrouwelijke_data_proxy.files.clients import client_registry
+
+    try:
+        import uwsgi
+        from uwsgidecorators import postfork
+    except ImportError:
+        # Not running in uWSGI, so this is the process that handles the requests.
+        client_registry.prefetch_token()
+        return
+
+    if _is_enabled(uwsgi.opt.get("lazy-apps")) or _is_enabled(uwsgi.opt.get("lazy")):
+        client_registry.prefetch_token()
+    else:
+        postfork(client_registry.prefetch_token)
+
+
+def _is_enabled(option) -> bool:
+    """Interpret a uWSGI flag, which is ``True`` on the command line or a value otherwise."""
+    if isinstance(option, bytes):
+        option = option.decode()
+    if isinstance(option, str):
+        return option.lower() not in ("", "0", "false", "no", "off")
+    return bool(option)
@@ -0,0 +1,82 @@
+"""OpenTelemetry spans for the phases of a request.
+
+The spans are children of the Django request span, so a trace shows how a slow download
+splits between the authorization, the storage account calls, and sending the data.
+Without a configured tracer provider (e.g. outside Azure) these spans are no-ops.
+"""
+
+from __future__ import annotations
+
+import time
+from collections.abc import Iterable, Iterator
+from contextlib import nullcontext
+
+try:
+    from opentelemetry import trace
+except ImportError:  # the monitoring packages are only configured in Azure
+    trace = None
+
+tracer = trace.get_tracer(__name__) if trace is not None else None
+
+
+def is_recording() -> bool:
+    """Tell whether the current request is traced, so extra measurements are worth it."""
+    return trace is not None and trace.get_current_span().is_recording()
+
+
+def span(name: str, attributes: dict | None = None):
+    """Trace a phase of the request, e.g. ``with span("proxy.authorize"): ...``."""
+    if tracer is None:
+        return nullcontext()
+    return tracer.start_as_current_span(name, attributes=_clean(attributes))
+
+
+def traced_chunks(chunks: Iterable[bytes], name: str, attributes: dict | None = None):
+    """Trace the streaming of chunks, which continues after the view returned the response.
+
+    The span lasts until the last chunk is sent. It has the number of bytes and chunks,
+    and the time spent waiting for the next chunk from the storage account;
+    the remainder of its duration is spent on sending the data to the client.
+    """
+    if not is_recording():
+        return chunks
+    return _traced_chunks(chunks, tracer.start_span(name, attributes=_clean(attributes)))
+
+
+def _traced_chunks(chunks: Iterable[bytes], stream_span) -> Iterator[bytes]:
+    size = 0
+    count = 0
+    waited = 0.0
+    max_wait = 0.0
+    chunks = iter(chunks)
+    try:
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            wait = time.perf_counter() - start
+            waited += wait
+            max_wait = max(max_wait, wait)
+            if chunk is None:
+                break
+            size += len(chunk)
+            count += 1
+            yield chunk
+    finally:
+        stream_span.set_attributes(
+            {
+                "proxy.bytes": size,
+                "proxy.chunks": count,
+                "proxy.upstream_wait": round(waited, 6),
+                "proxy.upstream_wait_max": round(max_wait, 6),
+            }
+        )
+        stream_span.end()
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def _clean(attributes: dict | None) -> dict | None:
+    """Span attributes can't be ``None``."""
+    if not attributes:
+        return None
+    return {key: value for key, value in attributes.items() if value is not None}
@@ -5,7 +5,8 @@ from django.urls import include, path
 from . import views
 
 urlpatterns = [
-    path("status/", views.RootView.as_view()),
+    path("status/", views.RootView.as_view(), name="status"),
+    path("_proxy/metrics", views.MetricsView.as_view(), name="metrics"),
     path("", include("vertrouwelijke_data_proxy.files.urls")),
 ]
 
@@ -1,9 +1,35 @@
-from django.http import JsonResponse
+import hmac
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse
 from django.views import View
 
+from vertrouwelijke_data_proxy import metrics
+from vertrouwelijke_data_proxy.files.cache import get_blob_cache
+
 
 class RootView(View):
     """Root page of the server."""
 
     def get(self, request, *args, **kwargs):
-        return JsonResponse({"status": "online"})
+        data = {"status": "online"}
+        if (blob_cache := get_blob_cache()) is not None:
+            data["blob_cache"] = blob_cache.stats
+        return JsonResponse(data)
+
+
+class MetricsView(View):
+    """Prometheus metrics, of all worker processes together.
+
+    The metrics are only served to requests with an ``X-Metrics-Token`` header that has
+    the ``METRICS_TOKEN``; without that setting, this page doesn't exist.
+    """
+
+    def get(self, request, *args, **kwargs):
+        token = request.headers.get("X-Metrics-Token", "")
+        if not settings.METRICS_TOKEN or not hmac.compare_digest(
+            token.encode(), settings.METRICS_TOKEN.encode()
+        ):
+            raise Http404()
+        content, content_type = metrics.generate()
+        return HttpResponse(content, content_type=content_type)
@@ -14,3 +14,14 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "vertrouwelijke_data_proxy.setti
 
 application = get_wsgi_application()
 application = WhiteNoise(application, root=settings.STATIC_ROOT)
+
+if settings.STARTUP_WARM_UP:
+    # Without lazy-apps, this runs in the uWSGI master before the workers are forked.
+    from vertrouwelijke_data_proxy.startup import warm_up
+
+    warm_up()
+
+if settings.AZURE_TOKEN_PREFETCH:
+    from vertrouwelijke_data_proxy.startup import prefetch_token
+
+    prefetch_token()